@@ -0,0 +1,491 @@
+# -*- coding: utf-8 -*-
+"""
+ArtistMatcher 的紧凑二进制画师索引 (artist_index.bin)。
+
+取代每次启动都要 json.load 的缩进版 artist_cache.json：索引按列存储
+(artist / trigger / url 字符串表 + count 整数数组)，通过 mmap 只读映射，
+启动时只需解码 trigger 一列供模糊匹配使用，其余字段按行懒解码。
+
+文件布局 (小端序):
+    头部     magic(8s) 格式版本(I) 段数(I)
+    段目录   每段: 名称(16s) 偏移(Q) 长度(Q)
+    段数据   8 字节对齐
+字符串列由两段组成: "<列>.str" 为以 NUL 分隔的 UTF-8 文本，"<列>.off" 为
+每行起始字节偏移 (uint32，共 n+1 个)。"meta" 段是 JSON (行数、数据来源指纹等)，
+其中 build_id 每次构建都不同，供依赖索引内容的缓存判断是否过期。
+
+模糊匹配与精确匹配都基于构建时算好的匹配键 (见 match_key: NFKC、假名转罗马字、
+小写、去括号转义、下划线与空格统一)。"match" 列是每行 trigger 的匹配键，查询时
+只需对查询本身做同样的规范化。精确匹配用的 "key.str"/"key.off" 为 trigger、artist
+以及 transliteration.json 中别名的去重匹配键，"key.row" 为每个键对应的行号，"key.hash" 是以 crc32 为散列、
+线性探测的开放寻址表 (槽位存 键序号+1，0 为空)，查找时直接在映射上探测。
+
+模糊匹配的预筛选用字符三元组倒排索引: 对每行 trigger 的匹配键按词排序后的
+文本 (见 gram_text，与 token_sort_ratio 的比较方式一致) 取首尾补空格的三元组，
+"gram.str"/"gram.off"/"gram.hash" 是三元组的散列表 (结构同 key)，"gram.post.off"
+为每个三元组在 "gram.post" 中的行号区间 (uint32，行号升序)，"gram.count" 为每行
+的三元组个数，用于按 Dice 系数给候选排序 (见 ArtistIndex.shortlist)。
+
+随机画师串按 count 加权抽样用 Vose 别名表: 对 ALIAS_TEMPERATURES 中的每个温度 T
+预先算好 "alias<T>.p" (每格接受概率，double) 与 "alias<T>.i" (别名行号，uint32)，
+每次抽样 O(1)。其它温度的别名表由调用方按需用 build_alias_table 构建。
+"""
+import contextlib
+import heapq
+import json
+import math
+import mmap
+import os
+import re
+import shutil
+import struct
+import sys
+import tempfile
+import time
+import unicodedata
+import uuid
+import zlib
+from array import array
+from collections import Counter
+from collections.abc import Sequence
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from transliteration import default_transliterator
+
+INDEX_MAGIC = b'ARTIDX\0\0'
+INDEX_FORMAT_VERSION = 6
+HEADER = struct.Struct('<8sII')
+SECTION_ENTRY = struct.Struct('<16sQQ')
+SECTION_ALIGNMENT = 8
+SPOOL_CHUNK_ROWS = 4096
+# Windows 上目标文件仍被其它插件进程映射时 os.replace 会失败，按该间隔重试，最多等这么久
+REPLACE_RETRY_SECONDS = 0.1
+REPLACE_TIMEOUT_SECONDS = 60.0
+COPY_CHUNK_BYTES = 1 << 20
+
+STRING_COLUMNS = ('artist', 'trigger', 'url', 'match')
+ALIAS_TEMPERATURES = (0.5, 1.0, 2.0)
+WHITESPACE_PATTERN = re.compile(r'\s+')
+
+
+def normalize_key(name: str) -> str:
+    """NFKC、小写、去掉括号转义、下划线与空格统一，使 trigger / artist 及其书写变体得到同一个键。"""
+    text = unicodedata.normalize('NFKC', str(name))
+    text = text.replace('\\(', '(').replace('\\)', ')').replace('_', ' ').lower()
+    return WHITESPACE_PATTERN.sub(' ', text).strip()
+
+
+def match_key(name: str) -> str:
+    """normalize_key 之前先做假名转写，使假名写法与罗马字 trigger 可以直接比较。"""
+    return normalize_key(default_transliterator()(unicodedata.normalize('NFKC', str(name))))
+
+
+def key_hash(key_bytes: bytes) -> int:
+    return zlib.crc32(key_bytes)
+
+
+def gram_text(name: str) -> str:
+    """匹配键按词排序，与 token_sort_ratio 比较的文本形状一致。"""
+    return ' '.join(sorted(match_key(name).split()))
+
+
+def trigrams(text: str) -> Set[str]:
+    padded = f' {text} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)} if text else set()
+
+
+def count_weights(counts: Sequence, temperature: float) -> List[float]:
+    """按 count 的温度加权: w ∝ count^(1/T)。T=1 与 count 成正比，T 越大越接近均匀，越小越偏向高 count。"""
+    logs = [math.log(max(count, 1)) for count in counts]
+    top = max(logs, default=0.0)
+    return [math.exp((value - top) / temperature) for value in logs]
+
+
+def build_alias_table(weights: Sequence[float]) -> Tuple[array, array]:
+    """Vose 别名法，返回 (prob, alias)；之后用 alias_draw 每次 O(1) 抽一行。"""
+    n = len(weights)
+    total = sum(weights)
+    prob = array('d', bytes(8 * n))
+    alias = array('I', bytes(4 * n))
+    scaled = [weight * n / total for weight in weights] if total > 0 else [1.0] * n
+    small = [i for i, p in enumerate(scaled) if p < 1.0]
+    large = [i for i, p in enumerate(scaled) if p >= 1.0]
+    while small and large:
+        less, more = small.pop(), large.pop()
+        prob[less] = scaled[less]
+        alias[less] = more
+        scaled[more] += scaled[less] - 1.0
+        (small if scaled[more] < 1.0 else large).append(more)
+    # 剩下的格子只受浮点误差影响，概率按 1 处理
+    for i in large + small:
+        prob[i] = 1.0
+        alias[i] = i
+    return prob, alias
+
+
+def alias_draw(rng, prob: Sequence[float], alias: Sequence[int]) -> int:
+    i = rng.randrange(len(prob))
+    return i if rng.random() < prob[i] else alias[i]
+
+
+def _alias_name(temperature: float) -> str:
+    return f'alias{temperature:g}'
+
+
+class IndexFormatError(Exception):
+    """索引文件缺失、损坏或版本不符，需要重建。"""
+
+
+def _aligned(offset: int) -> int:
+    return (offset + SECTION_ALIGNMENT - 1) // SECTION_ALIGNMENT * SECTION_ALIGNMENT
+
+
+def _typed_bytes(values: array) -> bytes:
+    if sys.byteorder != 'little':
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def _typed_view(buffer: memoryview, typecode: str) -> Sequence:
+    if sys.byteorder == 'little':
+        return buffer.cast(typecode)
+    values = array(typecode, buffer.tobytes())
+    values.byteswap()
+    return values
+
+
+def _string_sections(name: str, values: List[bytes]) -> Dict[str, bytes]:
+    offsets = array('I', [0])
+    for value in values:
+        offsets.append(offsets[-1] + len(value) + 1)
+    return {f'{name}.str': b'\0'.join(values) + b'\0' if values else b'', f'{name}.off': _typed_bytes(offsets)}
+
+
+def _hash_sections(name: str, key_list: List[bytes]) -> Dict[str, bytes]:
+    """键 -> 键序号 的开放寻址散列表 ("<name>.str"/"<name>.off"/"<name>.hash")。"""
+    size = 1
+    while size < 2 * max(1, len(key_list)):
+        size *= 2
+    slots = array('I', bytes(4 * size))
+    for position, key in enumerate(key_list):
+        slot = key_hash(key) & (size - 1)
+        while slots[slot]:
+            slot = (slot + 1) & (size - 1)
+        slots[slot] = position + 1
+    sections = _string_sections(name, key_list)
+    sections[f'{name}.hash'] = _typed_bytes(slots)
+    return sections
+
+
+def _gram_sections(postings: Dict[bytes, array], gram_counts: array) -> Dict[str, bytes]:
+    offsets = array('I', [0])
+    rows = array('I')
+    for row_list in postings.values():
+        rows.extend(row_list)
+        offsets.append(len(rows))
+    sections = _hash_sections('gram', list(postings))
+    sections['gram.post.off'] = _typed_bytes(offsets)
+    sections['gram.post'] = _typed_bytes(rows)
+    sections['gram.count'] = _typed_bytes(gram_counts)
+    return sections
+
+
+class _StringSpool:
+    """构建时的字符串列: 内容按块追加到临时文件，内存中只保留每行的偏移。"""
+
+    def __init__(self):
+        self.file = tempfile.TemporaryFile()
+        self.offsets = array('I', [0])
+        self._pending: List[bytes] = []
+
+    def append(self, value: bytes) -> None:
+        self.offsets.append(self.offsets[-1] + len(value) + 1)
+        self._pending.append(value)
+        if len(self._pending) >= SPOOL_CHUNK_ROWS:
+            self.flush()
+
+    def flush(self) -> None:
+        if self._pending:
+            self.file.write(b'\0'.join(self._pending) + b'\0')
+            self._pending.clear()
+
+
+def _section_length(data) -> int:
+    return len(data) if isinstance(data, bytes) else data.seek(0, os.SEEK_END)
+
+
+def _write_sections(f, sections: Dict[str, Any]) -> None:
+    offset = _aligned(HEADER.size + SECTION_ENTRY.size * len(sections))
+    directory = []
+    for name, data in sections.items():
+        length = _section_length(data)
+        directory.append((name, offset, length))
+        offset = _aligned(offset + length)
+
+    f.write(HEADER.pack(INDEX_MAGIC, INDEX_FORMAT_VERSION, len(sections)))
+    f.write(b''.join(SECTION_ENTRY.pack(name.encode('ascii'), offset, length)
+                     for name, offset, length in directory))
+    for (name, offset, _length), data in zip(directory, sections.values()):
+        f.seek(offset)
+        if isinstance(data, bytes):
+            f.write(data)
+        else:
+            data.seek(0)
+            shutil.copyfileobj(data, f, COPY_CHUNK_BYTES)
+
+
+def _replace_when_unmapped(source: str, target: str) -> None:
+    """os.replace；Windows 上旧索引仍被正在服务的请求映射时会 PermissionError，等它们退出后重试。"""
+    deadline = time.monotonic() + REPLACE_TIMEOUT_SECONDS
+    while True:
+        try:
+            os.replace(source, target)
+            return
+        except PermissionError:
+            if os.name != 'nt' or time.monotonic() >= deadline:
+                raise
+            time.sleep(REPLACE_RETRY_SECONDS)
+
+
+def write_index(path: str, rows: Iterable[Dict[str, Any]], meta: Dict[str, Any] = None) -> int:
+    """
+    把行 (含 artist/trigger/url/count 字段) 写成索引文件，返回行数。
+
+    行按流读取，字符串列分块写入临时文件，不会把整份数据留在内存里。索引先写到同目录
+    的临时文件，fsync 后用 os.replace 原子替换，并发的插件进程只会看到旧索引或完整的新索引。
+    """
+    spools = {column: _StringSpool() for column in STRING_COLUMNS}
+    counts = array('i')
+    keys: Dict[bytes, int] = {}
+    postings: Dict[bytes, array] = {}
+    gram_counts = array('I')
+    try:
+        for row in rows:
+            row_number = len(counts)
+            row = dict(row, match=match_key(row.get('trigger') or ''))
+            for column, spool in spools.items():
+                spool.append(str(row.get(column) or '').replace('\0', '').encode('utf-8'))
+            counts.append(int(row['count']))
+            # 同一个键出现在多行时保留 count 最高的一行
+            for name in (row.get('trigger'), row.get('artist')):
+                key = match_key(name or '').replace('\0', '').encode('utf-8')
+                if key and (key not in keys or counts[keys[key]] < counts[row_number]):
+                    keys[key] = row_number
+            grams = trigrams(' '.join(sorted(row['match'].replace('\0', '').split())))
+            gram_counts.append(len(grams))
+            for gram in grams:
+                encoded = gram.encode('utf-8')
+                if encoded not in postings:
+                    postings[encoded] = array('I')
+                postings[encoded].append(row_number)
+
+        # 别名只指向数据中存在的画师，且不覆盖数据本身的键
+        for alias, target in default_transliterator().aliases.items():
+            row_number = keys.get(match_key(target).encode('utf-8'))
+            if row_number is not None:
+                keys.setdefault(match_key(alias).encode('utf-8'), row_number)
+
+        sections: Dict[str, Any] = {}
+        for column, spool in spools.items():
+            spool.flush()
+            sections[f'{column}.str'] = spool.file
+            sections[f'{column}.off'] = _typed_bytes(spool.offsets)
+        sections['count'] = _typed_bytes(counts)
+        sections.update(_hash_sections('key', list(keys)))
+        sections['key.row'] = _typed_bytes(array('i', keys.values()))
+        sections.update(_gram_sections(postings, gram_counts))
+        for temperature in ALIAS_TEMPERATURES:
+            prob, alias = build_alias_table(count_weights(counts, temperature))
+            sections[f'{_alias_name(temperature)}.p'] = _typed_bytes(prob)
+            sections[f'{_alias_name(temperature)}.i'] = _typed_bytes(alias)
+        sections['meta'] = json.dumps(dict(meta or {}, rows=len(counts), build_id=uuid.uuid4().hex),
+                                      ensure_ascii=False).encode('utf-8')
+
+        fd, temp_path = tempfile.mkstemp(prefix=os.path.basename(path) + '.', suffix='.tmp',
+                                         dir=os.path.dirname(os.path.abspath(path)))
+        try:
+            # mkstemp 建出的文件权限为 0600，改回按 umask 的普通权限，其他用户运行的插件进程也能读取
+            umask = os.umask(0)
+            os.umask(umask)
+            os.chmod(temp_path, 0o666 & ~umask)
+            with os.fdopen(fd, 'wb') as f:
+                _write_sections(f, sections)
+                f.flush()
+                os.fsync(f.fileno())
+            _replace_when_unmapped(temp_path, path)
+        except BaseException:
+            with contextlib.suppress(OSError):
+                os.remove(temp_path)
+            raise
+    finally:
+        for spool in spools.values():
+            spool.file.close()
+    return len(counts)
+
+
+class ArtistIndex(Sequence):
+    """只读映射的画师索引；index[i] 返回与旧 JSON 缓存相同形状的行字典。"""
+
+    def __init__(self, path: str):
+        try:
+            with open(path, 'rb') as f:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError) as e:
+            raise IndexFormatError(f"无法打开索引文件 {path}: {e}")
+        self._views: List[memoryview] = []
+        try:
+            self._load()
+        except BaseException:
+            self.close()
+            raise
+
+    def _load(self) -> None:
+        buffer = self._track(memoryview(self._mmap))
+        if len(buffer) < HEADER.size:
+            raise IndexFormatError("索引文件已损坏 (头部不完整)。")
+        magic, version, section_count = HEADER.unpack_from(buffer, 0)
+        if magic != INDEX_MAGIC:
+            raise IndexFormatError("不是画师索引文件。")
+        if version != INDEX_FORMAT_VERSION:
+            raise IndexFormatError(f"索引格式版本 {version} 与当前版本 {INDEX_FORMAT_VERSION} 不符。")
+
+        self._sections: Dict[str, memoryview] = {}
+        for i in range(section_count):
+            raw_name, offset, length = SECTION_ENTRY.unpack_from(buffer, HEADER.size + i * SECTION_ENTRY.size)
+            if offset + length > len(buffer):
+                raise IndexFormatError("索引文件已损坏 (段越界)。")
+            self._sections[raw_name.rstrip(b'\0').decode('ascii')] = self._track(buffer[offset:offset + length])
+        try:
+            self.meta = json.loads(bytes(self._sections['meta']).decode('utf-8'))
+            self.counts = self._view('count', 'i')
+            self._offsets = {column: self._view(f'{column}.off', 'I')
+                             for column in STRING_COLUMNS + ('key', 'gram')}
+            self._key_rows = self._view('key.row', 'i')
+            self._slots = {name: self._view(f'{name}.hash', 'I') for name in ('key', 'gram')}
+            self._post_offsets = self._view('gram.post.off', 'I')
+            self._gram_counts = self._view('gram.count', 'I')
+        except (KeyError, ValueError, TypeError) as e:
+            raise IndexFormatError(f"索引文件已损坏: {e}")
+        if len(self.counts) != self.meta.get('rows'):
+            raise IndexFormatError("索引文件已损坏 (行数不一致)。")
+        self._columns: Dict[str, List[str]] = {}
+
+    def _track(self, view: memoryview) -> memoryview:
+        self._views.append(view)
+        return view
+
+    def _view(self, section: str, typecode: str) -> Sequence:
+        view = _typed_view(self._sections[section], typecode)
+        return self._track(view) if isinstance(view, memoryview) else view
+
+    def close(self) -> None:
+        """
+        释放映射上的全部视图并关闭 mmap，可重复调用。Windows 上仍被映射的文件不能被
+        os.replace 覆盖，重建索引前必须先关闭旧索引；关闭后不能再读取该索引。
+        """
+        views, self._views = getattr(self, '_views', []), []
+        for view in reversed(views):
+            view.release()
+        self._mmap.close()
+
+    def __enter__(self) -> 'ArtistIndex':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        return len(self.counts)
+
+    def string(self, column: str, i: int) -> str:
+        offsets = self._offsets[column]
+        return bytes(self._sections[f'{column}.str'][offsets[i]:offsets[i + 1] - 1]).decode('utf-8')
+
+    def _probe(self, name: str, key: bytes):
+        """在 "<name>.hash" 中查找键，返回键序号；没有时返回 None。"""
+        slots = self._slots[name]
+        mask = len(slots) - 1
+        slot = key_hash(key) & mask
+        offsets, blob = self._offsets[name], self._sections[f'{name}.str']
+        while True:
+            entry = slots[slot]
+            if not entry:
+                return None
+            if blob[offsets[entry - 1]:offsets[entry] - 1] == key:
+                return entry - 1
+            slot = (slot + 1) & mask
+
+    def lookup(self, name: str):
+        """按规范化键精确查找，返回行号；没有时返回 None。不做任何模糊打分。"""
+        position = self._probe('key', match_key(name).encode('utf-8'))
+        return None if position is None else self._key_rows[position]
+
+    def shortlist(self, name: str, limit: int) -> List[int]:
+        """
+        按三元组 Dice 系数 (2·共有三元组数 / 双方三元组数之和) 取最相似的至多 limit 行
+        (同分时取行号小的)，返回升序行号，供模糊打分器复核。有 numpy 时用 bincount 计数，否则用 Counter。
+        """
+        grams = trigrams(gram_text(name))
+        spans = []
+        for gram in grams:
+            position = self._probe('gram', gram.encode('utf-8'))
+            if position is not None:
+                spans.append((self._post_offsets[position], self._post_offsets[position + 1]))
+        if not spans or limit <= 0:
+            return []
+        postings = self._sections['gram.post']
+
+        try:
+            import numpy as np
+        except ImportError:
+            np = None
+        if np is not None:
+            hits = np.bincount(np.concatenate([np.frombuffer(postings[4 * start:4 * end], dtype='<u4')
+                                               for start, end in spans]), minlength=len(self))
+            rows = np.flatnonzero(hits)
+            if len(rows) > limit:
+                gram_counts = np.frombuffer(self._sections['gram.count'], dtype='<u4')[rows]
+                dice = hits[rows] / (gram_counts + len(grams))
+                kth = np.partition(dice, len(dice) - limit)[len(dice) - limit]
+                above = rows[dice > kth]
+                rows = np.sort(np.concatenate([above, rows[dice == kth][:limit - len(above)]]))
+            return rows.tolist()
+
+        view = _typed_view(postings, 'I')
+        hits = Counter()
+        for start, end in spans:
+            hits.update(view[start:end])
+        if len(hits) <= limit:
+            return sorted(hits)
+        gram_counts = self._gram_counts
+        return sorted(heapq.nlargest(limit, hits, key=lambda row: (hits[row] / (gram_counts[row] + len(grams)), -row)))
+
+    def alias_table(self, temperature: float) -> Optional[Tuple[Sequence[float], Sequence[int]]]:
+        """预先算好的别名表 (prob, alias)；该温度没有预计算时返回 None。"""
+        name = _alias_name(temperature)
+        if f'{name}.p' not in self._sections:
+            return None
+        return self._view(f'{name}.p', 'd'), self._view(f'{name}.i', 'I')
+
+    def column(self, column: str) -> List[str]:
+        """整列解码为字符串列表 (一次 decode + split，结果缓存)。"""
+        if column not in self._columns:
+            blob = bytes(self._sections[f'{column}.str'])
+            self._columns[column] = blob[:-1].decode('utf-8').split('\0') if blob else []
+        return self._columns[column]
+
+    def __getitem__(self, i):
+        """不含 match 列，与旧 JSON 缓存的行形状相同。"""
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError('artist index out of range')
+        return {
+            'artist': self.string('artist', i),
+            'trigger': self.string('trigger', i),
+            'count': str(self.counts[i]),
+            'url': self.string('url', i),
+        }
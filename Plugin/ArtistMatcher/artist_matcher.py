@@ -2,76 +2,320 @@
 import sys
 import json
 import csv
+import hashlib
 import os
 import random
+import re
+import subprocess
+import time
+from bisect import bisect_left
 from rapidfuzz import process, fuzz
 
-# 全局变量缓存CSV数据
+from artist_index import (ArtistIndex, IndexFormatError, alias_draw, build_alias_table, count_weights, match_key,
+                          write_index)
+from query_cache import QueryCache
+from transliteration import default_transliterator
+
+# 全局变量缓存画师索引 (ArtistIndex，按行返回与旧 JSON 缓存相同的字典)
 ARTIST_DATA = None
 ARTIST_CHOICES = None
+# 本次请求沿用旧索引 (新索引仍在后台构建或构建失败) 时的说明，随结果一并返回
+INDEX_NOTE = None
+
+# 跨进程的查询结果缓存，绑定到当前索引的 build_id
+QUERY_CACHE = QueryCache.from_env()
+
+# 批量查询可选的打分函数
+SCORERS = {
+    'token_sort_ratio': fuzz.token_sort_ratio,
+    'token_set_ratio': fuzz.token_set_ratio,
+    'ratio': fuzz.ratio,
+    'partial_ratio': fuzz.partial_ratio,
+    'WRatio': fuzz.WRatio,
+    'QRatio': fuzz.QRatio,
+}
+DEFAULT_TOP_K = 3
+MAX_TOP_K = 20
+MAX_BATCH_NAMES = 50
+NAME_SEPARATOR_PATTERN = re.compile(r'[\n,，、;；]+')
+
+# 模糊匹配模式 (ARTIST_MATCH_MODE): exhaustive 对全部画师打分；indexed 先用三元组倒排索引
+# 取 ARTIST_INDEX_SHORTLIST 个候选再打分，候选中达到阈值的结果不足所需个数 (find_best_match 为 1，
+# find_top_matches 为 top_k) 时退回全量打分；够数时候选之外更相似的画师仍可能被漏掉，召回是尽力而为的；
+# auto 在画师数超过 ARTIST_INDEX_AUTO_ROWS 时使用 indexed。
+MATCH_MODES = ('auto', 'exhaustive', 'indexed')
+DEFAULT_SHORTLIST_SIZE = 2000
+DEFAULT_AUTO_INDEX_ROWS = 100000
+
+# 只收录 count 大于该值的画师 (ARTIST_MIN_COUNT)。artist_cache.json 本身只含 count > 100 的画师，
+# 设为更低的值需要 danbooru_artist.csv
+DEFAULT_MIN_COUNT = 100
+
+# 索引在分离的后台进程中重建 (大数据源的构建可能超过宿主的超时)。请求最多等待 ARTIST_INDEX_BUILD_WAIT_MS，
+# 之后沿用旧索引，没有旧索引时返回"正在构建"的错误；构建锁超过 BUILD_LOCK_STALE_SECONDS 仍在时视为构建进程已被杀死
+DEFAULT_BUILD_WAIT_MS = 6000
+BUILD_LOCK_STALE_SECONDS = 600
+BUILD_POLL_SECONDS = 0.05
+BUILD_LOG_NAME = 'artist_index.build.log'
+
+# 随机画师串: 按 count^(1/温度) 加权抽样 (ARTIST_RANDOM_TEMPERATURE)
+DEFAULT_RANDOM_TEMPERATURE = 1.0
+MAX_RANDOM_TEMPERATURE = 100.0
+MAX_RANDOM_STRINGS = 50
+MAX_DRAWS_PER_ARTIST = 200
+# 索引中没有预计算的温度，在本进程内构建一次后复用
+ALIAS_TABLES = {}
+
+def env_int(name, default, minimum=1):
+    value = os.environ.get(name, '').strip()
+    try:
+        return max(minimum, int(value)) if value else default
+    except ValueError:
+        raise ValueError(f"配置项 {name} 必须是整数，当前为: {value}")
+
+def env_float(name, default):
+    value = os.environ.get(name, '').strip()
+    try:
+        return float(value) if value else default
+    except ValueError:
+        raise ValueError(f"配置项 {name} 必须是数字，当前为: {value}")
+
+def source_path(script_dir):
+    """
+    重建索引的数据来源：优先使用原始 danbooru_artist.csv，没有 CSV 时退回旧版 artist_cache.json。
+    artist_cache.json 已按 count > 100 过滤过，ARTIST_MIN_COUNT 低于 100 时只有 CSV 才能收录更多画师。
+    """
+    for name in ('danbooru_artist.csv', 'artist_cache.json'):
+        path = os.path.join(script_dir, name)
+        if os.path.exists(path):
+            return path
+    return None
+
+def count_above(row, min_count):
+    count_str = str(row.get('count', '0')).strip()
+    return count_str.isdigit() and int(count_str) > min_count
+
+def require_source_path(script_dir):
+    path = source_path(script_dir)
+    if path is None:
+        raise FileNotFoundError(f"错误：原始数据文件未找到，路径：{os.path.join(script_dir, 'danbooru_artist.csv')}")
+    return path
+
+def iter_source_rows(script_dir, min_count=DEFAULT_MIN_COUNT):
+    """逐行读取数据来源，只保留 count > min_count 的画师。"""
+    path = require_source_path(script_dir)
+    if path.endswith('.csv'):
+        with open(path, mode='r', encoding='utf-8', errors='replace') as infile:
+            yield from (row for row in csv.DictReader(infile) if count_above(row, min_count))
+    else:
+        with open(path, 'r', encoding='utf-8') as f:
+            yield from (row for row in json.load(f) if count_above(row, min_count))
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def source_fingerprint(path, min_count, with_digest=True):
+    stat = os.stat(path)
+    fingerprint = {
+        'file': os.path.basename(path),
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+        'min_count': min_count,
+    }
+    if with_digest:
+        fingerprint['sha256'] = file_digest(path)
+    return fingerprint
+
+def index_is_current(meta, path, min_count):
+    """
+    索引是否由当前数据来源构建：文件名、阈值与转写表必须一致；大小与修改时间都没变时直接
+    认为有效，否则大小相同再比较内容 sha256 (只是被 touch 过的文件不必重建)。
+    没有数据来源文件时只要阈值一致就沿用现有索引 (阈值不同则需要数据来源重建)。
+    """
+    built = meta.get('source') or {}
+    if path is None:
+        return built.get('min_count', min_count) == min_count
+    if meta.get('transliteration') != default_transliterator().digest:
+        return False
+    current = source_fingerprint(path, min_count, with_digest=False)
+    if any(built.get(field) != current[field] for field in ('file', 'size', 'min_count')):
+        return False
+    return built.get('mtime_ns') == current['mtime_ns'] or built.get('sha256') == file_digest(path)
+
+def build_lock_path(index_path):
+    return index_path + '.building'
+
+def acquire_build_lock(lock_path):
+    """原子地创建构建锁；已有未过期的锁 (另一个构建正在进行) 时返回 False。"""
+    for _ in range(2):
+        try:
+            fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            try:
+                if time.time() - os.path.getmtime(lock_path) < BUILD_LOCK_STALE_SECONDS:
+                    return False
+                os.remove(lock_path)
+            except FileNotFoundError:
+                pass
+            continue
+        with os.fdopen(fd, 'w') as f:
+            f.write(f"{os.getpid()}\n")
+        return True
+    return False
+
+def start_background_build(script_dir, index_path):
+    """
+    在分离的子进程 (artist_matcher.py --build-index) 中重建索引，已有构建在进行时什么也不做。
+    子进程脱离宿主的进程组，请求超时被杀死时构建仍会完成；它的错误输出追加到 artist_index.build.log。
+    """
+    lock_path = build_lock_path(index_path)
+    if not acquire_build_lock(lock_path):
+        return
+    if os.name == 'nt':
+        detach = {'creationflags': subprocess.DETACHED_PROCESS | subprocess.CREATE_NEW_PROCESS_GROUP}
+    else:
+        detach = {'start_new_session': True}
+    try:
+        with open(os.path.join(script_dir, BUILD_LOG_NAME), 'ab') as log:
+            subprocess.Popen([sys.executable, os.path.abspath(__file__), '--build-index'], cwd=script_dir,
+                             stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=log, close_fds=True, **detach)
+    except BaseException:
+        os.remove(lock_path)
+        raise
+
+def wait_for_build(index_path, seconds):
+    """等待后台构建结束 (构建锁消失)，最多 seconds 秒；返回构建是否已结束。"""
+    deadline = time.monotonic() + seconds
+    while os.path.exists(build_lock_path(index_path)):
+        if time.monotonic() >= deadline:
+            return False
+        time.sleep(BUILD_POLL_SECONDS)
+    return True
+
+def build_index(script_dir, index_path):
+    """重建索引 (--build-index 子进程的入口)，结束后释放构建锁。"""
+    try:
+        min_count = env_int('ARTIST_MIN_COUNT', DEFAULT_MIN_COUNT, minimum=0)
+        path = require_source_path(script_dir)
+        # 指纹在读取数据之前取得：构建期间 CSV 再次变化时，下次请求会再重建
+        meta = {'source': source_fingerprint(path, min_count),
+                'transliteration': default_transliterator().digest}
+        write_index(index_path, iter_source_rows(script_dir, min_count), meta)
+    finally:
+        try:
+            os.remove(build_lock_path(index_path))
+        except FileNotFoundError:
+            pass
+
+def open_index(index_path, path, min_count):
+    """打开索引，返回 (索引, 是否由当前数据来源构建)；索引不存在或格式过期时为 (None, False)。"""
+    try:
+        index = ArtistIndex(index_path)
+    except IndexFormatError:
+        return None, False
+    return index, index_is_current(index.meta, path, min_count)
 
 def load_artist_data():
     """
-    加载艺术家数据。优先从缓存加载，如果缓存不存在则创建缓存。
+    加载艺术家数据。优先映射二进制索引；索引不存在、格式过期或数据来源 (CSV) 已变化时在后台重建，
+    等待 ARTIST_INDEX_BUILD_WAIT_MS 仍未完成则沿用旧索引 (没有旧索引时报告正在构建)。
     """
-    global ARTIST_DATA, ARTIST_CHOICES
+    global ARTIST_DATA, ARTIST_CHOICES, INDEX_NOTE
     if ARTIST_DATA is not None:
         return
 
-    script_dir = os.path.dirname(__file__)
-    cache_path = os.path.join(script_dir, 'artist_cache.json')
-    
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    index_path = os.path.join(script_dir, 'artist_index.bin')
+    min_count = env_int('ARTIST_MIN_COUNT', DEFAULT_MIN_COUNT, minimum=0)
+    wait_seconds = env_int('ARTIST_INDEX_BUILD_WAIT_MS', DEFAULT_BUILD_WAIT_MS, minimum=0) / 1000
+
     try:
-        # 优先从缓存加载
-        if os.path.exists(cache_path):
-            with open(cache_path, 'r', encoding='utf-8') as f:
-                ARTIST_DATA = json.load(f)
-        else:
-            # 如果缓存不存在，则从原始CSV创建
-            csv_path = os.path.join(script_dir, 'danbooru_artist.csv')
-            if not os.path.exists(csv_path):
-                raise FileNotFoundError(f"错误：原始数据文件未找到，路径：{csv_path}")
-
-            temp_data = []
-            with open(csv_path, mode='r', encoding='utf-8', errors='replace') as infile:
-                reader = csv.DictReader(infile)
-                for row in reader:
-                    # 筛选 count > 100 的画师
-                    count_str = row.get('count', '0')
-                    if count_str.isdigit() and int(count_str) > 100:
-                        temp_data.append(row)
-            
-            ARTIST_DATA = temp_data
-            # 将筛选后的数据写入缓存
-            with open(cache_path, 'w', encoding='utf-8') as f:
-                json.dump(ARTIST_DATA, f, ensure_ascii=False, indent=2)
+        path = source_path(script_dir)
+        ARTIST_DATA, current = open_index(index_path, path, min_count)
+        if not current:
+            if path is None: # 没有数据来源时无法重建
+                require_source_path(script_dir)
+            if ARTIST_DATA is not None: # Windows 上仍被映射的文件不能被 os.replace 覆盖，等待期间先关闭旧索引
+                ARTIST_DATA.close()
+                ARTIST_DATA = None
+            start_background_build(script_dir, index_path)
+            finished = wait_for_build(index_path, wait_seconds)
+            ARTIST_DATA, current = open_index(index_path, path, min_count)
+            if not current:
+                if finished:
+                    status = f"后台构建画师索引失败，详见 {BUILD_LOG_NAME}"
+                else:
+                    status = "画师索引正在后台构建，请稍后重试"
+                if ARTIST_DATA is None:
+                    raise RuntimeError(status + "。")
+                INDEX_NOTE = f"{status}；本次结果来自旧索引。"
 
-        # 为模糊搜索准备选择列表
-        ARTIST_CHOICES = [row['trigger'] for row in ARTIST_DATA]
+        # 为模糊搜索准备选择列表 (每行 trigger 的匹配键，构建索引时已算好)
+        ARTIST_CHOICES = ARTIST_DATA.column('match')
+        QUERY_CACHE.bind(ARTIST_DATA.meta.get('build_id') or '')
 
     except Exception as e:
+        if ARTIST_DATA is not None:
+            ARTIST_DATA.close()
+        ARTIST_DATA = None
         raise RuntimeError(f"加载或创建艺术家数据缓存时出错: {e}")
 
+def resolve_match_mode(mode=None):
+    """返回实际使用的匹配模式 ('exhaustive' 或 'indexed')。mode 为空时读取 ARTIST_MATCH_MODE。"""
+    mode = (mode or os.environ.get('ARTIST_MATCH_MODE') or 'auto').strip().lower()
+    if mode not in MATCH_MODES:
+        raise ValueError(f"未知的匹配模式 '{mode}'，可选: {', '.join(MATCH_MODES)}")
+    if mode == 'auto':
+        return 'indexed' if len(ARTIST_DATA) > env_int('ARTIST_INDEX_AUTO_ROWS', DEFAULT_AUTO_INDEX_ROWS) else 'exhaustive'
+    return mode
+
+def match_signature():
+    """影响匹配结果的配置 (匹配模式与候选数)，作为缓存键的一部分。"""
+    if resolve_match_mode() == 'indexed':
+        return f"indexed:{env_int('ARTIST_INDEX_SHORTLIST', DEFAULT_SHORTLIST_SIZE)}"
+    return 'exhaustive'
+
+def shortlist_rows(names):
+    """各名字的三元组候选行号的并集 (升序)。"""
+    size = env_int('ARTIST_INDEX_SHORTLIST', DEFAULT_SHORTLIST_SIZE)
+    rows = set()
+    for name in names:
+        rows.update(ARTIST_DATA.shortlist(name, size))
+    return sorted(rows)
 
-def find_best_match(query_name, score_cutoff=75):
+def find_best_match(query_name, score_cutoff=75, mode=None):
     """
     在缓存的数据中查找最佳匹配项。
     """
     if ARTIST_CHOICES is None:
         load_artist_data()
 
-    match = process.extractOne(query_name, ARTIST_CHOICES, scorer=fuzz.token_sort_ratio, score_cutoff=score_cutoff)
+    # 精确命中 (大小写、下划线/空格、括号转义不同也算) 直接查散列索引，不做模糊打分
+    row = ARTIST_DATA.lookup(query_name)
+    if row is not None:
+        return ARTIST_DATA[row], 100.0
+
+    # 查询与 ARTIST_CHOICES 一样取匹配键 (假名转写、大小写/下划线/括号转义统一)
+    query = match_key(query_name)
+    if resolve_match_mode(mode) == 'indexed':
+        rows = shortlist_rows([query])
+        match = process.extractOne(query, [ARTIST_CHOICES[i] for i in rows],
+                                   scorer=fuzz.token_sort_ratio, score_cutoff=score_cutoff)
+        if match:
+            return ARTIST_DATA[rows[match[2]]], match[1]
+
+    # 候选中没有达到阈值的结果时全量打分，保证"未找到"不是预筛选漏掉的 (找到时不保证是全局最佳)
+    match = process.extractOne(query, ARTIST_CHOICES, scorer=fuzz.token_sort_ratio, score_cutoff=score_cutoff)
 
     if not match:
         return None
 
-    best_trigger, score, _ = match
-    
-    for artist in ARTIST_DATA:
-        if artist['trigger'] == best_trigger:
-            return artist, score
-    
-    return None
+    _best_trigger, score, row = match
+    return ARTIST_DATA[row], score
 
 def get_fitting_level(count_str):
     """
@@ -87,17 +331,252 @@ def get_fitting_level(count_str):
     except (ValueError, TypeError):
         return f"{count_str} (未知)"
 
-def get_random_artist_string():
+def parse_name_list(value):
+    """批量查询的名字列表：JSON 数组，或以换行/逗号/顿号/分号分隔的字符串。"""
+    if isinstance(value, str):
+        text = value.strip()
+        if text.startswith('['):
+            try:
+                value = json.loads(text)
+            except json.JSONDecodeError:
+                pass
+        if isinstance(value, str):
+            value = NAME_SEPARATOR_PATTERN.split(text)
+    if not isinstance(value, list):
+        raise ValueError("'artist_names' 必须是名字列表或以逗号/换行分隔的字符串。")
+    names = [str(name).strip() for name in value if str(name).strip()]
+    if not names:
+        raise ValueError("'artist_names' 中没有有效的画师名。")
+    if len(names) > MAX_BATCH_NAMES:
+        raise ValueError(f"一次最多查询 {MAX_BATCH_NAMES} 位画师，收到 {len(names)} 位。")
+    return names
+
+def parse_int_param(input_data, name, default, minimum, maximum=None):
+    value = input_data.get(name)
+    if value is None or value == '':
+        return default
+    try:
+        number = int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"参数 '{name}' 必须是整数，收到: {value}")
+    if number < minimum or (maximum is not None and number > maximum):
+        raise ValueError(f"参数 '{name}' 超出范围 [{minimum}, {maximum if maximum is not None else '∞'}]: {number}")
+    return number
+
+def parse_float_param(input_data, name, default, minimum, maximum):
+    """取值范围为 (minimum, maximum]。"""
+    value = input_data.get(name)
+    if value is None or value == '':
+        value = default
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"参数 '{name}' 必须是数字，收到: {value}")
+    if not minimum < number <= maximum:
+        raise ValueError(f"参数 '{name}' 超出范围 ({minimum}, {maximum}]: {number}")
+    return number
+
+def parse_bool_param(input_data, name, default):
+    value = input_data.get(name)
+    if value is None or value == '':
+        return default
+    if isinstance(value, bool):
+        return value
+    text = str(value).strip().lower()
+    if text in ('true', '1', 'yes', 'on'):
+        return True
+    if text in ('false', '0', 'no', 'off'):
+        return False
+    raise ValueError(f"参数 '{name}' 必须是 true 或 false，收到: {value}")
+
+def _top_k_scores(names, choices, scorer, score_cutoff, top_k, exact_positions):
     """
-    生成一个随机的、带权重的画师组合字符串。
+    每个名字得分最高的 top_k 个 (位置, 分数)，与第 k 名同分的也一并返回，由调用方按 count 决胜。
+    有 numpy 时用 process.cdist 一次算出整个分数矩阵 (多线程)；没有 numpy 时退回逐个
+    process.extract。精确命中记为 100 分。
     """
+    try:
+        import numpy as np
+    except ImportError:
+        np = None
+
+    results = []
+    if np is None:
+        for name, exact in zip(names, exact_positions):
+            found = {index: score for _choice, score, index in
+                     process.extract(name, choices, scorer=scorer, limit=None, score_cutoff=score_cutoff)}
+            if exact is not None:
+                found[exact] = 100.0
+            ranked = sorted(found.items(), key=lambda item: -item[1])
+            if len(ranked) > top_k:
+                ranked = [item for item in ranked if item[1] >= ranked[top_k - 1][1]]
+            results.append(ranked)
+        return results
+
+    matrix = process.cdist(names, choices, scorer=scorer, score_cutoff=score_cutoff, workers=-1)
+    k = min(top_k, len(choices))
+    for row, exact in zip(matrix, exact_positions):
+        if exact is not None:
+            row[exact] = 100
+        kth_score = max(float(-np.partition(-row, k - 1)[k - 1]), score_cutoff, 1e-9)
+        top = np.flatnonzero(row >= kth_score)
+        results.append([(int(i), float(row[i])) for i in top])
+    return results
+
+def _score_rows(names, rows, scorer, score_cutoff, top_k):
+    """对 rows (升序行号；None 表示全部画师) 打分，返回每个名字的 [(行号, 分数)]。"""
+    choices = ARTIST_CHOICES if rows is None else [ARTIST_CHOICES[i] for i in rows]
+    if not choices:
+        return [[] for _ in names]
+
+    exact_positions = []
+    for name in names:
+        row = ARTIST_DATA.lookup(name)
+        if row is not None and rows is not None:
+            position = bisect_left(rows, row)
+            row = position if position < len(rows) and rows[position] == row else None
+        exact_positions.append(row)
+
+    scored = _top_k_scores(names, choices, scorer, score_cutoff, top_k, exact_positions)
+    if rows is None:
+        return scored
+    return [[(rows[position], score) for position, score in items] for items in scored]
+
+def find_top_matches(names, top_k=DEFAULT_TOP_K, score_cutoff=75, min_count=0, scorer_name='token_sort_ratio',
+                     mode=None):
+    """
+    批量、top-k 查询。返回 [{"query", "candidates": [{artist, trigger, count, score, level}]}]，
+    候选按匹配度降序、同分按 count 降序排列。
+    """
+    if scorer_name not in SCORERS:
+        raise ValueError(f"未知的打分方式 '{scorer_name}'，可选: {', '.join(SCORERS)}")
     load_artist_data()
+    scorer = SCORERS[scorer_name]
 
-    if not ARTIST_DATA or len(ARTIST_DATA) < 6:
-        return {"status": "error", "error": "符合条件的优质画师数量不足，无法生成画师串。"}
+    counts = ARTIST_DATA.counts
+    eligible = None
+    if min_count > 0:
+        eligible = [i for i in range(len(counts)) if counts[i] >= min_count]
+
+    queries = [match_key(name) for name in names]
+    if resolve_match_mode(mode) == 'indexed':
+        rows = shortlist_rows(queries)
+        if eligible is not None:
+            rows = sorted(set(rows).intersection(eligible))
+        results = _score_rows(queries, rows, scorer, score_cutoff, top_k)
+        # 候选中过线结果不足 top_k 个的名字退回全量打分，保证返回的候选数与 exhaustive 相同
+        missing = [i for i, items in enumerate(results) if len(items) < top_k]
+        if missing:
+            for i, items in zip(missing, _score_rows([queries[i] for i in missing], eligible, scorer,
+                                                     score_cutoff, top_k)):
+                results[i] = items
+    else:
+        results = _score_rows(queries, eligible, scorer, score_cutoff, top_k)
+
+    matches = []
+    for name, scored in zip(names, results):
+        candidates = []
+        for row, score in scored:
+            artist = ARTIST_DATA[row]
+            candidates.append({
+                "artist": artist['artist'],
+                "trigger": artist['trigger'],
+                "count": counts[row],
+                "score": round(score, 2),
+                "level": get_fitting_level(counts[row]),
+            })
+        candidates.sort(key=lambda c: (-c['score'], -c['count']))
+        matches.append({"query": name, "candidates": candidates[:top_k]})
+    return matches
+
+def cache_report(stats):
+    """响应中的缓存统计: 本次请求的命中/未命中数与缓存文件的累计数。缓存未启用时为 None。"""
+    totals = QUERY_CACHE.totals()
+    return dict(stats, **totals) if totals else None
+
+def find_artists_batch(input_data):
+    """
+    批量查询多个画师名，每个名字返回 top-k 候选及拟合度分级。各名字的结果分别缓存，
+    只有未命中的名字参与打分。
+    """
+    names = parse_name_list(input_data.get('artist_names'))
+    top_k = parse_int_param(input_data, 'top_k', DEFAULT_TOP_K, 1, MAX_TOP_K)
+    min_count = parse_int_param(input_data, 'min_count', 0, 0)
+    score_cutoff = parse_int_param(input_data, 'score_cutoff', 75, 0, 100)
+    scorer_name = str(input_data.get('scorer') or 'token_sort_ratio').strip()
+
+    if scorer_name not in SCORERS:
+        raise ValueError(f"未知的打分方式 '{scorer_name}'，可选: {', '.join(SCORERS)}")
+    load_artist_data()
+
+    signature = match_signature()
+    keys = [json.dumps(['top', match_key(name), scorer_name, score_cutoff, top_k, min_count, signature],
+                       ensure_ascii=False) for name in names]
+    cached = [QUERY_CACHE.get(key) for key in keys]
+    stats = {"hits": sum(1 for value in cached if value is not None)}
+    stats["misses"] = len(names) - stats["hits"]
+    missing = [i for i, value in enumerate(cached) if value is None]
+    if missing:
+        computed = find_top_matches([names[i] for i in missing], top_k, score_cutoff, min_count, scorer_name)
+        for i, match in zip(missing, computed):
+            cached[i] = match['candidates']
+            QUERY_CACHE.put(keys[i], match['candidates'])
+    matches = [{"query": name, "candidates": candidates} for name, candidates in zip(names, cached)]
+
+    lines = [
+        f"批量查询 {len(names)} 位画师的匹配结果 (打分: {scorer_name}，每位最多 {top_k} 个候选"
+        + (f"，拟合值 ≥ {min_count}" if min_count else "") + "):",
+        "----------------------------------------",
+    ]
+    for match in matches:
+        if not match['candidates']:
+            lines.append(f"「{match['query']}」: 未找到足够匹配的画师。")
+            continue
+        lines.append(f"「{match['query']}」:")
+        for rank, candidate in enumerate(match['candidates'], start=1):
+            lines.append(f"  {rank}. `{candidate['trigger']}` (Artist: `{candidate['artist']}`) "
+                         f"匹配度 {candidate['score']:g}% · 拟合值 {candidate['level']}")
+    lines += [
+        "----------------------------------------",
+        "**建议:** 每位画师优先使用匹配度最高的 **触发词 (Trigger)**；匹配度相近时选择拟合值更高的候选。",
+    ]
+    output = {"status": "success", "result": "\n".join(lines), "matches": matches}
+    report = cache_report(stats)
+    if report:
+        output["cache"] = report
+    return output
+
+def get_alias_table(temperature):
+    table = ARTIST_DATA.alias_table(temperature)
+    if table is None:
+        if temperature not in ALIAS_TABLES:
+            ALIAS_TABLES[temperature] = build_alias_table(count_weights(ARTIST_DATA.counts, temperature))
+        table = ALIAS_TABLES[temperature]
+    return table
+
+def draw_artist_rows(num_artists, alias_table, dedupe):
+    """
+    按别名表抽 num_artists 行 (每次 O(1))。dedupe 时同一个串里不出现规范化后相同的 trigger，
+    抽到重复的就重抽；温度过低、几乎只会抽到少数画师时报错而不是无限重试。
+    """
+    prob, alias = alias_table
+    rows = []
+    seen = set()
+    for _ in range(MAX_DRAWS_PER_ARTIST * num_artists):
+        row = alias_draw(random, prob, alias)
+        if dedupe:
+            key = ARTIST_CHOICES[row]
+            if key in seen:
+                continue
+            seen.add(key)
+        rows.append(row)
+        if len(rows) == num_artists:
+            return rows
+    raise ValueError("温度过低，抽样几乎只落在少数画师上，无法凑齐不重复的画师。请调高 temperature。")
 
+def build_random_artist_string(alias_table, dedupe):
     num_artists = random.randint(3, 6)
-    selected_artists = random.sample(ARTIST_DATA, num_artists)
+    selected_artists = [ARTIST_DATA[row] for row in draw_artist_rows(num_artists, alias_table, dedupe)]
 
     max_total_weight = 2 + (num_artists - 3) / 3.0
     
@@ -111,24 +590,66 @@ def get_random_artist_string():
     weights = [min(w, 0.9) for w in weights]
 
     artist_string_parts = [f"{artist['trigger']}:{weight:.2f}" for artist, weight in zip(selected_artists, weights)]
-    final_string = ", ".join(artist_string_parts)
-
-    result_text = (
-        f"✨ **随机画师串已生成 ({num_artists}位)** ✨\n"
-        f"----------------------------------------\n"
-        f"请将以下内容直接复制到你的提示词中，体验不同风格的融合：\n\n"
-        f"`{final_string}`\n\n"
-        f"----------------------------------------\n"
-        f"💡 **提示:** 你可以微调每个画师后面的权重值来改变其风格影响强度。"
-    )
+    return ", ".join(artist_string_parts), num_artists
+
+def get_random_artist_string(input_data=None):
+    """
+    生成随机的、带权重的画师组合字符串。画师按 count 加权抽取 (temperature 越低越偏向
+    高拟合值画师，越高越接近均匀)，num_strings 控制一次生成的串数。
+    """
+    input_data = input_data or {}
+    load_artist_data()
+
+    num_strings = parse_int_param(input_data, 'num_strings', 1, 1, MAX_RANDOM_STRINGS)
+    temperature = parse_float_param(input_data, 'temperature',
+                                    env_float('ARTIST_RANDOM_TEMPERATURE', DEFAULT_RANDOM_TEMPERATURE),
+                                    0, MAX_RANDOM_TEMPERATURE)
+    dedupe = parse_bool_param(input_data, 'dedupe', True)
+
+    if not ARTIST_DATA or len(ARTIST_DATA) < 6:
+        return {"status": "error", "error": "符合条件的优质画师数量不足，无法生成画师串。"}
+
+    alias_table = get_alias_table(temperature)
+    strings = [build_random_artist_string(alias_table, dedupe) for _ in range(num_strings)]
+
+    if num_strings == 1:
+        final_string, num_artists = strings[0]
+        result_text = (
+            f"✨ **随机画师串已生成 ({num_artists}位)** ✨\n"
+            f"----------------------------------------\n"
+            f"请将以下内容直接复制到你的提示词中，体验不同风格的融合：\n\n"
+            f"`{final_string}`\n\n"
+            f"----------------------------------------\n"
+            f"💡 **提示:** 你可以微调每个画师后面的权重值来改变其风格影响强度。"
+        )
+    else:
+        listing = "\n".join(f"{i}. `{final_string}`" for i, (final_string, _n) in enumerate(strings, start=1))
+        result_text = (
+            f"✨ **已生成 {num_strings} 组随机画师串** ✨\n"
+            f"----------------------------------------\n"
+            f"从下面挑选喜欢的一组，直接复制到你的提示词中：\n\n"
+            f"{listing}\n\n"
+            f"----------------------------------------\n"
+            f"💡 **提示:** 你可以微调每个画师后面的权重值来改变其风格影响强度。"
+        )
     
-    return {"status": "success", "result": result_text}
+    return {"status": "success", "result": result_text, "strings": [final_string for final_string, _n in strings]}
 
 def find_artist_by_name(artist_name):
     """
-    根据名称查找单个画师。
+    根据名称查找单个画师。结果按规范化后的名字缓存。
     """
-    match_result = find_best_match(artist_name)
+    load_artist_data()
+    key = json.dumps(['best', match_key(artist_name), 'token_sort_ratio', 75, match_signature()],
+                     ensure_ascii=False)
+    cached = QUERY_CACHE.get(key)
+    if cached is not None:
+        stats = {"hits": 1, "misses": 0}
+        match_result = cached['match']
+    else:
+        stats = {"hits": 0, "misses": 1}
+        match_result = find_best_match(artist_name)
+        QUERY_CACHE.put(key, {'match': match_result})
 
     if match_result:
         artist_info, score = match_result
@@ -143,12 +664,20 @@ def find_artist_by_name(artist_name):
             f"----------------------------------------\n"
             f"**建议:** 请使用 **触发词 (Trigger)** 作为你的主要artist tag以获得最佳效果。拟合值越高，模型对该画师风格的还原度通常越好。"
         )
-        return {"status": "success", "result": result_text}
     else:
         result_text = f"很抱歉，未能为「{artist_name}」找到足够匹配的画师。请尝试更常见的画师名或检查拼写。"
-        return {"status": "success", "result": result_text}
+
+    output = {"status": "success", "result": result_text}
+    report = cache_report(stats)
+    if report:
+        output["cache"] = report
+    return output
 
 def main():
+    if sys.argv[1:] == ['--build-index']:
+        script_dir = os.path.dirname(os.path.abspath(__file__))
+        build_index(script_dir, os.path.join(script_dir, 'artist_index.bin'))
+        return
     output = {}
     try:
         input_str = sys.stdin.readline()
@@ -167,8 +696,11 @@ def main():
                 raise ValueError("请求 'FindArtist' 命令时缺少 'artist_name' 参数。")
             output = find_artist_by_name(artist_name)
         
+        elif command == 'FindArtists':
+            output = find_artists_batch(input_data)
+
         elif command == 'GetRandomArtistString':
-            output = get_random_artist_string()
+            output = get_random_artist_string(input_data)
 
         else:
             # 为兼容旧版（不带command的调用），将其视为FindArtist
@@ -180,6 +712,8 @@ def main():
 
     except Exception as e:
         output = {"status": "error", "error": f"插件执行时发生错误: {str(e)}"}
+    if INDEX_NOTE and output.get("status") == "success":
+        output["index"] = INDEX_NOTE
     
     print(json.dumps(output, ensure_ascii=False))
     sys.stdout.flush()
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+"""
+ArtistMatcher 模糊匹配基准：比较全量打分 (exhaustive) 与三元组预筛选 (indexed)
+在不同数据规模下的单次查询延迟与召回。
+
+真实画师数据之外的行由真实 trigger 的词随机拼接、再加字符扰动合成，用来模拟完整
+Danbooru 画师表的规模。每个规模都在临时目录中重新构建索引 (同时记录构建耗时与
+索引大小)。查询为随机真实 trigger 加 1-2 处拼写错误，外加一部分不存在的名字；
+召回按 "indexed 的最佳得分与 exhaustive 相同" 统计。
+
+用法:
+  python benchmark_index.py [--sizes real,100000,400000] [--queries 200] [--shortlist 2000] [--output results.json]
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+PLUGIN_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, PLUGIN_DIR)
+
+import artist_matcher
+from artist_index import ArtistIndex, write_index
+
+ALPHABET = 'abcdefghijklmnopqrstuvwxyz'
+
+
+def misspell(rng, text):
+    chars = list(text)
+    for _ in range(rng.randint(1, 2)):
+        i = rng.randrange(len(chars))
+        op = rng.random()
+        if op < 0.4:
+            chars[i] = rng.choice(ALPHABET)
+        elif op < 0.7 and len(chars) > 3:
+            del chars[i]
+        else:
+            chars.insert(i, rng.choice('aeiou'))
+    return ''.join(chars)
+
+
+def synthetic_rows(rng, real_rows, size):
+    """在真实行之后补足到 size 行。"""
+    words = sorted({word for row in real_rows for word in row['trigger'].split()})
+    rows = list(real_rows)
+    seen = {row['trigger'] for row in rows}
+    while len(rows) < size:
+        trigger = misspell(rng, ' '.join(rng.choice(words) for _ in range(rng.randint(1, 3))))
+        if trigger in seen:
+            continue
+        seen.add(trigger)
+        rows.append({'artist': trigger.replace(' ', '_'), 'trigger': trigger, 'url': '',
+                     'count': rng.randint(1, 100)})
+    return rows
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def time_queries(queries, mode):
+    samples, results = [], []
+    for query in queries:
+        start = time.perf_counter()
+        match = artist_matcher.find_best_match(query, mode=mode)
+        samples.append((time.perf_counter() - start) * 1000)
+        results.append(match[1] if match else None)
+    return {
+        'median_ms': round(statistics.median(samples), 3),
+        'p95_ms': round(percentile(samples, 0.95), 3),
+    }, results
+
+
+def run_size(rng, real_rows, size, query_count, workdir, log=sys.stderr):
+    rows = synthetic_rows(rng, real_rows, size)
+    index_path = os.path.join(workdir, f'artist_index_{len(rows)}.bin')
+    start = time.perf_counter()
+    write_index(index_path, rows)
+    build_seconds = time.perf_counter() - start
+
+    index = ArtistIndex(index_path)
+    artist_matcher.ARTIST_DATA = index
+    artist_matcher.ARTIST_CHOICES = index.column('match')
+
+    queries = [misspell(rng, row['trigger']) for row in rng.sample(real_rows, query_count)]
+    queries += [misspell(rng, ''.join(rng.choice(ALPHABET) for _ in range(rng.randint(5, 14))))
+                for _ in range(max(1, query_count // 10))]
+    for query in queries[:5]: # 预热
+        artist_matcher.find_best_match(query, mode='indexed')
+
+    exhaustive, expected = time_queries(queries, 'exhaustive')
+    indexed, found = time_queries(queries, 'indexed')
+    recall = sum(1 for a, b in zip(expected, found) if a == b) / len(queries)
+    entry = {
+        'rows': len(rows),
+        'build_s': round(build_seconds, 2),
+        'index_mb': round(os.path.getsize(index_path) / 2 ** 20, 1),
+        'queries': len(queries),
+        'exhaustive': exhaustive,
+        'indexed': indexed,
+        'recall_at_1': round(recall, 4),
+    }
+    print(f"[{len(rows)} rows] exhaustive {exhaustive['median_ms']} ms, indexed {indexed['median_ms']} ms, "
+          f"recall {entry['recall_at_1']}", file=log, flush=True)
+    index.close()
+    artist_matcher.ARTIST_DATA = artist_matcher.ARTIST_CHOICES = None
+    os.remove(index_path)
+    return entry
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="ArtistMatcher exhaustive vs indexed benchmark")
+    parser.add_argument('--sizes', default='real,100000,200000,400000',
+                        help="comma-separated row counts; 'real' is the unmodified dataset")
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--shortlist', type=int, help="override ARTIST_INDEX_SHORTLIST")
+    parser.add_argument('--seed', type=int, default=20240601)
+    parser.add_argument('--output', help="results file (default: stdout)")
+    args = parser.parse_args(argv)
+
+    if args.shortlist:
+        os.environ['ARTIST_INDEX_SHORTLIST'] = str(args.shortlist)
+    real_rows = list(artist_matcher.iter_source_rows(PLUGIN_DIR))
+    sizes = [len(real_rows) if size.strip() == 'real' else int(size) for size in args.sizes.split(',')]
+
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for size in sizes:
+            results.append(run_size(random.Random(args.seed), real_rows, size, args.queries, workdir))
+
+    print(f"{'rows':>8} {'build s':>8} {'MB':>6} {'exh med':>9} {'exh p95':>9} {'idx med':>9} {'idx p95':>9} "
+          f"{'recall':>7}", file=sys.stderr)
+    for entry in results:
+        print(f"{entry['rows']:>8} {entry['build_s']:>8} {entry['index_mb']:>6} "
+              f"{entry['exhaustive']['median_ms']:>9} {entry['exhaustive']['p95_ms']:>9} "
+              f"{entry['indexed']['median_ms']:>9} {entry['indexed']['p95_ms']:>9} {entry['recall_at_1']:>7}",
+              file=sys.stderr)
+
+    text = json.dumps({
+        'shortlist': artist_matcher.env_int('ARTIST_INDEX_SHORTLIST', artist_matcher.DEFAULT_SHORTLIST_SIZE),
+        'seed': args.seed,
+        'results': results,
+    }, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+"""
+ArtistMatcher 的跨进程查询结果缓存 (SQLite，LRU 淘汰)。
+
+插件每次调用都是一个新进程，热门画师名会被反复查询；缓存命中时直接返回上次的
+匹配结果，不再做模糊打分。缓存绑定到画师索引的 build_id: 索引重建后第一次打开
+缓存时清空旧结果。累计命中/未命中次数也存在同一个文件里。
+
+只依赖标准库；任何 SQLite 错误都只会让缓存失效，不会影响查询本身。
+"""
+import json
+import os
+import sqlite3
+import time
+from typing import Any, Dict, Optional
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'query_cache.sqlite3')
+DEFAULT_MAX_ENTRIES = 5000
+
+
+class QueryCache:
+    """按条目数限制的持久化 LRU 缓存，值为可 JSON 序列化的查询结果。"""
+
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, max_entries: int = DEFAULT_MAX_ENTRIES,
+                 enabled: bool = True):
+        self.path = path
+        self.max_entries = max_entries
+        self.enabled = enabled
+        self.build_id: Optional[str] = None
+        self._conn: Optional[sqlite3.Connection] = None
+
+    @classmethod
+    def from_env(cls) -> 'QueryCache':
+        try:
+            max_entries = int(os.environ.get('ARTIST_QUERY_CACHE_MAX_ENTRIES') or DEFAULT_MAX_ENTRIES)
+        except ValueError:
+            max_entries = DEFAULT_MAX_ENTRIES
+        return cls(
+            path=os.environ.get('ARTIST_QUERY_CACHE_PATH') or DEFAULT_CACHE_PATH,
+            max_entries=max_entries,
+            enabled=os.environ.get('ARTIST_QUERY_CACHE', 'true').strip().lower() not in ('false', '0', 'off', 'no'),
+        )
+
+    def bind(self, build_id: str) -> None:
+        """指定当前画师索引的 build_id；与缓存记录的不一致时在首次访问时清空结果。"""
+        if build_id != self.build_id:
+            self.build_id = build_id
+            self._conn = None
+
+    def _connect(self) -> Optional[sqlite3.Connection]:
+        if not self.enabled or self.build_id is None:
+            return None
+        if self._conn is None:
+            try:
+                conn = sqlite3.connect(self.path, timeout=5)
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS results ("
+                    " key TEXT PRIMARY KEY, value TEXT NOT NULL, last_access REAL NOT NULL)"
+                )
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_results_last_access ON results(last_access)")
+                conn.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT NOT NULL)")
+                row = conn.execute("SELECT value FROM meta WHERE name = 'index_build'").fetchone()
+                if row is None or row[0] != self.build_id:
+                    conn.execute("DELETE FROM results")
+                    conn.execute("INSERT OR REPLACE INTO meta (name, value) VALUES ('index_build', ?)",
+                                 (self.build_id,))
+                conn.commit()
+                self._conn = conn
+            except sqlite3.Error:
+                self.enabled = False
+                return None
+        return self._conn
+
+    def _count(self, conn: sqlite3.Connection, name: str) -> None:
+        conn.execute("INSERT OR IGNORE INTO meta (name, value) VALUES (?, 0)", (name,))
+        conn.execute("UPDATE meta SET value = CAST(value AS INTEGER) + 1 WHERE name = ?", (name,))
+
+    def get(self, key: str) -> Optional[Any]:
+        """命中时返回缓存的值并刷新访问时间；未命中 (或缓存不可用) 返回 None。"""
+        conn = self._connect()
+        if conn is None:
+            return None
+        try:
+            row = conn.execute("SELECT value FROM results WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                conn.execute("UPDATE results SET last_access = ? WHERE key = ?", (time.time(), key))
+            self._count(conn, 'hits' if row is not None else 'misses')
+            conn.commit()
+            return json.loads(row[0]) if row is not None else None
+        except (sqlite3.Error, ValueError):
+            return None
+
+    def put(self, key: str, value: Any) -> None:
+        conn = self._connect()
+        if conn is None:
+            return
+        try:
+            conn.execute("INSERT OR REPLACE INTO results (key, value, last_access) VALUES (?, ?, ?)",
+                         (key, json.dumps(value, ensure_ascii=False), time.time()))
+            count = conn.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+            if count > self.max_entries:
+                conn.execute("DELETE FROM results WHERE key IN "
+                             "(SELECT key FROM results ORDER BY last_access ASC LIMIT ?)",
+                             (count - self.max_entries,))
+            conn.commit()
+        except (sqlite3.Error, TypeError, ValueError):
+            pass
+
+    def totals(self) -> Dict[str, int]:
+        """缓存文件记录的累计命中/未命中次数 (索引重建后不清零)。"""
+        conn = self._connect()
+        if conn is None:
+            return {}
+        try:
+            values = dict(conn.execute("SELECT name, value FROM meta WHERE name IN ('hits', 'misses')"))
+        except sqlite3.Error:
+            return {}
+        return {'total_hits': int(values.get('hits', 0)), 'total_misses': int(values.get('misses', 0))}
+
+    def clear(self) -> None:
+        conn = self._connect()
+        if conn is None:
+            return
+        try:
+            conn.execute("DELETE FROM results")
+            conn.commit()
+        except sqlite3.Error:
+            pass
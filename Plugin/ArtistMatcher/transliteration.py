@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""
+ArtistMatcher 的跨文字转写 (假名 -> 罗马字、别名)。
+
+表格放在 transliteration.json 里随插件分发 (文件缺失时转写为空操作)。构建索引时
+对每行 trigger 算一次转写后的匹配键，查询时只转写查询本身，不会对整份数据逐次转写。
+表的 sha256 记录在索引的 meta 中，表被修改后索引会自动重建。
+
+假名按赫本式转写: 片假名先转为平假名，按最长匹配 (两字符的拗音/外来音优先) 查表；
+促音 っ 重复下一个音节的首辅音 (ch 前写 t)，长音符 ー 重复前一个元音。
+"""
+import hashlib
+import json
+import os
+from typing import Dict, Optional
+
+DATA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'transliteration.json')
+
+KATAKANA_START, KATAKANA_END = 0x30A1, 0x30F6
+KATAKANA_OFFSET = 0x60
+SOKUON = 'っ'
+CHOONPU = 'ー'
+VOWELS = 'aeiou'
+
+
+class Transliterator:
+
+    def __init__(self, kana: Dict[str, str] = None, symbols: Dict[str, str] = None,
+                 aliases: Dict[str, str] = None, digest: str = ''):
+        self.kana = kana or {}
+        self.symbols = symbols or {}
+        self.aliases = aliases or {}
+        self.digest = digest
+
+    @classmethod
+    def load(cls, path: str = DATA_PATH) -> 'Transliterator':
+        if not os.path.exists(path):
+            return cls()
+        with open(path, 'rb') as f:
+            raw = f.read()
+        tables = json.loads(raw.decode('utf-8'))
+        return cls(tables.get('kana'), tables.get('symbols'), tables.get('aliases'),
+                   hashlib.sha256(raw).hexdigest())
+
+    def __call__(self, text: str) -> str:
+        if text.isascii() or not (self.kana or self.symbols):
+            return text
+        chars = [chr(ord(c) - KATAKANA_OFFSET) if KATAKANA_START <= ord(c) <= KATAKANA_END else c for c in text]
+        out = []
+        double_next = False
+        i = 0
+        while i < len(chars):
+            pair = ''.join(chars[i:i + 2])
+            if len(pair) == 2 and pair in self.kana:
+                romaji, i = self.kana[pair], i + 2
+            elif chars[i] in self.kana:
+                romaji, i = self.kana[chars[i]], i + 1
+            else:
+                c = chars[i]
+                i += 1
+                if c == SOKUON and self.kana:
+                    double_next = True
+                    continue
+                if c == CHOONPU and out and out[-1] and out[-1][-1] in VOWELS:
+                    out.append(out[-1][-1])
+                    continue
+                romaji = self.symbols.get(c, c)
+            if double_next:
+                double_next = False
+                if romaji[:1] and romaji[0] not in VOWELS and romaji[0] != 'n':
+                    romaji = ('t' if romaji.startswith('ch') else romaji[0]) + romaji
+            out.append(romaji)
+        return ''.join(out)
+
+
+_default: Optional[Transliterator] = None
+
+
+def default_transliterator() -> Transliterator:
+    global _default
+    if _default is None:
+        _default = Transliterator.load()
+    return _default
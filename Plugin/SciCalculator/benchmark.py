@@ -0,0 +1,260 @@
+"""
+SciCalculator 性能基准。
+
+对 benchmark_corpus.json 中的固定语料测量:
+  * 冷启动延迟: 每次启动一个新的 `python calculator.py` 进程 (与 Plugin.js 的调用方式相同)，
+    同时记录该进程的峰值 RSS；
+  * 热延迟: 在本进程中导入 calculator 后重复调用 evaluate()；
+两者都跳过结果缓存，测的是真实计算开销。结果写成 JSON，可以用 compare 子命令
+对比两次运行并按阈值判定性能回退。
+
+用法:
+  python benchmark.py run [--output results.json] [--cold-runs 3] [--warm-runs 5] [--only stats,arithmetic]
+  python benchmark.py compare old.json new.json [--threshold 0.2] [--min-delta-ms 5]
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+PLUGIN_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_CORPUS_PATH = os.path.join(PLUGIN_DIR, 'benchmark_corpus.json')
+CALCULATOR_PATH = os.path.join(PLUGIN_DIR, 'calculator.py')
+RESULT_PREVIEW_CHARS = 200
+
+
+def load_corpus(path: str) -> Dict[str, Any]:
+    with open(path, 'r', encoding='utf-8') as f:
+        corpus = json.load(f)
+    if not isinstance(corpus.get('version'), int) or not isinstance(corpus.get('cases'), list):
+        raise ValueError(f"Corpus '{path}' must have an integer 'version' and a 'cases' list.")
+    ids = [case['id'] for case in corpus['cases']]
+    if len(ids) != len(set(ids)):
+        raise ValueError(f"Corpus '{path}' has duplicate case ids.")
+    return corpus
+
+
+def expand_expression(case: Dict[str, Any]) -> str:
+    """`{values}` 展开为确定性的数字列表字面量 (长度为用例的 values 字段)。"""
+    expression = case['expression']
+    if 'values' in case:
+        values = [((i * 7919) % 1000) / 10 for i in range(int(case['values']))]
+        expression = expression.replace('{values}', '[' + ', '.join(repr(v) for v in values) + ']')
+    return expression
+
+
+def summarize(samples_ms: List[float]) -> Dict[str, float]:
+    ordered = sorted(samples_ms)
+    return {
+        'median_ms': round(statistics.median(ordered), 3),
+        'min_ms': round(ordered[0], 3),
+        'max_ms': round(ordered[-1], 3),
+    }
+
+
+def run_cold(expression: str) -> Dict[str, Any]:
+    """启动一个新进程计算表达式，返回耗时、峰值 RSS (KB，不支持时为 None) 与输出。"""
+    request = json.dumps({'expression': expression, 'no_cache': True})
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, CALCULATOR_PATH], cwd=PLUGIN_DIR, stdin=subprocess.PIPE,
+                               stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    process.stdin.write(request.encode('utf-8') + b'\n')
+    process.stdin.close()
+    stdout = process.stdout.read()
+    process.stdout.close()
+    peak_rss_kb = None
+    if hasattr(os, 'wait4'):
+        _pid, status, usage = os.wait4(process.pid, 0)
+        process.returncode = status # 已由 wait4 回收，避免 Popen 再次等待
+        peak_rss_kb = usage.ru_maxrss // 1024 if sys.platform == 'darwin' else usage.ru_maxrss
+    else:
+        process.wait()
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    try:
+        output = json.loads(stdout.decode('utf-8'))
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        output = {'status': 'error', 'error': f"Unparseable output: {stdout[:RESULT_PREVIEW_CHARS]!r}"}
+    return {'ms': elapsed_ms, 'peak_rss_kb': peak_rss_kb, 'output': output}
+
+
+def unwrap_result(text: str) -> str:
+    """去掉 build_output() 的 "###计算结果：...###" 包装，使冷/热结果可以直接比较。"""
+    prefix, suffix = '###计算结果：', '###，请将结果转告用户'
+    if text.startswith(prefix) and text.endswith(suffix):
+        return text[len(prefix):-len(suffix)]
+    return text
+
+
+def run_warm(calculator: Any, expression: str) -> Dict[str, Any]:
+    meta: Dict[str, Any] = {}
+    start = time.perf_counter()
+    result = calculator.evaluate(expression, meta, use_cache=False)
+    return {'ms': (time.perf_counter() - start) * 1000, 'result': str(result), 'meta': meta}
+
+
+def process_peak_rss_kb() -> Optional[int]:
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=PLUGIN_DIR, capture_output=True,
+                              text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def run_benchmark(corpus: Dict[str, Any], cold_runs: int, warm_runs: int,
+                  categories: Optional[List[str]] = None, log=sys.stderr) -> Dict[str, Any]:
+    cases = [case for case in corpus['cases'] if not categories or case['category'] in categories]
+    results: Dict[str, Any] = {}
+
+    for case in cases:
+        expression = expand_expression(case)
+        entry: Dict[str, Any] = {'category': case['category']}
+        if cold_runs > 0:
+            runs = [run_cold(expression) for _ in range(cold_runs)]
+            output = runs[-1]['output']
+            entry['cold'] = summarize([run['ms'] for run in runs])
+            rss_values = [run['peak_rss_kb'] for run in runs if run['peak_rss_kb'] is not None]
+            entry['cold']['peak_rss_kb'] = max(rss_values) if rss_values else None
+            entry['status'] = output.get('status')
+            entry['result'] = unwrap_result(str(output.get('result', output.get('error', ''))))[:RESULT_PREVIEW_CHARS]
+            entry['tier'] = output.get('tier')
+        results[case['id']] = entry
+        print(f"[cold] {case['id']}: {entry.get('cold', {}).get('median_ms', '-')} ms", file=log, flush=True)
+
+    warm_peak_rss_kb = None
+    if warm_runs > 0:
+        sys.path.insert(0, PLUGIN_DIR)
+        import calculator
+        for case in cases:
+            expression = expand_expression(case)
+            run_warm(calculator, expression) # 预热: 加载依赖、填充解析/编译缓存
+            runs = [run_warm(calculator, expression) for _ in range(warm_runs)]
+            entry = results[case['id']]
+            entry['warm'] = summarize([run['ms'] for run in runs])
+            entry.setdefault('result', runs[-1]['result'][:RESULT_PREVIEW_CHARS])
+            entry.setdefault('tier', runs[-1]['meta'].get('tier'))
+            print(f"[warm] {case['id']}: {entry['warm']['median_ms']} ms", file=log, flush=True)
+        warm_peak_rss_kb = process_peak_rss_kb()
+
+    return {
+        'corpus_version': corpus['version'],
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'git_revision': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cold_runs': cold_runs,
+        'warm_runs': warm_runs,
+        'warm_peak_rss_kb': warm_peak_rss_kb,
+        'cases': results,
+    }
+
+
+def compare_results(old: Dict[str, Any], new: Dict[str, Any], threshold: float,
+                    min_delta_ms: float) -> Dict[str, Any]:
+    """
+    对两次运行中共同的用例逐项比较中位数延迟与冷启动峰值 RSS。
+    新值超过旧值的 (1 + threshold) 倍且绝对差超过 min_delta_ms (RSS 为 1 MB) 时判为回退。
+    """
+    rows = []
+    regressions = []
+    for case_id, old_entry in old['cases'].items():
+        new_entry = new['cases'].get(case_id)
+        if new_entry is None:
+            continue
+        for mode in ('cold', 'warm'):
+            if mode not in old_entry or mode not in new_entry:
+                continue
+            for metric, min_delta in (('median_ms', min_delta_ms), ('peak_rss_kb', 1024)):
+                before, after = old_entry[mode].get(metric), new_entry[mode].get(metric)
+                if before is None or after is None:
+                    continue
+                ratio = after / before if before else float('inf')
+                regressed = ratio > 1 + threshold and after - before > min_delta
+                row = {'case': case_id, 'mode': mode, 'metric': metric, 'old': before, 'new': after,
+                       'ratio': round(ratio, 3), 'regressed': regressed}
+                rows.append(row)
+                if regressed:
+                    regressions.append(row)
+    changed_results = [case_id for case_id, old_entry in old['cases'].items()
+                       if case_id in new['cases'] and old_entry.get('result') != new['cases'][case_id].get('result')]
+    return {
+        'comparable': old.get('corpus_version') == new.get('corpus_version'),
+        'rows': rows,
+        'regressions': regressions,
+        'changed_results': changed_results,
+        'missing_cases': sorted(set(old['cases']) - set(new['cases'])),
+        'new_cases': sorted(set(new['cases']) - set(old['cases'])),
+    }
+
+
+def print_comparison(report: Dict[str, Any], out=sys.stdout) -> None:
+    if not report['comparable']:
+        print("Warning: corpus versions differ; only cases with the same id are compared.", file=out)
+    print(f"{'case':<28} {'mode':<5} {'metric':<12} {'old':>12} {'new':>12} {'ratio':>7}", file=out)
+    for row in report['rows']:
+        flag = '  REGRESSION' if row['regressed'] else ''
+        print(f"{row['case']:<28} {row['mode']:<5} {row['metric']:<12} {row['old']:>12} {row['new']:>12} "
+              f"{row['ratio']:>7}{flag}", file=out)
+    if report['changed_results']:
+        print(f"Results changed: {', '.join(report['changed_results'])}", file=out)
+    if report['missing_cases']:
+        print(f"Missing in new run: {', '.join(report['missing_cases'])}", file=out)
+    print(f"{len(report['regressions'])} regression(s).", file=out)
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="SciCalculator benchmark harness")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser('run', help="run the corpus and write results as JSON")
+    run_parser.add_argument('--corpus', default=DEFAULT_CORPUS_PATH)
+    run_parser.add_argument('--output', help="results file (default: stdout)")
+    run_parser.add_argument('--cold-runs', type=int, default=3)
+    run_parser.add_argument('--warm-runs', type=int, default=5)
+    run_parser.add_argument('--only', help="comma-separated categories to run")
+
+    compare_parser = subparsers.add_parser('compare', help="compare two results files")
+    compare_parser.add_argument('old')
+    compare_parser.add_argument('new')
+    compare_parser.add_argument('--threshold', type=float, default=0.2,
+                                help="relative slowdown counted as a regression (default 0.2 = 20%%)")
+    compare_parser.add_argument('--min-delta-ms', type=float, default=5.0,
+                                help="ignore slowdowns smaller than this many milliseconds")
+    args = parser.parse_args(argv)
+
+    if args.command == 'run':
+        corpus = load_corpus(args.corpus)
+        categories = [c.strip() for c in args.only.split(',')] if args.only else None
+        results = run_benchmark(corpus, args.cold_runs, args.warm_runs, categories)
+        text = json.dumps(results, indent=2, ensure_ascii=False)
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as f:
+                f.write(text + '\n')
+        else:
+            print(text)
+        return 0
+
+    with open(args.old, 'r', encoding='utf-8') as f:
+        old = json.load(f)
+    with open(args.new, 'r', encoding='utf-8') as f:
+        new = json.load(f)
+    report = compare_results(old, new, args.threshold, args.min_delta_ms)
+    print_comparison(report)
+    return 1 if report['regressions'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
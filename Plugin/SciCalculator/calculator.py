@@ -1,22 +1,187 @@
 import ast
+import functools
+import multiprocessing
+import multiprocessing.connection as mp_connection
 import operator
+import re
 import math
 import statistics
+import os
 import sys # 用于 stdin, stdout, stderr
+import time
+import warnings
 from typing import Union, Dict, Tuple, Any, List
 
-import sympy # 导入 sympy 模块本身
-# SymPy imports
-from sympy import (
-    sympify, Symbol, integrate, diff, sin, cos, tan, pi as sympy_pi,
-    atan, asin, acos, sqrt, exp as sympy_exp, log as sympy_log, E as sympy_E, Abs,
-    sinh, cosh, tanh, asinh, acosh, atanh, oo as sympy_inf,
-    Integral as SympyIntegral, I as sympy_I, zoo as sympy_zoo, nan as sympy_nan_symbol, # I, zoo, nan for checking
-    latex, Add, Mul, Pow, Integer, Float, Rational, Function, Number # Added Number
-)
-from scipy import stats
-from scipy.integrate import quad
-from numpy import inf as numpy_inf, nan as numpy_nan # For numerical integration with quad
+from result_cache import (ResultCache, integral_cache_key, multi_integral_cache_key, error_propagation_cache_key,
+                          monte_carlo_cache_key, solver_cache_key)
+
+# 重量级依赖 (sympy / scipy / numpy) 按需分层加载，纯算术只使用标准库。
+# 这些名字在对应的 _load_*_stack() 被调用前都是 None。
+np = None
+stats_engine = None
+diagnostics = None
+stats = None
+quad = nquad = None
+numpy_inf = numpy_nan = None
+sympy = None
+IntegrationWarning = None
+sympify = Symbol = integrate = diff = latex = None
+sympy_pi = sympy_exp = sympy_log = sympy_E = Abs = None
+sympy_inf = sympy_I = sympy_zoo = sympy_nan_symbol = SympyIntegral = None
+Add = Mul = Pow = Integer = Float = Rational = Function = Number = None
+
+# 计算层级: stdlib < numpy < scipy < sympy。响应中会报告实际服务该请求的层级。
+# 每个需要重量级依赖的函数在被调用时自行加载对应层级；若 sympy 层的调用
+# 全部命中磁盘缓存，则报告为 cache 层 (此时没有导入 sympy)。
+TIER_STDLIB = 'stdlib'
+TIER_NUMPY = 'numpy'
+TIER_SCIPY = 'scipy'
+TIER_SYMPY = 'sympy'
+TIER_CACHE = 'cache'
+_TIER_RANK = {TIER_STDLIB: 0, TIER_NUMPY: 1, TIER_SCIPY: 2, TIER_SYMPY: 3}
+
+# 需要更高层级依赖的函数名
+NUMPY_TIER_FUNCTIONS = {'linspace', 'arange', 'base64_data', 'file_data', 'percentile', 'histogram', 'correlation',
+                        'det', 'inv', 'eig', 'svd', 'matmul', 'norm', 'base64_matrix'}
+SCIPY_TIER_FUNCTIONS = {'norm_pdf', 'norm_cdf', 't_test', 'confidence_interval', 'solve_linear', 'lstsq'}
+SYMPY_TIER_FUNCTIONS = {'integral', 'integral2', 'integral3', 'nintegral', 'error_propagation', 'error_propagation_mc',
+                        'solve', 'nsolve', 'minimize', 'maximize', 'fit'}
+
+def _load_numpy() -> None:
+    global np, numpy_inf, numpy_nan
+    if np is not None:
+        return
+    import numpy as np
+    from numpy import inf as numpy_inf, nan as numpy_nan # For numerical integration with quad
+
+def _load_stats_engine() -> None:
+    global stats_engine
+    if stats_engine is not None:
+        return
+    _load_numpy()
+    import stats_engine
+
+def _load_diagnostics() -> None:
+    global diagnostics
+    if diagnostics is None:
+        import diagnostics
+
+def is_dataset(value: Any) -> bool:
+    return stats_engine is not None and isinstance(value, stats_engine.Dataset)
+
+def _load_scipy_stack() -> None:
+    global stats
+    if stats is not None:
+        return
+    _load_numpy()
+    from scipy import stats
+
+def _load_sympy_stack() -> None:
+    global sympy, sympify, Symbol, integrate, diff, latex, quad, nquad, IntegrationWarning
+    global sympy_pi, sympy_exp, sympy_log, sympy_E, Abs
+    global sympy_inf, sympy_I, sympy_zoo, sympy_nan_symbol, SympyIntegral
+    global Add, Mul, Pow, Integer, Float, Rational, Function, Number
+    if sympy is not None:
+        return
+    _load_scipy_stack()
+    import sympy # 导入 sympy 模块本身
+    from sympy import (
+        sympify, Symbol, integrate, diff, pi as sympy_pi,
+        exp as sympy_exp, log as sympy_log, E as sympy_E, Abs, oo as sympy_inf,
+        Integral as SympyIntegral, I as sympy_I, zoo as sympy_zoo, nan as sympy_nan_symbol, # I, zoo, nan for checking
+        latex, Add, Mul, Pow, Integer, Float, Rational, Function, Number # Added Number
+    )
+    from scipy.integrate import quad, nquad, IntegrationWarning
+
+    # 基础的 SymPy 符号和函数，用于符号计算
+    base_sympy_locals.update({
+        'sin': sympy.sin, 'cos': sympy.cos, 'tan': sympy.tan,
+        'asin': sympy.asin, 'acos': sympy.acos, 'atan': sympy.atan, 'atan2': sympy.atan2,
+        'arctan': sympy.atan, 'arcsin': sympy.asin, 'arccos': sympy.acos,
+        'sqrt': sympy.sqrt, 'exp': sympy_exp, 'E': sympy_E, 'log': sympy_log,
+        'abs': Abs, 'Abs': Abs,
+        'pi': sympy_pi, 'I': sympy_I, 'oo': sympy_inf, 'zoo': sympy_zoo, 'nan': sympy_nan_symbol,
+        'sinh': sympy.sinh, 'cosh': sympy.cosh, 'tanh': sympy.tanh,
+        'asinh': sympy.asinh, 'acosh': sympy.acosh, 'atanh': sympy.atanh,
+        'gamma': sympy.gamma, 'factorial': sympy.factorial,
+        'Min': sympy.Min, 'Max': sympy.Max,
+        'DiracDelta': sympy.DiracDelta, 'Heaviside': sympy.Heaviside,
+        'Symbol': Symbol, 'Integer': Integer, 'Float': Float, 'Rational': Rational, 'Function': Function,
+        'Add': Add, 'Mul': Mul, 'Pow': Pow, 'Number': Number
+    })
+
+def required_tier(tree: ast.AST) -> str:
+    """根据 AST 中实际出现的函数调用判断需要加载到哪一层依赖。"""
+    tier = TIER_STDLIB
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Name):
+            if node.func.id in SYMPY_TIER_FUNCTIONS:
+                return TIER_SYMPY
+            if node.func.id in SCIPY_TIER_FUNCTIONS:
+                tier = TIER_SCIPY
+            elif node.func.id in NUMPY_TIER_FUNCTIONS and tier == TIER_STDLIB:
+                tier = TIER_NUMPY
+    return tier
+
+def _norm_pdf(x, loc=0, scale=1):
+    _load_scipy_stack()
+    return stats.norm.pdf(x, loc=loc, scale=scale)
+
+def _norm_cdf(x, loc=0, scale=1):
+    _load_scipy_stack()
+    return stats.norm.cdf(x, loc=loc, scale=scale)
+
+def _t_test(data, mu):
+    _load_scipy_stack()
+    return stats.ttest_1samp(data, mu).pvalue
+
+def _env_seconds(name: str, default_ms: float) -> float:
+    """Read a millisecond setting from the environment and return it in seconds."""
+    try:
+        return float(os.environ.get(name, default_ms)) / 1000.0
+    except (TypeError, ValueError):
+        return default_ms / 1000.0
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(float(os.environ.get(name, default)))
+    except (TypeError, ValueError):
+        return default
+
+# 积分 / 误差传递结果的磁盘缓存
+RESULT_CACHE = ResultCache.from_env()
+# 受时间预算影响的结果 (数值结果抢先返回、符号计算超时) 会带上这些说明，换一个预算结果就可能不同，不缓存
+BUDGET_NOTE_KEYS = ('integration_note', 'solve_note')
+BUDGET_TIMEOUT_MARKER = 'did not finish within'
+
+def is_budget_limited(result: Any, call_info: Dict[str, Any]) -> bool:
+    return any(key in call_info for key in BUDGET_NOTE_KEYS) \
+        or (isinstance(result, str) and BUDGET_TIMEOUT_MARKER in result)
+
+def cached_call(cache_key: str, info: Dict[str, Any], use_cache: bool, compute) -> Any:
+    """
+    Serve `compute(call_info)` from RESULT_CACHE when possible.
+    Per-call details (e.g. integration_path) are stored with the value so a hit
+    reports the same metadata as the original computation.
+    """
+    if use_cache:
+        entry = RESULT_CACHE.get(cache_key)
+        if entry is not None:
+            info.setdefault('cache', []).append('hit')
+            for key, values in entry.items():
+                if key != 'value':
+                    info.setdefault(key, []).extend(values)
+            return entry['value']
+    call_info: Dict[str, Any] = {}
+    result = compute(call_info)
+    for key, values in call_info.items():
+        info.setdefault(key, []).extend(values)
+    if use_cache:
+        info.setdefault('cache', []).append('miss')
+        # 不缓存错误 (可能是瞬时问题) 与受时间预算影响的结果，只缓存真正的计算结果
+        if not (isinstance(result, str) and result.startswith("Error")) and not is_budget_limited(result, call_info):
+            RESULT_CACHE.put(cache_key, {'value': result, **call_info})
+    return result
 
 # 支持的操作符 (保持不变)
 allowed_operators = {
@@ -35,63 +200,656 @@ math_functions = {
     'log': math.log, 'exp': math.exp, 'abs': math.fabs, 'ceil': math.ceil,
     'floor': math.floor, 'mean': statistics.mean, 'median': statistics.median,
     'mode': statistics.mode, 'variance': statistics.variance, 'stdev': statistics.stdev,
-    'norm_pdf': stats.norm.pdf, 'norm_cdf': stats.norm.cdf,
-    't_test': lambda data, mu: stats.ttest_1samp(data, mu).pvalue,
+    'norm_pdf': _norm_pdf, 'norm_cdf': _norm_cdf, 't_test': _t_test,
 }
 
+# 数组 (numpy 广播) 语义下 math_functions 的逐元素版本，首次使用时由 _vectorized_math_functions() 构建
+_VECTORIZED_MATH_FUNCTIONS: Dict[str, Any] = {}
+
+# 单个数组允许的最大元素数，防止 linspace/arange 等耗尽内存
+MAX_ARRAY_SIZE = 1_000_000
+# 摘要输出时首尾各展示的元素数；不超过 2 倍该值的数组总是完整输出
+ARRAY_PREVIEW_ITEMS = 5
+# 不超过该维数的矩阵完整输出，更大的只显示四角
+MATRIX_PREVIEW_DIM = 10
+MATRIX_PREVIEW_ITEMS = 3
+# 超过该长度的统计输入改由 numpy 统计引擎处理 (更短的输入保持 statistics 的精确结果)
+STATS_ENGINE_MIN_SIZE = 10_000
+
+def _vectorized_math_functions() -> Dict[str, Any]:
+    _load_numpy()
+    if not _VECTORIZED_MATH_FUNCTIONS:
+        _VECTORIZED_MATH_FUNCTIONS.update({
+            'sin': np.sin, 'cos': np.cos, 'tan': np.tan, 'asin': np.arcsin,
+            'acos': np.arccos, 'atan': np.arctan, 'arctan': np.arctan, 'arcsin': np.arcsin,
+            'arccos': np.arccos, 'sinh': np.sinh, 'cosh': np.cosh, 'tanh': np.tanh,
+            'asinh': np.arcsinh, 'acosh': np.arccosh, 'atanh': np.arctanh,
+            'sqrt': np.sqrt, 'root': lambda x, n: np.power(x, 1 / np.asarray(n, dtype=float)),
+            'log': lambda x, base=None: np.log(x) if base is None else np.log(x) / np.log(base),
+            'exp': np.exp, 'abs': np.abs, 'ceil': np.ceil, 'floor': np.floor,
+        })
+    return _VECTORIZED_MATH_FUNCTIONS
+
+def to_array(value: Any) -> Any:
+    """Convert a (nested) numeric list or scalar to a float numpy array, enforcing MAX_ARRAY_SIZE."""
+    _load_numpy()
+    if is_dataset(value):
+        value = value.to_array()
+    try:
+        arr = np.asarray(value, dtype=float)
+    except (TypeError, ValueError):
+        try:
+            arr = np.asarray(value, dtype=complex)
+        except (TypeError, ValueError):
+            raise ValueError("Array operands must contain only numbers.")
+    if arr.size > MAX_ARRAY_SIZE:
+        raise ValueError(f"Array too large ({arr.size} elements, limit {MAX_ARRAY_SIZE}).")
+    return arr
+
+def format_scalar(value: Any) -> str:
+    formatted = f"{float(value):.10g}"
+    if '.' in formatted and 'e' not in formatted:
+        formatted = formatted.rstrip('0').rstrip('.')
+    return formatted
+
+def format_vector(values: Any) -> str:
+    return '[' + ', '.join(format_scalar(v) if np.isreal(v) else str(complex(v)) for v in values) + ']'
+
+def format_matrix(arr: Any, full: bool = False) -> str:
+    """Whole matrix when small (or requested), otherwise the corner rows/columns around '...'."""
+    rows, cols = arr.shape
+    if full or (rows <= MATRIX_PREVIEW_DIM and cols <= MATRIX_PREVIEW_DIM):
+        return '[' + ', '.join(format_vector(row) for row in arr) + ']'
+    n = MATRIX_PREVIEW_ITEMS
+
+    def format_row(row):
+        if cols <= 2 * n:
+            return format_vector(row)
+        return format_vector(row[:n])[:-1] + ', ..., ' + format_vector(row[-n:])[1:]
+
+    if rows > 2 * n:
+        shown = [format_row(row) for row in arr[:n]] + ['...'] + [format_row(row) for row in arr[-n:]]
+    else:
+        shown = [format_row(row) for row in arr]
+    return f"matrix(shape=({rows}, {cols})) [" + ', '.join(shown) + ']'
+
+def format_array(arr: Any, full: bool = False) -> str:
+    """Format an array result: full values for small arrays (or when requested), otherwise a compact summary."""
+    _fmt = format_vector
+
+    if arr.ndim == 2:
+        return format_matrix(arr, full)
+    flat = arr.ravel()
+    if full or arr.size <= 2 * ARRAY_PREVIEW_ITEMS:
+        if arr.ndim == 1:
+            return _fmt(flat)
+        return json.dumps(np.real_if_close(arr).tolist())
+    finite = flat[np.isfinite(flat)]
+    head = _fmt(flat[:ARRAY_PREVIEW_ITEMS])[:-1]
+    tail = _fmt(flat[-ARRAY_PREVIEW_ITEMS:])[1:]
+    summary = f"array(shape={tuple(arr.shape)}, size={arr.size}"
+    if finite.size and np.isrealobj(finite):
+        summary += (f", min={format_scalar(finite.min())}, max={format_scalar(finite.max())}"
+                    f", mean={format_scalar(finite.mean())}")
+    if finite.size < flat.size:
+        summary += f", non_finite={flat.size - finite.size}"
+    return f"{summary}) {head}, ..., {tail}"
+
+# 以列表为输入、保持 statistics/scipy 原有语义的函数
+_STATS_LIST_FUNCTIONS = {'mean', 'median', 'mode', 'variance', 'stdev', 't_test', 'confidence_interval'}
+# 只由 numpy 统计引擎提供的函数；数据集、大数组与超长列表也交给引擎处理
+STATS_ENGINE_FUNCTIONS = {'percentile', 'histogram', 'correlation'}
+
 # 支持的常数 (用于直接数值计算)
 constants = { 'pi': math.pi, 'e': math.e }
 
-# 基础的 SymPy 符号和函数，用于符号计算
-base_sympy_locals = {
-    'sin': sympy.sin, 'cos': sympy.cos, 'tan': sympy.tan,
-    'asin': sympy.asin, 'acos': sympy.acos, 'atan': sympy.atan, 'atan2': sympy.atan2,
-    'arctan': sympy.atan, 'arcsin': sympy.asin, 'arccos': sympy.acos,
-    'sqrt': sympy.sqrt, 'exp': sympy_exp, 'E': sympy_E, 'log': sympy_log, 
-    'abs': Abs, 'Abs': Abs, 
-    'pi': sympy_pi, 'I': sympy_I, 'oo': sympy_inf, 'zoo': sympy_zoo, 'nan': sympy_nan_symbol,
-    'sinh': sympy.sinh, 'cosh': sympy.cosh, 'tanh': sympy.tanh,
-    'asinh': sympy.asinh, 'acosh': sympy.acosh, 'atanh': sympy.atanh,
-    'gamma': sympy.gamma, 'factorial': sympy.factorial,
-    'Min': sympy.Min, 'Max': sympy.Max,
-    'DiracDelta': sympy.DiracDelta, 'Heaviside': sympy.Heaviside,
-    'Symbol': Symbol, 'Integer': Integer, 'Float': Float, 'Rational': Rational, 'Function': Function,
-    'Add': Add, 'Mul': Mul, 'Pow': Pow, 'Number': Number
-}
+# 基础的 SymPy 符号和函数，用于符号计算 (由 _load_sympy_stack() 填充)
+base_sympy_locals: Dict[str, Any] = {}
+
+@functools.lru_cache(maxsize=256)
+def cached_sympify(expr_str: str, symbol_names: Tuple[str, ...] = ()) -> Any:
+    """sympify() with base_sympy_locals plus the given free symbols; SymPy trees are immutable, so results are shared."""
+    _load_sympy_stack()
+    sympy_locals = base_sympy_locals.copy()
+    for name in symbol_names:
+        sympy_locals[name] = Symbol(name)
+    return sympify(expr_str, locals=sympy_locals)
+
+@functools.lru_cache(maxsize=256)
+def parse_expression(expr_str: str) -> ast.Expression:
+    return ast.parse(expr_str, mode='eval')
 
 def preprocess_expression_string(expr_str: str) -> str:
     expr_str = expr_str.replace('^', '**')
     return expr_str
 
+# scipy 提供 gamma 等特殊函数的向量化实现，否则 lambdify 会退回到只接受标量的 math 模块
+NUMERIC_LAMBDIFY_MODULES = ['numpy', 'scipy']
+
+def compile_numeric_integrand(expr: Any, var_symbol: Any, probe_points: Tuple[float, ...] = (0.5, 1.5, -0.5)):
+    """
+    Compile a SymPy expression once into a numpy callable for quad.
+    Mirrors the NaN/inf/complex handling of the per-point subs/evalf path:
+    complex values with a negligible imaginary part collapse to their real part,
+    everything else non-real becomes NaN. Returns None when the expression
+    cannot be compiled (e.g. functions with no numpy equivalent).
+    `var_symbol` may also be a sequence of symbols for multi-dimensional integrands.
+    """
+    var_symbols = list(var_symbol) if isinstance(var_symbol, (list, tuple)) else [var_symbol]
+    try:
+        compiled = sympy.lambdify(var_symbols, expr, modules=NUMERIC_LAMBDIFY_MODULES)
+    except Exception:
+        return None
+
+    def f_compiled(*x_vals_np: Any) -> Any:
+        with np.errstate(all='ignore'):
+            val = compiled(*x_vals_np)
+        if np.iscomplexobj(val):
+            val = np.where(np.abs(np.imag(val)) < 1e-9, np.real(val), numpy_nan)
+        shape = np.broadcast(*x_vals_np).shape
+        if not shape:
+            return float(val)
+        return np.broadcast_to(np.asarray(val, dtype=float), shape)
+
+    # A compiled function that references names numpy does not know about
+    # only fails when it is called, so probe it before trusting it.
+    for probe in probe_points:
+        try:
+            f_compiled(*([probe] * len(var_symbols)))
+        except (ZeroDivisionError, OverflowError, ValueError, FloatingPointError):
+            continue
+        except Exception:
+            return None
+    return f_compiled
+
+# --- 定积分的符号/数值竞速 ---
+# 符号积分 (sympy.integrate) 可能远超插件超时时间；定积分会同时在两个工作进程中
+# 分别尝试符号积分与数值 quad，预算内第一个可接受的结果胜出，另一个被终止。
+INTEGRAL_BUDGET_SECONDS = _env_seconds('SCICALC_INTEGRAL_BUDGET_MS', 10000)
+# 数值结果先到时，再给符号积分的宽限时间 (优先返回精确结果)
+INTEGRAL_SYMBOLIC_GRACE_SECONDS = _env_seconds('SCICALC_INTEGRAL_SYMBOLIC_GRACE_MS', 250)
+# 当前请求所有竞速共享的截止时间 (time.monotonic())，由 handle_request 设置：批量或一个表达式中的
+# 多个积分加起来也不超过一个预算，不会拖过宿主的超时。None 时每次竞速各自使用完整预算。
+REQUEST_DEADLINE = None
+
+def race_budget_seconds() -> float:
+    """本次竞速可用的时间：单个预算与当前请求剩余时间中较小者 (可能 <= 0)。"""
+    if REQUEST_DEADLINE is None:
+        return INTEGRAL_BUDGET_SECONDS
+    return min(INTEGRAL_BUDGET_SECONDS, REQUEST_DEADLINE - time.monotonic())
+
+def integral_race_enabled() -> bool:
+    """SCICALC_INTEGRAL_RACE=true/false; 默认 auto，仅在支持 fork 的平台上启用 (spawn 需要在子进程中重新导入 sympy，代价过高)。"""
+    setting = os.environ.get('SCICALC_INTEGRAL_RACE', 'auto').strip().lower()
+    if setting in ('true', '1', 'yes', 'on'):
+        return True
+    if setting in ('false', '0', 'no', 'off'):
+        return False
+    return 'fork' in multiprocessing.get_all_start_methods()
+
 def compute_integral(original_expr_str: str, var_name_str: str,
-                     lower_limit_in: Any, upper_limit_in: Any) -> Any:
+                     lower_limit_in: Any, upper_limit_in: Any, info: Dict[str, Any] = None,
+                     use_cache: bool = True) -> Any:
+    if info is None:
+        info = {}
+    try:
+        cache_key = integral_cache_key(original_expr_str, var_name_str, lower_limit_in, upper_limit_in)
+    except Exception:
+        cache_key, use_cache = None, False
+
+    def compute(call_info: Dict[str, Any]) -> Any:
+        args = (original_expr_str, var_name_str, lower_limit_in, upper_limit_in)
+        if integral_race_enabled():
+            contenders = {'symbolic': (_compute_integral_uncached, args)}
+            if not (lower_limit_in is None and upper_limit_in is None):
+                contenders['numeric'] = (_compute_numeric_integral, args)
+            return race_symbolic_numeric(original_expr_str, contenders, call_info, race_budget_seconds())
+        return _compute_integral_uncached(*args, call_info)
+
+    return cached_call(cache_key, info, use_cache, compute)
+
+def _integral_worker(kind: str, target: Any, args: Tuple[Any, ...], conn) -> None:
+    """Runs in a child process and sends back (result, call_info) from target(*args, call_info)."""
+    call_info: Dict[str, Any] = {}
+    diag = diagnostics.active if diagnostics is not None else None
+    if diag is not None:
+        diag.start_worker(kind)
+    try:
+        try:
+            result = target(*args, call_info)
+        except Exception as e:
+            result = f"Error in integral computation: {type(e).__name__} - {str(e)}"
+        if diag is not None:
+            call_info['_diagnostics'] = diag.finish_worker()
+        conn.send((result, call_info))
+    finally:
+        conn.close()
+
+def race_symbolic_numeric(original_expr_str: str, contenders: Dict[str, Tuple[Any, Tuple[Any, ...]]],
+                          info: Dict[str, Any], budget_seconds: float, task: str = 'integration',
+                          numeric_is_final: Any = None, note_key: str = 'integration_note') -> Any:
+    """
+    Race the 'symbolic' contender (the full compute path) against an optional
+    'numeric' one, each a (function, args) pair run in its own worker process.
+    The symbolic result is final whenever it arrives in time; a numeric result
+    wins only if numeric_is_final(result) holds (default: it is a clean float),
+    and even then the symbolic worker gets a short grace period so exact results
+    are preferred when they are about to land. If the deadline passes with just
+    a numeric warning/NaN message, that message is returned with a note.
+    """
+    if numeric_is_final is None:
+        numeric_is_final = lambda result: isinstance(result, float)
+    if budget_seconds <= 0:
+        # 同一请求中前面的计算已用完预算，不再启动工作进程
+        return (f"Error: {task.capitalize()} of '{original_expr_str}' {BUDGET_TIMEOUT_MARKER} the request's "
+                f"{INTEGRAL_BUDGET_SECONDS:g}s time budget (not started: earlier calculations used it up).")
+    _load_sympy_stack()
+    ctx = multiprocessing.get_context('fork') if 'fork' in multiprocessing.get_all_start_methods() else multiprocessing.get_context()
+
+    workers = {}
+    for kind, (target, args) in contenders.items():
+        recv_conn, send_conn = ctx.Pipe(duplex=False)
+        process = ctx.Process(target=_integral_worker, args=(kind, target, args, send_conn), daemon=True)
+        process.start()
+        send_conn.close()
+        workers[recv_conn] = (kind, process)
+
+    deadline = time.monotonic() + budget_seconds
+    numeric_winner = None
+    numeric_fallback = None
+    try:
+        while workers:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            for conn in mp_connection.wait(list(workers), timeout=remaining):
+                kind, process = workers.pop(conn)
+                try:
+                    result, call_info = conn.recv()
+                except EOFError:
+                    continue # Worker died without answering; let the other one finish.
+                finally:
+                    conn.close()
+                worker_report = call_info.pop('_diagnostics', None)
+                if worker_report is not None and diagnostics.active is not None:
+                    diagnostics.active.add_worker(kind, worker_report)
+                if kind == 'symbolic':
+                    for key, values in call_info.items():
+                        info.setdefault(key, []).extend(values)
+                    return result
+                if numeric_is_final(result):
+                    numeric_winner = (result, call_info)
+                    deadline = min(deadline, time.monotonic() + INTEGRAL_SYMBOLIC_GRACE_SECONDS)
+                else:
+                    numeric_fallback = (result, call_info)
+    finally:
+        for conn, (_kind, process) in workers.items():
+            if process.is_alive():
+                process.terminate()
+            conn.close()
+        for _kind, process in workers.values():
+            process.join(timeout=1)
+
+    if numeric_winner is not None:
+        result, call_info = numeric_winner
+        for key, values in call_info.items():
+            info.setdefault(key, []).extend(values)
+        info.setdefault(note_key, []).append(
+            f"Numeric result returned before symbolic {task} finished.")
+        return result
+    if numeric_fallback is not None:
+        result, call_info = numeric_fallback
+        for key, values in call_info.items():
+            info.setdefault(key, []).extend(values)
+        return f"{result} (Note: symbolic {task} {BUDGET_TIMEOUT_MARKER} {budget_seconds:.3g}s)"
+    return (f"Error: {task.capitalize()} of '{original_expr_str}' {BUDGET_TIMEOUT_MARKER} {budget_seconds:.3g}s "
+            f"(unfinished attempts were cancelled).")
+
+def standardize_limit(lim_val: Any, locals_for_eval: Dict[str, Any]) -> Any:
+    if isinstance(lim_val, str):
+        s_lim_val = lim_val.strip().lower()
+        if s_lim_val == 'inf': return sympy_inf
+        if s_lim_val == '-inf': return -sympy_inf
+        try:
+            return sympify(lim_val, locals=locals_for_eval) 
+        except Exception as e_sympify_lim:
+            raise ValueError(f"Invalid string limit value '{lim_val}': {e_sympify_lim}")
+    elif lim_val is float('inf'): return sympy_inf 
+    elif lim_val is float('-inf'): return -sympy_inf
+    elif isinstance(lim_val, (int, float, Integer, Float, Rational)): return sympify(lim_val)
+    elif lim_val is None: return None 
+    else: 
+        try:
+            return sympify(lim_val, locals=locals_for_eval)
+        except Exception as e_sympify_lim_other:
+            raise ValueError(f"Invalid limit type '{type(lim_val).__name__}' for value '{lim_val}': {e_sympify_lim_other}")
+
+def _compute_numeric_integral(original_expr_str: str, var_name_str: str,
+                              lower_limit_in: Any, upper_limit_in: Any, info: Dict[str, Any]) -> Any:
+    """Numeric-only entry point (the racing quad worker): no symbolic attempt at all."""
+    _load_sympy_stack()
     try:
         var_symbol = Symbol(var_name_str)
         sympy_integration_locals = base_sympy_locals.copy()
         sympy_integration_locals[var_name_str] = var_symbol
-        expr = sympify(original_expr_str, locals=sympy_integration_locals)
-
-        def standardize_limit(lim_val: Any, locals_for_eval: Dict[str, Any]) -> Any:
-            # (No changes to standardize_limit from previous version)
-            if isinstance(lim_val, str):
-                s_lim_val = lim_val.strip().lower()
-                if s_lim_val == 'inf': return sympy_inf
-                if s_lim_val == '-inf': return -sympy_inf
-                try:
-                    return sympify(lim_val, locals=locals_for_eval) 
-                except Exception as e_sympify_lim:
-                    raise ValueError(f"Invalid string limit value '{lim_val}': {e_sympify_lim}")
-            elif lim_val is float('inf'): return sympy_inf 
-            elif lim_val is float('-inf'): return -sympy_inf
-            elif isinstance(lim_val, (int, float, Integer, Float, Rational)): return sympify(lim_val)
-            elif lim_val is None: return None 
-            else: 
-                try:
-                    return sympify(lim_val, locals=locals_for_eval)
-                except Exception as e_sympify_lim_other:
-                    raise ValueError(f"Invalid limit type '{type(lim_val).__name__}' for value '{lim_val}': {e_sympify_lim_other}")
-        
+        expr = cached_sympify(original_expr_str, (var_name_str,))
+        sympy_lower = standardize_limit(lower_limit_in, sympy_integration_locals)
+        sympy_upper = standardize_limit(upper_limit_in, sympy_integration_locals)
+        return numeric_integral(expr, var_symbol, sympy_lower, sympy_upper, "", info)
+    except Exception as e:
+        return f"Error in numerical integration for '{original_expr_str}': {type(e).__name__} - {str(e)}"
+
+def numeric_integral(expr: Any, var_symbol: Any, sympy_lower: Any, sympy_upper: Any,
+                     numerical_attempt_message_prefix: str, info: Dict[str, Any]) -> Any:
+    def f_for_quad(x_val_np: float) -> float:
+        try:
+            substituted_expr = expr.subs({var_symbol: x_val_np})
+            val_sympy = substituted_expr.evalf(n=15, chop=True)
+
+            if val_sympy is sympy.S.NaN: return numpy_nan
+            if val_sympy is sympy.S.Infinity: return numpy_inf
+            if val_sympy is sympy.S.NegativeInfinity: return -numpy_inf
+            if val_sympy is sympy.S.ComplexInfinity: return numpy_nan # zoo for quad
+
+            if isinstance(val_sympy, sympy.Number):
+                if val_sympy.is_infinite:
+                    if hasattr(val_sympy, 'is_extended_positive') and val_sympy.is_extended_positive: return numpy_inf
+                    if hasattr(val_sympy, 'is_extended_negative') and val_sympy.is_extended_negative: return -numpy_inf
+                    return numpy_nan 
+
+                if not val_sympy.is_extended_real: # Checks if it's complex
+                    if hasattr(val_sympy, 'as_real_imag'):
+                        _real, _imag = val_sympy.as_real_imag()
+                        # Check imag part with tolerance
+                        if abs(float(_imag.evalf(chop=True))) < 1e-9:
+                            val_to_check = float(_real.evalf(chop=True))
+                            # Check real part for NaN/Inf
+                            if math.isnan(val_to_check): return numpy_nan
+                            if math.isinf(val_to_check): return numpy_inf if val_to_check > 0 else -numpy_inf
+                            return val_to_check
+                        else: # Genuinely complex
+                            return numpy_nan
+                    else: # Should have as_real_imag if complex Number
+                        return numpy_nan
+                
+                # Is extended_real and finite (infinites handled above)
+                # Convert to Python float; this handles sympy.Float('nan') correctly.
+                py_float_val = float(val_sympy)
+                if math.isnan(py_float_val): return numpy_nan
+                # Should not be infinite here if sympy's is_infinite was False, but for safety:
+                if math.isinf(py_float_val): return numpy_inf if py_float_val > 0 else -numpy_inf
+                return py_float_val
+
+            # Not a recognized symbolic constant and not a SymPy Number after evalf.
+            # This implies it's still symbolic or an unhandled type.
+            return numpy_nan
+
+        except Exception: 
+            return numpy_nan 
+
+    # Prefer a single lambdify compilation over thousands of subs/evalf rewrites.
+    integrand = compile_numeric_integrand(expr, var_symbol)
+    if integrand is not None:
+        integration_path = 'numeric-compiled'
+    else:
+        integrand = f_for_quad
+        integration_path = 'numeric-subs'
+    info.setdefault('integration_path', []).append(integration_path)
+
+    q_lower_sympy_evalf = sympy_lower.evalf()
+    q_upper_sympy_evalf = sympy_upper.evalf()
+
+    # (Limit checking logic for q_lower, q_upper remains mostly same,
+    #  but ensure float conversion handles potential NaN/Inf from evalf robustly)
+    if q_lower_sympy_evalf.has(sympy_nan_symbol, sympy_zoo) or \
+       q_upper_sympy_evalf.has(sympy_nan_symbol, sympy_zoo) or \
+       (hasattr(q_lower_sympy_evalf, 'is_finite') and q_lower_sympy_evalf.is_finite is False and not q_lower_sympy_evalf.is_infinite) or \
+       (hasattr(q_upper_sympy_evalf, 'is_finite') and q_upper_sympy_evalf.is_finite is False and not q_upper_sympy_evalf.is_infinite) : # e.g. if limit expression evaluates to NaN or other non-finite non-infinite
+        return f"{numerical_attempt_message_prefix}Numerical integration failed: Could not evaluate limits to finite numbers for numerical integration (Lower: {latex(sympy_lower)}, Upper: {latex(sympy_upper)})."
+
+    q_lower = float(q_lower_sympy_evalf) if q_lower_sympy_evalf.is_finite else (numpy_inf if (q_lower_sympy_evalf == sympy_inf or (hasattr(q_lower_sympy_evalf,'is_extended_positive') and q_lower_sympy_evalf.is_extended_positive)) else (-numpy_inf if (q_lower_sympy_evalf == -sympy_inf or (hasattr(q_lower_sympy_evalf,'is_extended_negative') and q_lower_sympy_evalf.is_extended_negative)) else numpy_nan))
+    q_upper = float(q_upper_sympy_evalf) if q_upper_sympy_evalf.is_finite else (numpy_inf if (q_upper_sympy_evalf == sympy_inf or (hasattr(q_upper_sympy_evalf,'is_extended_positive') and q_upper_sympy_evalf.is_extended_positive)) else (-numpy_inf if (q_upper_sympy_evalf == -sympy_inf or (hasattr(q_upper_sympy_evalf,'is_extended_negative') and q_upper_sympy_evalf.is_extended_negative)) else numpy_nan))
+
+    if q_lower is numpy_nan or q_upper is numpy_nan:
+         return f"{numerical_attempt_message_prefix}Numerical integration failed: Limits evaluated to NaN (Lower: {latex(sympy_lower)}, Upper: {latex(sympy_upper)})."
+
+
+    if q_lower >= q_upper and not (math.isinf(q_lower) and math.isinf(q_upper) and q_lower == q_upper) :
+         return f"{numerical_attempt_message_prefix}Numerical integration error: lower limit {q_lower} must be less than upper limit {q_upper}."
+
+    try:
+        breakpoints = find_integrand_breakpoints(expr, var_symbol, integrand if integration_path == 'numeric-compiled' else None,
+                                                 q_lower, q_upper)
+        if breakpoints:
+            info.setdefault('breakpoints', []).extend(float(f"{p:.10g}") for p in breakpoints)
+        numeric_val, num_error = integrate_with_breakpoints(integrand, q_lower, q_upper, breakpoints)
+        if math.isnan(numeric_val):
+            return f"{numerical_attempt_message_prefix}Numerical integration resulted in NaN."
+        if abs(num_error) > 0.01 * abs(numeric_val) and abs(num_error) > 1e-4:
+            # Return the number, but also include a warning string.
+            # The calling function will need to handle this tuple.
+            # For now, let's just return the formatted string to avoid breaking things.
+            return f"{numerical_attempt_message_prefix}Numerical result: {numeric_val:.7g} (Warning: Potentially large error: {num_error:.2g})"
+        return float(numeric_val)
+    except Exception as quad_e:
+        return f"{numerical_attempt_message_prefix}Numerical integration failed: {type(quad_e).__name__} - {str(quad_e)}"
+
+# --- 奇点/间断点感知的数值积分 ---
+BREAKPOINT_SCAN_POINTS = 2049
+MAX_BREAKPOINTS = 50
+# 只对足够简单的子表达式做符号求根，避免 solveset 本身拖慢请求
+SYMBOLIC_BREAKPOINT_MAX_OPS = 30
+
+def _symbolic_breakpoints(expr: Any, var_symbol: Any, lower: float, upper: float) -> List[float]:
+    """
+    Zeros of Heaviside/Abs/sign arguments and of polynomial denominators, plus the
+    integer crossings of linear floor/ceiling arguments, where cheap to find.
+    """
+    candidates = []
+    pieces = [atom.args[0] for atom in expr.atoms(sympy.Heaviside, sympy.Abs, sympy.sign)
+              if atom.args and atom.args[0].has(var_symbol)]
+    for atom in expr.atoms(sympy.floor, sympy.ceiling):
+        arg = atom.args[0]
+        if not (arg.has(var_symbol) and math.isfinite(lower) and math.isfinite(upper)):
+            continue
+        if arg.is_polynomial(var_symbol) and sympy.degree(arg, var_symbol) == 1:
+            slope, offset = (float(c) for c in sympy.Poly(arg, var_symbol).all_coeffs())
+            low_arg, high_arg = sorted((slope * lower + offset, slope * upper + offset))
+            first = math.ceil(low_arg)
+            for k in range(first, min(math.floor(high_arg), first + MAX_BREAKPOINTS) + 1):
+                candidates.append((k - offset) / slope)
+        # 非线性的 floor/ceiling 参数交给网格扫描处理
+    if sympy.count_ops(expr) <= SYMBOLIC_BREAKPOINT_MAX_OPS:
+        denominator = sympy.denom(sympy.together(expr))
+        if denominator.has(var_symbol) and denominator.is_polynomial(var_symbol):
+            pieces.append(denominator)
+
+    for piece in pieces:
+        if sympy.count_ops(piece) > SYMBOLIC_BREAKPOINT_MAX_OPS:
+            continue
+        try:
+            if piece.is_polynomial(var_symbol):
+                roots = [complex(r) for r in sympy.Poly(piece, var_symbol).nroots()]
+                roots = [r.real for r in roots if abs(r.imag) < 1e-12]
+            else:
+                domain = sympy.Interval(lower, upper) if math.isfinite(lower) and math.isfinite(upper) else sympy.S.Reals
+                solutions = sympy.solveset(piece, var_symbol, domain=domain)
+                if not isinstance(solutions, sympy.FiniteSet):
+                    continue
+                roots = [float(r) for r in solutions if r.is_real]
+        except Exception:
+            continue
+        candidates.extend(r for r in roots if lower < r < upper)
+    return candidates
+
+def _refine_sign_change(f: Any, left: float, right: float, f_left: float, iterations: int = 60) -> float:
+    """Bisect a sign flip of f between left and right (an odd-order pole or a jump through zero)."""
+    for _ in range(iterations):
+        mid = 0.5 * (left + right)
+        if mid <= left or mid >= right:
+            break
+        f_mid = float(f(mid))
+        if not math.isfinite(f_mid):
+            return mid
+        if (f_mid > 0) == (f_left > 0):
+            left, f_left = mid, f_mid
+        else:
+            right = mid
+    return 0.5 * (left + right)
+
+def _refine_peak(f: Any, left: float, right: float, iterations: int = 60) -> float:
+    """Ternary search for the largest |f| between left and right (an even-order pole)."""
+    for _ in range(iterations):
+        m1 = left + (right - left) / 3
+        m2 = right - (right - left) / 3
+        if not m1 < m2:
+            break
+        v1, v2 = abs(float(f(m1))), abs(float(f(m2)))
+        if not math.isfinite(v1):
+            return m1
+        if not math.isfinite(v2):
+            return m2
+        if v1 < v2:
+            left = m1
+        else:
+            right = m2
+    return 0.5 * (left + right)
+
+def _refine_jump(f: Any, left: float, right: float, f_left: float, f_right: float, iterations: int = 60) -> float:
+    """Bisect towards the half of [left, right] that still contains most of the step in f."""
+    for _ in range(iterations):
+        mid = 0.5 * (left + right)
+        if mid <= left or mid >= right:
+            break
+        f_mid = float(f(mid))
+        if not math.isfinite(f_mid):
+            return mid
+        if abs(f_mid - f_left) >= abs(f_right - f_mid):
+            right, f_right = mid, f_mid
+        else:
+            left, f_left = mid, f_mid
+    return 0.5 * (left + right)
+
+def _grid_breakpoints(f: Any, lower: float, upper: float) -> List[float]:
+    """
+    Vectorized pre-scan of the integrand on a uniform grid. Flags interior
+    non-finite samples, poles (huge local peaks of |f| or huge sign flips) and
+    isolated jump discontinuities, then refines each location with a few scalar
+    evaluations.
+    """
+    grid = np.linspace(lower, upper, BREAKPOINT_SCAN_POINTS)
+    with np.errstate(all='ignore'):
+        values = np.asarray(f(grid), dtype=float)
+    finite = np.isfinite(values)
+    candidates = [float(x) for x in grid[1:-1][~finite[1:-1]]]
+    if finite.sum() < 3:
+        return candidates
+
+    safe = np.where(finite, values, 0.0)
+    magnitude = np.abs(safe)
+    scale = np.median(magnitude[finite]) + 1e-300
+    huge = finite & (magnitude > 1e3 * scale)
+    inner = slice(1, -1)
+    neighbours_finite = finite[:-2] & finite[2:]
+
+    # 极点: |f| 的局部峰值远超函数典型量级；奇数阶极点表现为两侧巨大值的符号翻转
+    peaks = huge[inner] & neighbours_finite & (magnitude[inner] >= magnitude[:-2]) & (magnitude[inner] >= magnitude[2:])
+    for i in np.flatnonzero(peaks) + 1:
+        if huge[i - 1] and np.sign(safe[i - 1]) != np.sign(safe[i]):
+            candidates.append(_refine_sign_change(f, float(grid[i - 1]), float(grid[i]), float(safe[i - 1])))
+        elif huge[i + 1] and np.sign(safe[i + 1]) != np.sign(safe[i]):
+            candidates.append(_refine_sign_change(f, float(grid[i]), float(grid[i + 1]), float(safe[i])))
+        else:
+            candidates.append(_refine_peak(f, float(grid[i - 1]), float(grid[i + 1])))
+
+    # 跳跃间断: 某一步的变化远大于典型步长，且远大于相邻两步 (排除极点附近的陡峭区域)
+    steps = np.abs(np.diff(safe))
+    steps_finite = finite[:-1] & finite[1:]
+    typical_step = np.median(steps[steps_finite]) if steps_finite.any() else 0.0
+    padded = np.concatenate(([np.inf], steps, [np.inf]))
+    neighbour_step = np.maximum(np.where(np.isfinite(padded[:-2]), padded[:-2], 0.0),
+                                np.where(np.isfinite(padded[2:]), padded[2:], 0.0))
+    jumps = steps_finite & ~huge[:-1] & ~huge[1:] & (steps > 50 * typical_step) \
+            & (steps > 20 * neighbour_step) & (steps > 1e-6 * scale)
+    for i in np.flatnonzero(jumps):
+        candidates.append(_refine_jump(f, float(grid[i]), float(grid[i + 1]), float(safe[i]), float(safe[i + 1])))
+    return candidates[:MAX_BREAKPOINTS]
+
+def find_integrand_breakpoints(expr: Any, var_symbol: Any, vectorized_integrand: Any,
+                               lower: float, upper: float) -> List[float]:
+    """
+    Locate poles, discontinuities and kinks strictly inside (lower, upper):
+    cheap SymPy root finding on the arguments of piecewise-like functions plus,
+    for finite intervals, a vectorized grid scan of the compiled integrand.
+    Exact symbolic locations take precedence over nearby grid estimates.
+    """
+    finite_interval = math.isfinite(lower) and math.isfinite(upper)
+    try:
+        symbolic_points = _symbolic_breakpoints(expr, var_symbol, lower, upper)
+    except Exception:
+        symbolic_points = []
+    grid_points = []
+    if vectorized_integrand is not None and finite_interval:
+        try:
+            grid_points = _grid_breakpoints(vectorized_integrand, lower, upper)
+        except Exception:
+            grid_points = []
+
+    width = upper - lower if finite_interval else 1.0
+    edge_tolerance = 1e-12 * width
+    merge_tolerance = width / (BREAKPOINT_SCAN_POINTS - 1) if finite_interval else 1e-9
+    breakpoints: List[float] = []
+    for point in list(symbolic_points) + list(grid_points):
+        if not (lower + edge_tolerance < point < upper - edge_tolerance):
+            continue
+        if any(abs(point - existing) <= merge_tolerance for existing in breakpoints):
+            continue
+        breakpoints.append(point)
+    return sorted(breakpoints)[:MAX_BREAKPOINTS]
+
+def integrate_with_breakpoints(integrand: Any, lower: float, upper: float, breakpoints: List[float]) -> Tuple[float, float]:
+    """
+    Integrate piece by piece between breakpoints so quad never has to discover them
+    by subdivision; values and error estimates of the pieces are summed. When a piece
+    raises an IntegrationWarning (typically a non-integrable pole at its edge), its
+    value is folded into the error so the caller reports a large error rather than
+    a confident number.
+    """
+    edges = [lower] + list(breakpoints) + [upper]
+    total_value, total_error = 0.0, 0.0
+    for left, right in zip(edges[:-1], edges[1:]):
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always', IntegrationWarning)
+            value, error = quad(integrand, left, right, limit=150, epsabs=1.49e-07, epsrel=1.49e-07)
+        if any(issubclass(w.category, IntegrationWarning) for w in caught):
+            error = max(error, abs(value))
+        total_value += value
+        total_error += error
+    return total_value, total_error
+
+def format_symbolic_definite_result(result_sympy: Any, evaluated_sympy_result: Any) -> Any:
+    if evaluated_sympy_result.is_extended_real and evaluated_sympy_result.is_finite:
+        return float(evaluated_sympy_result)
+    elif evaluated_sympy_result.is_extended_real: # Non-finite real
+        return f"Symbolic result: $${latex(result_sympy)}$$ evaluated to non-finite $${latex(evaluated_sympy_result)}$$"
+    elif evaluated_sympy_result.is_complex and evaluated_sympy_result.is_finite:
+        return f"$${latex(evaluated_sympy_result)}$$" # Return complex as string
+    elif evaluated_sympy_result.is_complex: # Non-finite complex
+        return f"Symbolic result: $${latex(result_sympy)}$$ evaluated to non-finite complex $${latex(evaluated_sympy_result)}$$"
+    else:
+        return f"Symbolic result: $${latex(result_sympy)}$$ (evaluated to $${latex(evaluated_sympy_result)}$$, but type is unexpected)"
+
+def _compute_integral_uncached(original_expr_str: str, var_name_str: str,
+                               lower_limit_in: Any, upper_limit_in: Any, info: Dict[str, Any]) -> Any:
+    _load_sympy_stack()
+    try:
+        var_symbol = Symbol(var_name_str)
+        sympy_integration_locals = base_sympy_locals.copy()
+        sympy_integration_locals[var_name_str] = var_symbol
+        expr = cached_sympify(original_expr_str, (var_name_str,))
+
         if lower_limit_in is None and upper_limit_in is None:
+            info.setdefault('integration_path', []).append('symbolic')
             result_sympy = integrate(expr, var_symbol)
             return f"$$ {latex(result_sympy)} + C $$"
         else:
@@ -110,117 +868,1137 @@ def compute_integral(original_expr_str: str, var_name_str: str,
                 else:
                     numerical_attempt_message_prefix = f"Symbolic result ($${latex(result_sympy)}$$) evaluated to ($${latex(evaluated_sympy_result)}$$). "
 
-                # MODIFIED f_for_quad STARTS HERE
-                def f_for_quad(x_val_np: float) -> float:
-                    try:
-                        substituted_expr = expr.subs({var_symbol: x_val_np})
-                        val_sympy = substituted_expr.evalf(subs_options={'chop': True}, n=15)
-
-                        if val_sympy is sympy.S.NaN: return numpy_nan
-                        if val_sympy is sympy.S.Infinity: return numpy_inf
-                        if val_sympy is sympy.S.NegativeInfinity: return -numpy_inf
-                        if val_sympy is sympy.S.ComplexInfinity: return numpy_nan # zoo for quad
-
-                        if isinstance(val_sympy, sympy.Number):
-                            if val_sympy.is_infinite:
-                                if hasattr(val_sympy, 'is_extended_positive') and val_sympy.is_extended_positive: return numpy_inf
-                                if hasattr(val_sympy, 'is_extended_negative') and val_sympy.is_extended_negative: return -numpy_inf
-                                return numpy_nan 
-
-                            if not val_sympy.is_extended_real: # Checks if it's complex
-                                if hasattr(val_sympy, 'as_real_imag'):
-                                    _real, _imag = val_sympy.as_real_imag()
-                                    # Check imag part with tolerance
-                                    if abs(float(_imag.evalf(chop=True))) < 1e-9:
-                                        val_to_check = float(_real.evalf(chop=True))
-                                        # Check real part for NaN/Inf
-                                        if math.isnan(val_to_check): return numpy_nan
-                                        if math.isinf(val_to_check): return numpy_inf if val_to_check > 0 else -numpy_inf
-                                        return val_to_check
-                                    else: # Genuinely complex
-                                        return numpy_nan
-                                else: # Should have as_real_imag if complex Number
-                                    return numpy_nan
-                            
-                            # Is extended_real and finite (infinites handled above)
-                            # Convert to Python float; this handles sympy.Float('nan') correctly.
-                            py_float_val = float(val_sympy)
-                            if math.isnan(py_float_val): return numpy_nan
-                            # Should not be infinite here if sympy's is_infinite was False, but for safety:
-                            if math.isinf(py_float_val): return numpy_inf if py_float_val > 0 else -numpy_inf
-                            return py_float_val
-
-                        # Not a recognized symbolic constant and not a SymPy Number after evalf.
-                        # This implies it's still symbolic or an unhandled type.
-                        return numpy_nan
+                return numeric_integral(expr, var_symbol, sympy_lower, sympy_upper,
+                                        numerical_attempt_message_prefix, info)
+            else:
+                info.setdefault('integration_path', []).append('symbolic')
+                return format_symbolic_definite_result(result_sympy, evaluated_sympy_result)
 
-                    except Exception: 
-                        return numpy_nan 
-                # MODIFIED f_for_quad ENDS HERE
-                
-                q_lower_sympy_evalf = sympy_lower.evalf()
-                q_upper_sympy_evalf = sympy_upper.evalf()
+    except ValueError as ve:
+        return f"Error in integral setup for '{original_expr_str}' with var '{var_name_str}': {str(ve)}"
+    except TypeError as te: 
+        return f"Error processing integral for '{original_expr_str}' (likely type issue or malformed expression for SymPy): {type(te).__name__} - {str(te)}"
+    except Exception as e: 
+        import traceback
+        tb_str = traceback.format_exc()
+        return f"Error in integral computation for '{original_expr_str}': {type(e).__name__} - {str(e)}\nTraceback:\n{tb_str}"
 
-                # (Limit checking logic for q_lower, q_upper remains mostly same,
-                #  but ensure float conversion handles potential NaN/Inf from evalf robustly)
-                if q_lower_sympy_evalf.has(sympy_nan_symbol, sympy_zoo) or \
-                   q_upper_sympy_evalf.has(sympy_nan_symbol, sympy_zoo) or \
-                   (hasattr(q_lower_sympy_evalf, 'is_finite') and q_lower_sympy_evalf.is_finite is False and not q_lower_sympy_evalf.is_infinite) or \
-                   (hasattr(q_upper_sympy_evalf, 'is_finite') and q_upper_sympy_evalf.is_finite is False and not q_upper_sympy_evalf.is_infinite) : # e.g. if limit expression evaluates to NaN or other non-finite non-infinite
-                    return f"{numerical_attempt_message_prefix}Numerical integration failed: Could not evaluate limits to finite numbers for numerical integration (Lower: {latex(sympy_lower)}, Upper: {latex(sympy_upper)})."
 
-                q_lower = float(q_lower_sympy_evalf) if q_lower_sympy_evalf.is_finite else (numpy_inf if (q_lower_sympy_evalf == sympy_inf or (hasattr(q_lower_sympy_evalf,'is_extended_positive') and q_lower_sympy_evalf.is_extended_positive)) else (-numpy_inf if (q_lower_sympy_evalf == -sympy_inf or (hasattr(q_lower_sympy_evalf,'is_extended_negative') and q_lower_sympy_evalf.is_extended_negative)) else numpy_nan))
-                q_upper = float(q_upper_sympy_evalf) if q_upper_sympy_evalf.is_finite else (numpy_inf if (q_upper_sympy_evalf == sympy_inf or (hasattr(q_upper_sympy_evalf,'is_extended_positive') and q_upper_sympy_evalf.is_extended_positive)) else (-numpy_inf if (q_upper_sympy_evalf == -sympy_inf or (hasattr(q_upper_sympy_evalf,'is_extended_negative') and q_upper_sympy_evalf.is_extended_negative)) else numpy_nan))
+# --- 多重积分 (integral2 / integral3 / nintegral) ---
+# 积分范围按 SymPy/nquad 的约定从最内层到最外层排列；上下限只能依赖更外层的变量。
+DEFAULT_INTEGRATION_VARIABLES = ('x', 'y', 'z')
+MULTI_INTEGRAL_DIMENSIONS = {'integral2': 2, 'integral3': 3, 'nintegral': None}
+NQUAD_LIMIT = 50
+# 4 维及以上改用加扰 Sobol 序列的准蒙特卡洛，误差取独立重复之间的标准误差
+QMC_MIN_DIMENSIONS = 4
+QMC_LOG2_POINTS = 14
+QMC_REPLICATES = 8
 
-                if q_lower is numpy_nan or q_upper is numpy_nan:
-                     return f"{numerical_attempt_message_prefix}Numerical integration failed: Limits evaluated to NaN (Lower: {latex(sympy_lower)}, Upper: {latex(sympy_upper)})."
+def compute_multi_integral(original_expr_str: str, specs: List[Tuple[str, Any, Any]],
+                           info: Dict[str, Any] = None, use_cache: bool = True) -> Any:
+    if info is None:
+        info = {}
+    try:
+        cache_key = multi_integral_cache_key(original_expr_str, specs)
+    except Exception:
+        cache_key, use_cache = None, False
 
+    def compute(call_info: Dict[str, Any]) -> Any:
+        args = (original_expr_str, tuple(specs))
+        if integral_race_enabled():
+            contenders = {'symbolic': (_compute_multi_integral_uncached, args),
+                          'numeric': (_compute_multi_numeric_integral, args)}
+            return race_symbolic_numeric(original_expr_str, contenders, call_info, race_budget_seconds())
+        return _compute_multi_integral_uncached(*args, call_info)
 
-                if q_lower >= q_upper and not (math.isinf(q_lower) and math.isinf(q_upper) and q_lower == q_upper) :
-                     return f"{numerical_attempt_message_prefix}Numerical integration error: lower limit {q_lower} must be less than upper limit {q_upper}."
+    return cached_call(cache_key, info, use_cache, compute)
 
-                try:
-                    numeric_val, num_error = quad(f_for_quad, q_lower, q_upper, limit=150, epsabs=1.49e-07, epsrel=1.49e-07)
-                    if math.isnan(numeric_val):
-                        return f"{numerical_attempt_message_prefix}Numerical integration resulted in NaN."
-                    if abs(num_error) > 0.01 * abs(numeric_val) and abs(num_error) > 1e-4:
-                        # Return the number, but also include a warning string.
-                        # The calling function will need to handle this tuple.
-                        # For now, let's just return the formatted string to avoid breaking things.
-                        return f"{numerical_attempt_message_prefix}Numerical result: {numeric_val:.7g} (Warning: Potentially large error: {num_error:.2g})"
-                    return float(numeric_val)
-                except Exception as quad_e:
-                    return f"{numerical_attempt_message_prefix}Numerical integration failed: {type(quad_e).__name__} - {str(quad_e)}"
+def setup_multi_integral(original_expr_str: str, specs: Tuple[Tuple[str, Any, Any], ...]) -> Tuple[Any, List[Tuple[Any, Any, Any]]]:
+    """Sympify the integrand and limits; returns (expr, [(symbol, lower, upper), ...]) innermost first."""
+    var_names = tuple(str(name).strip() for name, _lower, _upper in specs)
+    if len(set(var_names)) != len(var_names):
+        raise ValueError(f"Integration variables must be distinct, got {', '.join(var_names)}.")
+    var_symbols = [Symbol(name) for name in var_names]
+    sympy_integration_locals = base_sympy_locals.copy()
+    sympy_integration_locals.update(zip(var_names, var_symbols))
+    expr = cached_sympify(original_expr_str, var_names)
+
+    limits = []
+    for index, (name, lower_in, upper_in) in enumerate(specs):
+        outer_symbols = set(var_symbols[index + 1:])
+        bounds = []
+        for bound_in in (lower_in, upper_in):
+            bound = standardize_limit(bound_in, sympy_integration_locals)
+            if bound is None:
+                raise ValueError(f"Missing integration limit for variable '{var_names[index]}'.")
+            if not bound.free_symbols <= outer_symbols:
+                outer_names = ', '.join(var_names[index + 1:]) or 'none'
+                raise ValueError(f"Limits of '{var_names[index]}' may only depend on outer variables ({outer_names}), got '{bound}'.")
+            bounds.append(bound)
+        limits.append((var_symbols[index], bounds[0], bounds[1]))
+    return expr, limits
+
+def _compute_multi_integral_uncached(original_expr_str: str, specs: Tuple[Tuple[str, Any, Any], ...],
+                                     info: Dict[str, Any]) -> Any:
+    _load_sympy_stack()
+    var_names = ', '.join(str(name) for name, _lower, _upper in specs)
+    try:
+        expr, limits = setup_multi_integral(original_expr_str, specs)
+        result_sympy = integrate(expr, *limits)
+        evaluated_sympy_result = result_sympy.evalf(chop=True)
+        is_unevaluated_integral = result_sympy.has(SympyIntegral)
+        is_eval_problematic = evaluated_sympy_result.has(sympy_inf, -sympy_inf, sympy_zoo, sympy_nan_symbol) or \
+                              (evaluated_sympy_result.is_real is False and evaluated_sympy_result.is_complex is False)
+
+        if is_unevaluated_integral or is_eval_problematic:
+            if is_unevaluated_integral:
+                numerical_attempt_message_prefix = f"Symbolic integration unevaluated ($${latex(result_sympy)}$$). "
             else:
-                if evaluated_sympy_result.is_extended_real and evaluated_sympy_result.is_finite:
-                    return float(evaluated_sympy_result)
-                elif evaluated_sympy_result.is_extended_real: # Non-finite real
-                    return f"Symbolic result: $${latex(result_sympy)}$$ evaluated to non-finite $${latex(evaluated_sympy_result)}$$"
-                elif evaluated_sympy_result.is_complex and evaluated_sympy_result.is_finite:
-                    return f"$${latex(evaluated_sympy_result)}$$" # Return complex as string
-                elif evaluated_sympy_result.is_complex: # Non-finite complex
-                    return f"Symbolic result: $${latex(result_sympy)}$$ evaluated to non-finite complex $${latex(evaluated_sympy_result)}$$"
-                else:
-                    return f"Symbolic result: $${latex(result_sympy)}$$ (evaluated to $${latex(evaluated_sympy_result)}$$, but type is unexpected)"
+                numerical_attempt_message_prefix = f"Symbolic result ($${latex(result_sympy)}$$) evaluated to ($${latex(evaluated_sympy_result)}$$). "
+            return multi_numeric_integral(expr, limits, numerical_attempt_message_prefix, info)
+
+        info.setdefault('integration_path', []).append('symbolic')
+        return format_symbolic_definite_result(result_sympy, evaluated_sympy_result)
 
     except ValueError as ve:
-        return f"Error in integral setup for '{original_expr_str}' with var '{var_name_str}': {str(ve)}"
-    except TypeError as te: 
+        return f"Error in integral setup for '{original_expr_str}' with vars '{var_names}': {str(ve)}"
+    except TypeError as te:
         return f"Error processing integral for '{original_expr_str}' (likely type issue or malformed expression for SymPy): {type(te).__name__} - {str(te)}"
-    except Exception as e: 
-        import traceback
-        tb_str = traceback.format_exc()
-        return f"Error in integral computation for '{original_expr_str}': {type(e).__name__} - {str(e)}\nTraceback:\n{tb_str}"
+    except Exception as e:
+        return f"Error in integral computation for '{original_expr_str}': {type(e).__name__} - {str(e)}"
+
+def _compute_multi_numeric_integral(original_expr_str: str, specs: Tuple[Tuple[str, Any, Any], ...],
+                                    info: Dict[str, Any]) -> Any:
+    """Numeric-only entry point (the racing nquad/QMC worker)."""
+    _load_sympy_stack()
+    try:
+        expr, limits = setup_multi_integral(original_expr_str, specs)
+        return multi_numeric_integral(expr, limits, "", info)
+    except Exception as e:
+        return f"Error in numerical integration for '{original_expr_str}': {type(e).__name__} - {str(e)}"
+
+def _compile_limit(bound: Any, outer_symbols: List[Any]) -> Any:
+    """Turn a SymPy limit into a float or a numpy callable of the outer variables (±oo become ±inf)."""
+    def as_float(value: Any) -> float:
+        if value == sympy_inf: return numpy_inf
+        if value == -sympy_inf: return -numpy_inf
+        return float(value)
+
+    if not bound.free_symbols:
+        return as_float(bound.evalf())
+    compiled = sympy.lambdify(outer_symbols, bound, modules='numpy')
+
+    def limit_at(*outer_vals: Any) -> Any:
+        with np.errstate(all='ignore'):
+            return compiled(*outer_vals)
+    return limit_at
+
+def _subs_integrand(expr: Any, var_symbols: List[Any]):
+    """Per-point subs/evalf fallback for integrands lambdify cannot compile."""
+    def f_subs(*x_vals: float) -> float:
+        try:
+            val_sympy = expr.subs(dict(zip(var_symbols, x_vals))).evalf(n=15, chop=True)
+            val = complex(val_sympy)
+        except Exception:
+            return numpy_nan
+        if abs(val.imag) >= 1e-9:
+            return numpy_nan
+        return val.real
+    return f_subs
+
+def multi_numeric_integral(expr: Any, limits: List[Tuple[Any, Any, Any]],
+                           numerical_attempt_message_prefix: str, info: Dict[str, Any]) -> Any:
+    var_symbols = [symbol for symbol, _lower, _upper in limits]
+    integrand = compile_numeric_integrand(expr, var_symbols)
+    ranges = []
+    for index, (_symbol, lower, upper) in enumerate(limits):
+        lower_c = _compile_limit(lower, var_symbols[index + 1:])
+        upper_c = _compile_limit(upper, var_symbols[index + 1:])
+        if not callable(lower_c) and not callable(upper_c) and (math.isnan(lower_c) or math.isnan(upper_c)):
+            return f"{numerical_attempt_message_prefix}Numerical integration failed: Limits evaluated to NaN (Lower: {latex(lower)}, Upper: {latex(upper)})."
+        ranges.append((lower_c, upper_c))
+
+    try:
+        if integrand is not None and len(limits) >= QMC_MIN_DIMENSIONS:
+            estimate = qmc_integral(integrand, ranges)
+            if estimate is not None:
+                info.setdefault('integration_path', []).append('numeric-qmc')
+                numeric_val, num_error = estimate
+                return _numeric_result(numeric_val, num_error, numerical_attempt_message_prefix)
+
+        if integrand is not None:
+            integration_path = 'numeric-nquad'
+        else:
+            integrand = _subs_integrand(expr, var_symbols)
+            integration_path = 'numeric-subs'
+        info.setdefault('integration_path', []).append(integration_path)
+
+        def nquad_range(lower_c: Any, upper_c: Any) -> Any:
+            if not callable(lower_c) and not callable(upper_c):
+                return [lower_c, upper_c]
+            return lambda *outer_vals: [float(lower_c(*outer_vals)) if callable(lower_c) else lower_c,
+                                        float(upper_c(*outer_vals)) if callable(upper_c) else upper_c]
+
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always', IntegrationWarning)
+            numeric_val, num_error = nquad(integrand, [nquad_range(lo, hi) for lo, hi in ranges],
+                                           opts={'limit': NQUAD_LIMIT, 'epsabs': 1.49e-07, 'epsrel': 1.49e-07})
+        if any(issubclass(w.category, IntegrationWarning) for w in caught):
+            num_error = max(num_error, abs(numeric_val))
+        return _numeric_result(numeric_val, num_error, numerical_attempt_message_prefix)
+    except Exception as quad_e:
+        return f"{numerical_attempt_message_prefix}Numerical integration failed: {type(quad_e).__name__} - {str(quad_e)}"
+
+def _numeric_result(numeric_val: float, num_error: float, numerical_attempt_message_prefix: str) -> Any:
+    if math.isnan(numeric_val):
+        return f"{numerical_attempt_message_prefix}Numerical integration resulted in NaN."
+    if abs(num_error) > 0.01 * abs(numeric_val) and abs(num_error) > 1e-4:
+        return f"{numerical_attempt_message_prefix}Numerical result: {numeric_val:.7g} (Warning: Potentially large error: {num_error:.2g})"
+    return float(numeric_val)
+
+def qmc_integral(integrand: Any, ranges: List[Tuple[Any, Any]]) -> Any:
+    """
+    Randomized quasi-Monte Carlo over the unit cube, mapped onto the (possibly
+    dependent) limits from the outermost variable inwards; the Jacobian is the
+    product of the interval widths. Returns (value, standard error) or None when
+    some limit is infinite and the caller should use nquad instead.
+    """
+    from scipy.stats import qmc
+    dims = len(ranges)
+    estimates = []
+    for replicate in range(QMC_REPLICATES):
+        unit_points = qmc.Sobol(d=dims, scramble=True, seed=replicate).random_base2(m=QMC_LOG2_POINTS)
+        points = [None] * dims
+        jacobian = np.ones(unit_points.shape[0])
+        for index in reversed(range(dims)):
+            outer_points = points[index + 1:]
+            lower_c, upper_c = ranges[index]
+            lower = lower_c(*outer_points) if callable(lower_c) else lower_c
+            upper = upper_c(*outer_points) if callable(upper_c) else upper_c
+            width = np.asarray(upper, dtype=float) - np.asarray(lower, dtype=float)
+            if not np.all(np.isfinite(width)):
+                return None
+            points[index] = lower + width * unit_points[:, index]
+            jacobian = jacobian * width
+        with np.errstate(all='ignore'):
+            values = np.asarray(integrand(*points), dtype=float) * jacobian
+        estimates.append(float(np.mean(values)))
+    value = float(np.mean(estimates))
+    error = float(np.std(estimates, ddof=1) / math.sqrt(QMC_REPLICATES))
+    return value, error
+
+
+# --- 误差传递 (一阶线性) ---
+# 公式及其各变量偏导只求一次并编译为 numpy 函数，之后整张测量表逐行向量化求值。
+CORRELATION_KEY_PATTERN = re.compile(r'^\s*(cov\s*\()?\s*([A-Za-z_]\w*)\s*,\s*([A-Za-z_]\w*)\s*(?(1)\))\s*$')
+
+@functools.lru_cache(maxsize=128)
+def compile_error_propagation(expr_str: str, var_names: Tuple[str, ...]) -> Tuple[Any, List[Any], Any]:
+    """
+    Returns (sympy_expr, partial derivatives, compiled) where compiled(*values)
+    gives [value, d/dvar1, d/dvar2, ...] with numpy broadcasting, or None when
+    the expression has no numpy equivalent and rows must go through subs/evalf.
+    """
+    _load_sympy_stack()
+    var_symbols = [Symbol(name) for name in var_names]
+    sympy_expr = cached_sympify(preprocess_expression_string(expr_str), var_names)
+    unknown = sympy_expr.free_symbols - set(var_symbols)
+    if unknown:
+        raise ValueError(f"Expression uses variables without values: {', '.join(sorted(str(s) for s in unknown))}")
+    partials = [diff(sympy_expr, s_var) for s_var in var_symbols]
+    try:
+        compiled = sympy.lambdify(var_symbols, [sympy_expr] + partials, modules=NUMERIC_LAMBDIFY_MODULES)
+        with np.errstate(all='ignore'):
+            compiled(*([0.5] * len(var_symbols)))
+    except (ZeroDivisionError, OverflowError, ValueError, FloatingPointError):
+        pass
+    except Exception:
+        compiled = None
+    return sympy_expr, partials, compiled
+
+def parse_measurement_table(vars_errors: Dict[str, Any]) -> Tuple[Tuple[str, ...], Any, Any, bool]:
+    """
+    Accepts per variable either (value, error), a row list [(value, error), ...]
+    or columns (values, errors) where either side may be a scalar; all variables
+    are broadcast to a common number of rows. Returns (names, values, errors, is_table)
+    with values/errors shaped (rows, variables).
+    """
+    _load_numpy()
+    names = tuple(str(name) for name in vars_errors)
+    value_columns, error_columns = [], []
+    for name, spec in vars_errors.items():
+        if is_array(spec):
+            spec = spec.tolist()
+        if isinstance(spec, list) and spec and all(isinstance(row, (tuple, list)) for row in spec):
+            if not all(len(row) == 2 for row in spec):
+                raise ValueError(f"Each row of '{name}' must be (value, error).")
+            values, errors = [row[0] for row in spec], [row[1] for row in spec]
+        elif isinstance(spec, (tuple, list)) and len(spec) == 2:
+            values, errors = spec
+        else:
+            raise ValueError(f"Variable '{name}' must be (value, error), [(value, error), ...] or ([values], [errors]).")
+        try:
+            value_columns.append(np.asarray(values, dtype=float))
+            error_columns.append(np.asarray(errors, dtype=float))
+        except (TypeError, ValueError):
+            raise ValueError(f"Values and errors of '{name}' must be numeric.")
+    columns = value_columns + error_columns
+    if any(column.ndim > 1 for column in columns):
+        raise ValueError("Values and errors must be scalars or one-dimensional lists.")
+    is_table = any(column.ndim == 1 for column in columns)
+    try:
+        columns = np.broadcast_arrays(*[np.atleast_1d(column) for column in columns])
+    except ValueError:
+        raise ValueError("All measurement columns must have the same number of rows.")
+    if columns[0].size > MAX_ARRAY_SIZE:
+        raise ValueError(f"Too many rows ({columns[0].size}, limit {MAX_ARRAY_SIZE}).")
+    values = np.stack(columns[:len(names)], axis=-1)
+    errors = np.stack(columns[len(names):], axis=-1)
+    return names, values, errors, is_table
+
+def parse_correlations(correlations: Any, names: Tuple[str, ...]) -> Tuple[Any, Any]:
+    """
+    {'a,b': rho} gives correlation coefficients (scaled by each row's errors),
+    {'cov(a,b)': c} absolute covariances. Returns (correlation matrix, covariance matrix).
+    """
+    k = len(names)
+    correlation = np.eye(k)
+    covariance = np.zeros((k, k))
+    if correlations is None:
+        return correlation, covariance
+    if not isinstance(correlations, dict):
+        raise ValueError("Correlations must be a dict like {'a,b': rho} or {'cov(a,b)': covariance}.")
+    index = {name: i for i, name in enumerate(names)}
+    for key, value in correlations.items():
+        match = CORRELATION_KEY_PATTERN.match(str(key))
+        if not match:
+            raise ValueError(f"Invalid correlation key '{key}', expected 'a,b' or 'cov(a,b)'.")
+        is_cov, first, second = match.group(1) is not None, match.group(2), match.group(3)
+        for name in (first, second):
+            if name not in index:
+                raise ValueError(f"Correlation refers to unknown variable '{name}'.")
+        if first == second:
+            raise ValueError(f"Correlation key '{key}' must name two different variables.")
+        if not isinstance(value, (int, float)):
+            raise ValueError(f"Correlation '{key}' must be a number.")
+        i, j = index[first], index[second]
+        if is_cov:
+            covariance[i, j] = covariance[j, i] = value
+        else:
+            if not -1 <= value <= 1:
+                raise ValueError(f"Correlation coefficient '{key}' must be between -1 and 1.")
+            correlation[i, j] = correlation[j, i] = value
+    if np.linalg.eigvalsh(correlation).min() < -1e-10:
+        raise ValueError("Correlation matrix is not positive semi-definite.")
+    return correlation, covariance
+
+def propagate_errors(expr_str: str, vars_errors: Dict[str, Any], correlations: Any = None) -> Tuple[Any, Any, bool]:
+    """Vectorized first-order propagation: sigma^2 = g^T (R * s s^T + C) g for every row."""
+    names, values, errors, is_table = parse_measurement_table(vars_errors)
+    correlation, covariance = parse_correlations(correlations, names)
+    sympy_expr, partials, compiled = compile_error_propagation(expr_str, names)
+
+    if compiled is not None:
+        with np.errstate(all='ignore'):
+            outputs = compiled(*values.T)
+        outputs = [np.broadcast_to(np.asarray(out), values.shape[:1]) for out in outputs]
+        if any(np.iscomplexobj(out) for out in outputs):
+            outputs = [np.where(np.abs(np.imag(out)) < 1e-9, np.real(out), numpy_nan) for out in outputs]
+        row_values = np.asarray(outputs[0], dtype=float)
+        gradients = np.stack([np.asarray(out, dtype=float) for out in outputs[1:]], axis=-1)
+    else:
+        var_symbols = [Symbol(name) for name in names]
+        row_values = np.empty(values.shape[0])
+        gradients = np.empty(values.shape)
+        for row, row_vals in enumerate(values):
+            subs_values = dict(zip(var_symbols, row_vals.tolist()))
+            try:
+                row_values[row] = float(sympy_expr.subs(subs_values).evalf())
+                gradients[row] = [float(p.subs(subs_values).evalf()) for p in partials]
+            except TypeError:
+                row_values[row] = numpy_nan
+                gradients[row] = numpy_nan
+
+    scaled = gradients * errors
+    variance = np.einsum('ni,ij,nj->n', scaled, correlation, scaled)
+    if covariance.any():
+        variance = variance + np.einsum('ni,ij,nj->n', gradients, covariance, gradients)
+    with np.errstate(invalid='ignore'):
+        row_errors = np.sqrt(variance)
+    return row_values, row_errors, is_table
+
+
+# --- 蒙特卡洛误差传递 ---
+# 对强非线性公式或较大相对误差，按输入分布抽样并分块求值。均值/方差按块合并，分位数取自
+# 固定大小的蓄水池样本，内存与总样本数无关。
+MC_DEFAULT_SAMPLES = _env_int('SCICALC_MC_SAMPLES', 1_000_000)
+MC_MAX_SAMPLES = _env_int('SCICALC_MC_MAX_SAMPLES', 10_000_000)
+MC_CHUNK_SIZE = max(1, _env_int('SCICALC_MC_CHUNK_SIZE', 100_000))
+# 分位数用的蓄水池样本数：有限输出不超过该值时分位数是精确的
+MC_RESERVOIR_SIZE = max(1, _env_int('SCICALC_MC_RESERVOIR_SIZE', 200_000))
+MC_DEFAULT_PERCENTILES = (2.5, 16, 50, 84, 97.5)
+MC_DISTRIBUTIONS = {'normal': ('mean', 'std'), 'uniform': ('low', 'high'), 'triangular': ('low', 'mode', 'high'),
+                    'lognormal': ('mu', 'sigma'), 'samples': ('values',)}
+
+@functools.lru_cache(maxsize=128)
+def compile_mc_expression(expr_str: str, var_names: Tuple[str, ...]) -> Any:
+    _load_sympy_stack()
+    var_symbols = [Symbol(name) for name in var_names]
+    sympy_expr = cached_sympify(preprocess_expression_string(expr_str), var_names)
+    unknown = sympy_expr.free_symbols - set(var_symbols)
+    if unknown:
+        raise ValueError(f"Expression uses variables without values: {', '.join(sorted(str(s) for s in unknown))}")
+    compiled = compile_numeric_integrand(sympy_expr, var_symbols)
+    if compiled is None:
+        raise ValueError("Monte Carlo propagation needs an expression with a numpy equivalent.")
+    return compiled
+
+def make_sampler(name: str, spec: Any) -> Any:
+    """
+    (value, error) samples a normal distribution. Other distributions are named
+    explicitly as {'dist': ..., <parameters>} with the parameter names listed in
+    MC_DISTRIBUTIONS, e.g. {'dist': 'uniform', 'low': 0, 'high': 1}; the
+    positional ('uniform', low, high) form is equivalent. User-supplied samples
+    are resampled with replacement only when given as {'dist': 'samples', 'values': [...]}.
+    """
+    if is_array(spec):
+        spec = spec.tolist()
+    if isinstance(spec, dict):
+        dist = str(spec.get('dist', '')).strip().lower()
+        if dist not in MC_DISTRIBUTIONS:
+            raise ValueError(f"Unknown distribution '{spec.get('dist')}' for '{name}'. Use one of: {', '.join(MC_DISTRIBUTIONS)}.")
+        fields = MC_DISTRIBUTIONS[dist]
+        if set(spec) != {'dist', *fields}:
+            raise ValueError(f"Distribution '{dist}' of '{name}' takes exactly: {', '.join(fields)}.")
+        params = [spec[field] for field in fields]
+    elif isinstance(spec, (tuple, list)) and spec and isinstance(spec[0], str):
+        dist = spec[0].strip().lower()
+        params = list(spec[1:])
+        if dist not in MC_DISTRIBUTIONS or dist == 'samples' or len(params) != len(MC_DISTRIBUTIONS[dist]):
+            raise ValueError(f"Unknown distribution spec for '{name}': {spec}. Use one of " +
+                             ", ".join(f"{{'dist': '{d}', " + ", ".join(f"'{f}': ..." for f in fields) + "}"
+                                       for d, fields in MC_DISTRIBUTIONS.items()))
+    elif isinstance(spec, (tuple, list)) and len(spec) == 2:
+        dist, params = 'normal', list(spec)
+    else:
+        raise ValueError(f"Variable '{name}' must be (value, error) or {{'dist': ..., ...}}; "
+                         "resample data with {'dist': 'samples', 'values': [...]}.")
+    if dist == 'samples':
+        try:
+            values = np.asarray(params[0], dtype=float)
+        except (TypeError, ValueError):
+            values = None
+        if values is None or values.ndim != 1 or values.size == 0:
+            raise ValueError(f"'values' of '{name}' must be a non-empty list of numbers.")
+        params = [values]
+    elif not all(isinstance(p, (int, float)) and not isinstance(p, bool) for p in params):
+        raise ValueError(f"Distribution parameters of '{name}' must be numeric.")
+    if dist in ('normal', 'lognormal') and params[1] < 0:
+        raise ValueError(f"Standard deviation of '{name}' must not be negative.")
+    if dist == 'uniform' and params[0] > params[1]:
+        raise ValueError(f"Uniform bounds of '{name}' must satisfy low <= high.")
+    if dist == 'triangular' and not params[0] <= params[1] <= params[2]:
+        raise ValueError(f"Triangular parameters of '{name}' must satisfy low <= mode <= high.")
+
+    def sample(rng: Any, size: int) -> Any:
+        if dist == 'normal':
+            return rng.normal(params[0], params[1], size)
+        if dist == 'uniform':
+            return rng.uniform(params[0], params[1], size)
+        if dist == 'triangular':
+            return rng.triangular(params[0], params[1], params[2], size) if params[0] < params[2] else np.full(size, float(params[0]))
+        if dist == 'lognormal':
+            return rng.lognormal(params[0], params[1], size)
+        return rng.choice(params[0], size)
+    return sample
+
+def reservoir_update(reservoir: Any, seen: int, chunk: Any, rng: Any) -> None:
+    """
+    Algorithm R applied to a whole chunk at once: afterwards `reservoir` holds a
+    uniform sample of the `seen + chunk.size` values offered so far.
+    """
+    capacity = len(reservoir)
+    filled = min(chunk.size, max(0, capacity - seen))
+    reservoir[seen:seen + filled] = chunk[:filled]
+    rest = chunk[filled:]
+    if rest.size:
+        positions = np.arange(seen + filled, seen + chunk.size)
+        slots = (rng.random(rest.size) * (positions + 1)).astype(np.int64)
+        keep = slots < capacity
+        reservoir[slots[keep]] = rest[keep]
+
+def monte_carlo_propagation(expr_str: str, vars_spec: Dict[str, Any], samples: int,
+                            seed: int, percentiles: Tuple[float, ...]) -> Dict[str, Any]:
+    """
+    Evaluate the compiled expression over `samples` draws in chunks of
+    MC_CHUNK_SIZE. Mean and variance are merged chunk by chunk; percentiles
+    come from a reservoir of at most MC_RESERVOIR_SIZE finite outputs (exact
+    when there are no more finite outputs than that), so memory is one chunk
+    of inputs plus the reservoir, independent of `samples`.
+    """
+    _load_numpy()
+    if not 1 <= samples <= MC_MAX_SAMPLES:
+        raise ValueError(f"samples must be between 1 and {MC_MAX_SAMPLES}.")
+    names = tuple(str(name) for name in vars_spec)
+    samplers = [make_sampler(name, spec) for name, spec in zip(names, vars_spec.values())]
+    compiled = compile_mc_expression(expr_str, names)
+    rng = np.random.default_rng(seed)
+    # 蓄水池用独立的随机流，抽样序列 (以及均值/方差) 与蓄水池大小无关
+    reservoir_rng = np.random.default_rng([seed, 1])
+    reservoir = np.empty(min(samples, MC_RESERVOIR_SIZE))
+    count, mean, m2 = 0, 0.0, 0.0
+    for start in range(0, samples, MC_CHUNK_SIZE):
+        size = min(MC_CHUNK_SIZE, samples - start)
+        draws = [sampler(rng, size) for sampler in samplers]
+        with np.errstate(all='ignore'):
+            chunk = np.asarray(np.broadcast_to(compiled(*draws), (size,)), dtype=float)
+        chunk = chunk[np.isfinite(chunk)]
+        if chunk.size == 0:
+            continue
+        # 非有限值被丢弃，有限值进入蓄水池；均值/方差按块合并 (Chan 算法)
+        reservoir_update(reservoir, count, chunk, reservoir_rng)
+        chunk_mean = float(chunk.mean())
+        chunk_m2 = float(((chunk - chunk_mean) ** 2).sum())
+        delta = chunk_mean - mean
+        total = count + chunk.size
+        mean += delta * chunk.size / total
+        m2 += chunk_m2 + delta * delta * count * chunk.size / total
+        count = total
+    if count == 0:
+        raise ValueError("No sample produced a finite value.")
+    return {
+        'mean': mean,
+        'std': math.sqrt(m2 / (count - 1)) if count > 1 else 0.0,
+        'percentiles': dict(zip(percentiles, np.percentile(reservoir[:min(count, len(reservoir))], percentiles,
+                                                           overwrite_input=True).tolist())),
+        'samples': samples,
+        'percentile_samples': min(count, len(reservoir)),
+        'invalid': samples - count,
+        'seed': seed,
+    }
+
+
+# --- 方程求解与一维优化 (solve / nsolve / minimize / maximize) ---
+# 符号求解优先 (solveset)；数值路径在向量化网格上一次性找出所有变号区间，
+# 再对所有区间同时二分细化。极值同样先网格扫描，再对所有候选同时做黄金分割。
+SOLVER_FUNCTIONS = {'solve', 'nsolve', 'minimize', 'maximize'}
+SOLVE_DEFAULT_RANGE = (-100.0, 100.0)
+SOLVE_SCAN_POINTS = 20001
+# 无法 lambdify 的表达式逐点 subs/evalf，网格相应变粗
+SOLVE_SCAN_POINTS_SUBS = 801
+SOLVE_REFINE_ITERATIONS = 100
+MAX_REPORTED_SOLUTIONS = 100
+# 无变号的重根 (如 (x-1)**2) 只有在 |f| 的局部极小值足够接近 0 时才被接受
+DOUBLE_ROOT_TOLERANCE = 1e-10
+GOLDEN_RATIO_CONJUGATE = (math.sqrt(5) - 1) / 2
+EQUATION_SPLIT_PATTERN = re.compile(r'(?<![=<>!])=(?!=)')
+
+def equation_to_expression(expr_str: str) -> str:
+    """'lhs = rhs' (或 'lhs == rhs') 转换为 'lhs - (rhs)'，其余原样返回。"""
+    expr_str = preprocess_expression_string(expr_str).replace('==', '=')
+    parts = EQUATION_SPLIT_PATTERN.split(expr_str)
+    if len(parts) == 1:
+        return expr_str
+    if len(parts) != 2 or not parts[0].strip() or not parts[1].strip():
+        raise ValueError(f"Equation must have the form 'lhs = rhs', got '{expr_str}'.")
+    return f"({parts[0].strip()}) - ({parts[1].strip()})"
+
+def setup_solver(original_expr_str: str, var_name_str: str, lower_in: Any, upper_in: Any) -> Tuple[Any, Any, Any, Any]:
+    var_symbol = Symbol(var_name_str)
+    solver_locals = base_sympy_locals.copy()
+    solver_locals[var_name_str] = var_symbol
+    expr = cached_sympify(equation_to_expression(original_expr_str), (var_name_str,))
+    others = expr.free_symbols - {var_symbol}
+    if others:
+        raise ValueError(f"Expression uses variables other than '{var_name_str}': {', '.join(sorted(str(s) for s in others))}")
+    return (var_symbol, expr, standardize_limit(lower_in, solver_locals), standardize_limit(upper_in, solver_locals))
+
+def _scan_range(sympy_lower: Any, sympy_upper: Any) -> Tuple[float, float]:
+    if sympy_lower is None and sympy_upper is None:
+        return SOLVE_DEFAULT_RANGE
+    lower, upper = float(sympy_lower.evalf()), float(sympy_upper.evalf())
+    if not (math.isfinite(lower) and math.isfinite(upper)):
+        raise ValueError("Numeric scan needs a finite range (lower, upper).")
+    if lower >= upper:
+        raise ValueError(f"lower limit {lower:g} must be less than upper limit {upper:g}.")
+    return lower, upper
+
+def vectorized_function(expr: Any, var_symbol: Any) -> Tuple[Any, int]:
+    """Compiled numpy function of one variable (NaN where undefined) and the grid size to scan it with."""
+    compiled = compile_numeric_integrand(expr, var_symbol)
+    if compiled is not None:
+        return compiled, SOLVE_SCAN_POINTS
+    return np.vectorize(_subs_integrand(expr, [var_symbol]), otypes=[float]), SOLVE_SCAN_POINTS_SUBS
+
+def _merge_close(points: List[float], tolerance: float) -> List[float]:
+    merged: List[float] = []
+    for point in sorted(points):
+        if not merged or point - merged[-1] > tolerance:
+            merged.append(point)
+    return merged
+
+def golden_section_minimize(f: Any, left: Any, right: Any, iterations: int = SOLVE_REFINE_ITERATIONS) -> Any:
+    """Vectorized golden-section search: refines every [left, right] bracket at once (NaN counts as +inf)."""
+    def g(x: Any) -> Any:
+        with np.errstate(all='ignore'):
+            values = np.asarray(f(x), dtype=float)
+        return np.where(np.isnan(values), numpy_inf, values)
+
+    a, b = np.asarray(left, dtype=float), np.asarray(right, dtype=float)
+    c = b - GOLDEN_RATIO_CONJUGATE * (b - a)
+    d = a + GOLDEN_RATIO_CONJUGATE * (b - a)
+    fc, fd = g(c), g(d)
+    for _ in range(iterations):
+        go_left = fc < fd
+        b = np.where(go_left, d, b)
+        a = np.where(go_left, a, c)
+        new_c = b - GOLDEN_RATIO_CONJUGATE * (b - a)
+        new_d = a + GOLDEN_RATIO_CONJUGATE * (b - a)
+        f_probe = g(np.where(go_left, new_c, new_d))
+        c, d, fc, fd = (np.where(go_left, new_c, d), np.where(go_left, c, new_d),
+                        np.where(go_left, f_probe, fd), np.where(go_left, fc, f_probe))
+        if np.all(b - a <= 4 * np.finfo(float).eps * np.maximum(1.0, np.abs(a))):
+            break
+    return 0.5 * (a + b)
+
+def find_roots(f: Any, lower: float, upper: float, points: int = SOLVE_SCAN_POINTS) -> List[float]:
+    """
+    Scan f on a grid, bracket every sign change and bisect all brackets
+    together; sign changes at poles or jumps are rejected because |f| does not
+    vanish there. Touching roots without a sign change are found as local
+    minima of |f| that are (numerically) zero.
+    """
+    grid = np.linspace(lower, upper, points)
+    with np.errstate(all='ignore'):
+        values = np.asarray(f(grid), dtype=float)
+    finite = np.isfinite(values)
+    if not finite.any():
+        return []
+    roots = grid[finite & (values == 0)].tolist()
+    scale = max(1.0, float(np.median(np.abs(values[finite]))))
+
+    idx = np.flatnonzero(finite[:-1] & finite[1:] & (np.sign(values[:-1]) * np.sign(values[1:]) < 0))
+    if idx.size:
+        left, right, f_left = grid[idx], grid[idx + 1], values[idx]
+        for _ in range(SOLVE_REFINE_ITERATIONS):
+            mid = 0.5 * (left + right)
+            with np.errstate(all='ignore'):
+                f_mid = np.asarray(f(mid), dtype=float)
+            same_sign = np.sign(f_mid) == np.sign(f_left)
+            left = np.where(same_sign, mid, left)
+            f_left = np.where(same_sign, f_mid, f_left)
+            right = np.where(same_sign, right, mid)
+            if np.all(right - left <= 4 * np.finfo(float).eps * np.maximum(1.0, np.abs(left))):
+                break
+        candidates = 0.5 * (left + right)
+        with np.errstate(all='ignore'):
+            residual = np.abs(np.asarray(f(candidates), dtype=float))
+        bracket_scale = np.maximum(np.abs(values[idx]), np.abs(values[idx + 1]))
+        roots.extend(candidates[residual <= 1e-6 * np.maximum(1.0, bracket_scale)].tolist())
+
+    abs_values = np.where(finite, np.abs(values), numpy_inf)
+    interior = np.arange(1, points - 1)
+    minima = interior[(abs_values[interior] <= abs_values[interior - 1]) & (abs_values[interior] <= abs_values[interior + 1])
+                      & (abs_values[interior] > 0) & np.isfinite(abs_values[interior])]
+    if minima.size:
+        touching = golden_section_minimize(lambda x: np.abs(f(x)), grid[minima - 1], grid[minima + 1])
+        with np.errstate(all='ignore'):
+            residual = np.abs(np.asarray(f(touching), dtype=float))
+        roots.extend(touching[residual <= DOUBLE_ROOT_TOLERANCE * scale].tolist())
+    tolerance = 1e-9 * (upper - lower)
+    # 数值噪声级别的根 (如 tan(x) 的 -2.2e-16) 归零
+    return _merge_close([0.0 if abs(r) < 1e-3 * tolerance else r for r in roots], tolerance)
+
+def find_extremum(f: Any, lower: float, upper: float, maximize: bool, points: int = SOLVE_SCAN_POINTS) -> Tuple[float, float]:
+    """Global extremum on [lower, upper]: grid scan, then golden-section refinement of every local candidate."""
+    sign = -1.0 if maximize else 1.0
+    objective = lambda x: sign * np.asarray(f(x), dtype=float)
+    grid = np.linspace(lower, upper, points)
+    with np.errstate(all='ignore'):
+        values = objective(grid)
+    values = np.where(np.isnan(values), numpy_inf, values)
+    if not np.isfinite(values).any():
+        raise ValueError("Function has no finite values on the range.")
+    interior = np.arange(1, points - 1)
+    minima = interior[(values[interior] <= values[interior - 1]) & (values[interior] <= values[interior + 1])]
+    candidates = [grid[0], grid[-1], grid[int(np.argmin(values))]]
+    if minima.size:
+        candidates.extend(golden_section_minimize(objective, grid[minima - 1], grid[minima + 1]).tolist())
+    candidates = np.asarray(candidates)
+    with np.errstate(all='ignore'):
+        candidate_values = objective(candidates)
+    candidate_values = np.where(np.isnan(candidate_values), numpy_inf, candidate_values)
+    best = int(np.argmin(candidate_values))
+    if not np.isfinite(candidate_values[best]):
+        raise ValueError(f"Function is unbounded {'above' if maximize else 'below'} on the range "
+                         f"(near {format_scalar(float(candidates[best]))}).")
+    return float(candidates[best]), float(sign * candidate_values[best])
+
+def format_solutions(var_name_str: str, solutions: List[float]) -> str:
+    shown = ', '.join(format_scalar(v) for v in solutions[:MAX_REPORTED_SOLUTIONS])
+    if len(solutions) > MAX_REPORTED_SOLUTIONS:
+        shown += f", ... ({len(solutions)} solutions)"
+    return f"{var_name_str} = [{shown}]"
+
+def compute_solver(kind: str, original_expr_str: str, var_name_str: str, lower_in: Any, upper_in: Any,
+                   info: Dict[str, Any] = None, use_cache: bool = True) -> Any:
+    if info is None:
+        info = {}
+    try:
+        cache_key = solver_cache_key(kind, original_expr_str, var_name_str, lower_in, upper_in)
+    except Exception:
+        cache_key, use_cache = None, False
+
+    def compute(call_info: Dict[str, Any]) -> Any:
+        args = (original_expr_str, var_name_str, lower_in, upper_in)
+        if kind in ('minimize', 'maximize'):
+            return _compute_extremum(kind == 'maximize', *args, call_info)
+        if kind == 'nsolve':
+            return _compute_solve_numeric(*args, call_info)
+        if integral_race_enabled():
+            contenders = {'symbolic': (_compute_solve_uncached, args), 'numeric': (_compute_solve_numeric, args)}
+            return race_symbolic_numeric(original_expr_str, contenders, call_info, race_budget_seconds(),
+                                         task='solving', note_key='solve_note',
+                                         numeric_is_final=lambda result: not str(result).startswith(ERROR_PREFIXES))
+        return _compute_solve_uncached(*args, call_info)
+
+    return cached_call(cache_key, info, use_cache, compute)
+
+def _compute_solve_uncached(original_expr_str: str, var_name_str: str, lower_in: Any, upper_in: Any,
+                            info: Dict[str, Any]) -> Any:
+    _load_sympy_stack()
+    try:
+        var_symbol, expr, sympy_lower, sympy_upper = setup_solver(original_expr_str, var_name_str, lower_in, upper_in)
+        has_range = not (sympy_lower is None and sympy_upper is None)
+        if has_range and bool(sympy_lower >= sympy_upper):
+            raise ValueError(f"lower limit {sympy_lower} must be less than upper limit {sympy_upper}.")
+        domain = sympy.Interval(sympy_lower, sympy_upper) if has_range else sympy.S.Reals
+        solution_set = sympy.solveset(expr, var_symbol, domain)
+
+        if isinstance(solution_set, sympy.FiniteSet) or solution_set is sympy.S.EmptySet:
+            solutions = []
+            for solution in solution_set:
+                value = complex(solution.evalf())
+                if abs(value.imag) < 1e-12:
+                    solutions.append(value.real)
+            info.setdefault('solve_path', []).append('symbolic')
+            info.setdefault('solutions', []).extend(solutions)
+            if not solutions:
+                return f"No real solutions for {var_name_str}" + (f" in [{latex(sympy_lower)}, {latex(sympy_upper)}]" if has_range else "")
+            result = format_solutions(var_name_str, sorted(solutions))
+            exact_latex = latex(solution_set)
+            if not all(isinstance(solution, Integer) for solution in solution_set) \
+                    and not solution_set.has(sympy.CRootOf) and len(exact_latex) <= 300:
+                result += f" ($${exact_latex}$$)"
+            return result
+        if not has_range and not isinstance(solution_set, sympy.ConditionSet):
+            # 无穷解集 (如 sin(x) = 0) 只能以符号形式给出
+            info.setdefault('solve_path', []).append('symbolic')
+            return f"$${var_name_str} \\in {latex(solution_set)}$$"
+        prefix = f"Symbolic solution unavailable ($${latex(solution_set)}$$). "
+        return prefix + _compute_solve_numeric(original_expr_str, var_name_str, lower_in, upper_in, info)
+    except ValueError as ve:
+        return f"Error in solve setup for '{original_expr_str}' with var '{var_name_str}': {str(ve)}"
+    except Exception as e:
+        return f"Error in solve computation for '{original_expr_str}': {type(e).__name__} - {str(e)}"
+
+def _compute_solve_numeric(original_expr_str: str, var_name_str: str, lower_in: Any, upper_in: Any,
+                           info: Dict[str, Any]) -> Any:
+    _load_sympy_stack()
+    try:
+        var_symbol, expr, sympy_lower, sympy_upper = setup_solver(original_expr_str, var_name_str, lower_in, upper_in)
+        lower, upper = _scan_range(sympy_lower, sympy_upper)
+        f, points = vectorized_function(expr, var_symbol)
+        roots = find_roots(f, lower, upper, points)
+        info.setdefault('solve_path', []).append('numeric-scan')
+        info.setdefault('solutions', []).extend(roots)
+        scanned = f"numeric scan of [{format_scalar(lower)}, {format_scalar(upper)}]"
+        if not roots:
+            return f"No real roots found for {var_name_str} ({scanned})"
+        return f"{format_solutions(var_name_str, roots)} ({scanned})"
+    except ValueError as ve:
+        return f"Error in solve setup for '{original_expr_str}' with var '{var_name_str}': {str(ve)}"
+    except Exception as e:
+        return f"Error in numerical solve for '{original_expr_str}': {type(e).__name__} - {str(e)}"
+
+def _compute_extremum(maximize: bool, original_expr_str: str, var_name_str: str, lower_in: Any, upper_in: Any,
+                      info: Dict[str, Any]) -> Any:
+    _load_sympy_stack()
+    label = 'maximize' if maximize else 'minimize'
+    try:
+        var_symbol, expr, sympy_lower, sympy_upper = setup_solver(original_expr_str, var_name_str, lower_in, upper_in)
+        lower, upper = _scan_range(sympy_lower, sympy_upper)
+        f, points = vectorized_function(expr, var_symbol)
+        x_best, f_best = find_extremum(f, lower, upper, maximize, points)
+        info.setdefault('extremum', []).append([x_best, f_best])
+        return f"{'Maximum' if maximize else 'Minimum'} {format_scalar(f_best)} at {var_name_str} = {format_scalar(x_best)}"
+    except ValueError as ve:
+        return f"Error in {label} setup for '{original_expr_str}' with var '{var_name_str}': {str(ve)}"
+    except Exception as e:
+        return f"Error in {label} computation for '{original_expr_str}': {type(e).__name__} - {str(e)}"
+
+
+# --- 曲线拟合 (fit) ---
+# 模型对参数线性时 (含多项式) 直接用最小二乘闭式解；否则用符号推导的解析 Jacobian
+# 编译后交给 scipy.optimize.curve_fit (Levenberg-Marquardt)。
+FIT_POLYNOMIAL_PATTERN = re.compile(r'^\s*poly(\d+)\s*$', re.I)
+MAX_FIT_PARAMETERS = 20
+# 残差平方和/总平方和低于 数据平方和 × 该值时视为舍入误差 (常数数据的 R²)
+FIT_R_SQUARED_TOLERANCE = 1e-20
+
+def expand_fit_model(model_str: str, param_names: Any) -> Tuple[str, Tuple[str, ...]]:
+    """'linear' 与 'polyN' 简写展开为显式模型，参数名可省略。"""
+    shorthand = model_str.strip().lower()
+    if shorthand == 'linear':
+        return 'a*x + b', tuple(param_names or ('a', 'b'))
+    match = FIT_POLYNOMIAL_PATTERN.match(shorthand)
+    if match:
+        degree = int(match.group(1))
+        names = tuple(param_names or (f'c{i}' for i in range(degree + 1)))
+        return ' + '.join(f'{name}*x**{i}' for i, name in enumerate(names)), names
+    if not param_names:
+        raise ValueError("fit() needs the list of parameter names, e.g. fit('a*exp(b*x)', xs, ys, ['a', 'b']).")
+    return model_str, tuple(param_names)
+
+@functools.lru_cache(maxsize=64)
+def compile_fit_model(model_str: str, param_names: Tuple[str, ...]) -> Dict[str, Any]:
+    """
+    Sympify the model once: returns the independent variable name, whether the
+    model is linear in its parameters, and numpy callables for the model and
+    its analytic Jacobian (both take (x, *params)).
+    """
+    _load_sympy_stack()
+    param_symbols = [Symbol(name) for name in param_names]
+    model = cached_sympify(preprocess_expression_string(model_str), param_names + ('x',))
+    others = sorted(model.free_symbols - set(param_symbols), key=str)
+    if len(others) > 1:
+        raise ValueError(f"Model must have a single independent variable, found: {', '.join(map(str, others))}")
+    var_symbol = others[0] if others else Symbol('x')
+    jacobian = [diff(model, p) for p in param_symbols]
+    is_linear = all(diff(column, p) == 0 for column in jacobian for p in param_symbols)
+    arguments = [var_symbol] + param_symbols
+    model_f = sympy.lambdify(arguments, model, modules=NUMERIC_LAMBDIFY_MODULES)
+    jacobian_f = sympy.lambdify(arguments, jacobian, modules=NUMERIC_LAMBDIFY_MODULES)
+    return {'var': str(var_symbol), 'linear': is_linear, 'model': model_f, 'jacobian': jacobian_f}
+
+def _fit_columns(values: Any, n: int) -> Any:
+    """Broadcast lambdify output (scalars for constant terms) to float columns of length n."""
+    return np.column_stack([np.broadcast_to(np.asarray(v, dtype=float), (n,)) for v in values])
+
+def fit_model(model_str: str, xs: Any, ys: Any, param_names: Tuple[str, ...], initial: Any = None) -> Dict[str, Any]:
+    _load_scipy_stack()
+    if not 1 <= len(param_names) <= MAX_FIT_PARAMETERS:
+        raise ValueError(f"fit() supports 1 to {MAX_FIT_PARAMETERS} parameters.")
+    if len(set(param_names)) != len(param_names) or not all(name.isidentifier() for name in param_names):
+        raise ValueError("Parameter names must be distinct identifiers.")
+    x = np.asarray(xs, dtype=float).ravel()
+    y = np.asarray(ys, dtype=float).ravel()
+    if x.size != y.size:
+        raise ValueError(f"xs and ys must have the same length, got {x.size} and {y.size}.")
+    mask = np.isfinite(x) & np.isfinite(y)
+    x, y = x[mask], y[mask]
+    n, k = x.size, len(param_names)
+    if n < k:
+        raise ValueError(f"Need at least {k} finite data points to fit {k} parameters, got {n}.")
+
+    compiled = compile_fit_model(model_str, param_names)
+    if compiled['linear']:
+        # 对参数线性：设计矩阵就是 Jacobian 列，偏移项是参数取 0 时的模型值
+        zeros = [0.0] * k
+        with np.errstate(all='ignore'):
+            design = _fit_columns(compiled['jacobian'](x, *zeros), n)
+            offset = np.broadcast_to(np.asarray(compiled['model'](x, *zeros), dtype=float), (n,))
+        if not (np.all(np.isfinite(design)) and np.all(np.isfinite(offset))):
+            raise ValueError("Model is not defined at every x value.")
+        params, _residuals, rank, _sv = np.linalg.lstsq(design, y - offset, rcond=None)
+        if rank < k:
+            raise ValueError("Parameters are not identifiable from these data (rank-deficient design matrix).")
+        residual = y - offset - design @ params
+        dof = n - k
+        with np.errstate(all='ignore'):
+            covariance = np.linalg.pinv(design.T @ design) * (residual @ residual / dof if dof > 0 else numpy_inf)
+        method = 'linear-lstsq'
+    else:
+        from scipy.optimize import curve_fit
+        if initial is None:
+            p0 = np.ones(k)
+        elif isinstance(initial, dict):
+            unknown = set(initial) - set(param_names)
+            if unknown:
+                raise ValueError(f"Initial guesses for unknown parameters: {', '.join(sorted(map(str, unknown)))}")
+            p0 = np.array([float(initial.get(name, 1.0)) for name in param_names])
+        else:
+            p0 = np.asarray(initial, dtype=float).ravel()
+            if p0.size != k:
+                raise ValueError(f"Expected {k} initial guesses, got {p0.size}.")
+
+        def model_f(x_vals: Any, *p: float) -> Any:
+            return np.broadcast_to(np.asarray(compiled['model'](x_vals, *p), dtype=float), x_vals.shape)
+
+        def jacobian_f(x_vals: Any, *p: float) -> Any:
+            return _fit_columns(compiled['jacobian'](x_vals, *p), x_vals.size)
+
+        with warnings.catch_warnings(), np.errstate(all='ignore'):
+            warnings.simplefilter('ignore')
+            try:
+                params, covariance = curve_fit(model_f, x, y, p0=p0, jac=jacobian_f, maxfev=20000)
+            except RuntimeError as e:
+                raise ValueError(f"Least-squares fit did not converge ({e}); try other initial guesses.")
+        residual = y - model_f(x, *params)
+        method = 'nonlinear-lm'
+
+    rss = float(residual @ residual)
+    tss = float(np.sum((y - y.mean()) ** 2))
+    tolerance = FIT_R_SQUARED_TOLERANCE * max(float(y @ y), np.finfo(float).tiny)
+    if tss > tolerance:
+        r_squared = 1.0 - rss / tss
+    else:
+        # 常数数据：完全拟合时 R² 记为 1，否则无定义
+        r_squared = 1.0 if rss <= tolerance else None
+    with np.errstate(invalid='ignore'):
+        stderr = np.sqrt(np.clip(np.diag(covariance), 0, None))
+    # 数据点数等于参数个数时协方差为 inf (无自由度)，输出中记为 null
+    return {
+        'params': dict(zip(param_names, params.tolist())),
+        'stderr': dict(zip(param_names, json_safe(stderr.tolist()))),
+        'covariance': json_safe(covariance.tolist()),
+        'r_squared': json_safe(r_squared),
+        'n': n,
+        'method': method,
+        'var': compiled['var'],
+    }
+
+
+# --- 矩阵与线性代数 ---
+# 数值计算走 numpy / scipy.linalg；小型整数矩阵只在奇异、病态或显式传入 'exact' 时才走 SymPy Matrix 的精确路径。
+MATRIX_FUNCTIONS = {'det', 'inv', 'solve_linear', 'eig', 'svd', 'matmul', 'lstsq', 'norm', 'base64_matrix'}
+# O(n^3) 分解允许的最大维数 (元素总数另受 MAX_ARRAY_SIZE 限制)
+MAX_MATRIX_DIM = 1000
+MAX_EXACT_MATRIX_DIM = 6
+# 条件数超过该值的整数矩阵 (含奇异矩阵) 改用精确有理数计算
+EXACT_MATRIX_CONDITION_LIMIT = 1e10
+EXACT_FLAG = 'exact'
+NORM_ORDERS = {'fro': 'fro', 'nuc': 'nuc', 'inf': math.inf, '-inf': -math.inf}
+
+def to_matrix(value: Any, name: str = 'matrix', square: bool = False) -> Any:
+    """Nested list / array -> 2-D float (or complex) array, checking shape and size limits."""
+    arr = to_array(value)
+    if arr.ndim != 2:
+        raise ValueError(f"{name} must be a 2-D matrix (nested list), got {arr.ndim}-D data.")
+    if max(arr.shape) > MAX_MATRIX_DIM:
+        raise ValueError(f"{name} is too large ({arr.shape[0]}x{arr.shape[1]}, limit {MAX_MATRIX_DIM} per dimension).")
+    if square and arr.shape[0] != arr.shape[1]:
+        raise ValueError(f"{name} must be square, got {arr.shape[0]}x{arr.shape[1]}.")
+    if not np.all(np.isfinite(arr)):
+        raise ValueError(f"{name} contains non-finite values.")
+    return arr
 
+def is_small_int_matrix(value: Any) -> bool:
+    if not (isinstance(value, list) and value and len(value) <= MAX_EXACT_MATRIX_DIM):
+        return False
+    if not all(isinstance(row, list) and row and len(row) == len(value[0]) <= MAX_EXACT_MATRIX_DIM for row in value):
+        return False
+    return all(isinstance(item, int) and not isinstance(item, bool) for row in value for item in row)
+
+def exact_matrix(value: Any, exact: bool = False) -> Any:
+    """
+    A SymPy Matrix for small matrices of Python integers that need exact arithmetic: always when
+    `exact` is requested, otherwise only if the matrix is singular or ill-conditioned (where the
+    float result would be meaningless). None for anything else, which then goes through numpy.
+    """
+    if not is_small_int_matrix(value):
+        return None
+    if not exact:
+        arr = np.array(value, dtype=float)
+        if arr.shape[0] != arr.shape[1]:
+            return None
+        with np.errstate(all='ignore'):
+            condition = np.linalg.cond(arr)
+        if np.isfinite(condition) and condition < EXACT_MATRIX_CONDITION_LIMIT:
+            return None
+    _load_sympy_stack()
+    return sympy.Matrix(value)
+
+def split_exact_flag(func_name: str, args: List[Any], arity: int) -> Tuple[List[Any], bool]:
+    """Strip an optional trailing 'exact' argument (det/inv/solve_linear)."""
+    if len(args) == arity + 1 and isinstance(args[-1], str):
+        if args[-1].strip().lower() != EXACT_FLAG:
+            raise ValueError(f"{func_name}(): unknown option '{args[-1]}' (only '{EXACT_FLAG}' is supported).")
+        return args[:-1], True
+    return args, False
+
+def exact_result(value: Any, as_vector: bool = False) -> Any:
+    """Integer results become numbers/arrays; rational ones keep their exact form as text."""
+    if isinstance(value, sympy.MatrixBase):
+        rows = [list(value)] if as_vector else value.tolist()
+        if all(item.is_Integer for item in value):
+            return np.array(rows[0] if as_vector else rows, dtype=float)
+        text = ['[' + ', '.join(str(item) for item in row) + ']' for row in rows]
+        return text[0] if as_vector else '[' + ', '.join(text) + ']'
+    return int(value) if value.is_Integer else str(value)
+
+def matrix_from_spec(spec: Dict[str, Any]) -> Any:
+    shape = spec['shape']
+    if not (isinstance(shape, list) and len(shape) == 2 and all(isinstance(n, int) and n > 0 for n in shape)):
+        raise ValueError("'shape' must be [rows, cols].")
+    if 'base64' not in spec:
+        raise ValueError("A matrix entry needs 'base64' together with 'shape'.")
+    flat = stats_engine.decode_base64_array(spec['base64'], spec.get('dtype', 'float64'))
+    if flat.size != shape[0] * shape[1]:
+        raise ValueError(f"got {flat.size} values, expected {shape[0]}x{shape[1]} = {shape[0] * shape[1]}.")
+    return to_matrix(flat.reshape(shape))
+
+def matrix_function(func_name: str, args: List[Any], info: Dict[str, Any]) -> Any:
+    if func_name == 'base64_matrix':
+        if not 3 <= len(args) <= 4 or not isinstance(args[0], str) or not all(isinstance(a, int) and a > 0 for a in args[1:3]):
+            raise ValueError("base64_matrix() syntax: base64_matrix('base64_string', rows, cols [, 'float64'|'float32'|'int64'|'int32'])")
+        _load_stats_engine()
+        try:
+            return matrix_from_spec({'base64': args[0], 'shape': [args[1], args[2]], 'dtype': (args[3:] or ['float64'])[0]})
+        except ValueError as e:
+            raise ValueError(f"base64_matrix(): {e}")
+
+    if func_name == 'matmul':
+        if len(args) < 2:
+            raise ValueError("matmul() requires at least two matrices/vectors.")
+        operands = [to_array(a) for a in args]
+        if any(op.ndim not in (1, 2) or max(op.shape) > MAX_MATRIX_DIM for op in operands):
+            raise ValueError(f"matmul() operands must be vectors or matrices up to {MAX_MATRIX_DIM} per dimension.")
+        try:
+            return operands[0] @ operands[1] if len(operands) == 2 else np.linalg.multi_dot(operands)
+        except ValueError as e:
+            raise ValueError(f"matmul() shape mismatch: {e}")
+
+    if func_name == 'norm':
+        if not 1 <= len(args) <= 2:
+            raise ValueError("norm() syntax: norm(vector_or_matrix [, ord]) with ord a number, 'fro', 'nuc', 'inf' or '-inf'")
+        arr = to_array(args[0])
+        if arr.ndim not in (1, 2):
+            raise ValueError("norm() requires a vector or a matrix.")
+        order = args[1] if len(args) == 2 else None
+        if isinstance(order, str):
+            if order.strip().lower() not in NORM_ORDERS:
+                raise ValueError(f"Unknown norm order '{order}'.")
+            order = NORM_ORDERS[order.strip().lower()]
+        try:
+            return float(np.linalg.norm(arr, order))
+        except ValueError as e:
+            raise ValueError(f"norm(): {e}")
+
+    if func_name in ('det', 'inv', 'eig', 'svd'):
+        use_exact = False
+        if func_name in ('det', 'inv'):
+            args, use_exact = split_exact_flag(func_name, args, 1)
+        if len(args) != 1:
+            raise ValueError(f"{func_name}() requires a single matrix" +
+                             (f" (optionally followed by '{EXACT_FLAG}')." if func_name in ('det', 'inv') else "."))
+        exact = exact_matrix(args[0], use_exact) if func_name in ('det', 'inv') else None
+        if exact is not None:
+            if not exact.is_square:
+                raise ValueError(f"{func_name}() requires a square matrix, got {exact.rows}x{exact.cols}.")
+            info.setdefault('linalg_path', []).append('exact')
+            if func_name == 'det':
+                return exact_result(exact.det())
+            if exact.det() == 0:
+                raise ValueError("Matrix is singular.")
+            return exact_result(exact.inv())
+        arr = to_matrix(args[0], square=func_name != 'svd')
+        info.setdefault('linalg_path', []).append('numeric')
+        try:
+            if func_name == 'det':
+                return float(np.linalg.det(arr)) if np.isrealobj(arr) else complex(np.linalg.det(arr))
+            if func_name == 'inv':
+                return np.linalg.inv(arr)
+            if func_name == 'svd':
+                return np.linalg.svd(arr, compute_uv=False)
+            if np.isrealobj(arr) and np.allclose(arr, arr.T):
+                values, vectors = np.linalg.eigh(arr)
+            else:
+                values, vectors = np.linalg.eig(arr)
+                values = np.real_if_close(values)
+                vectors = np.real_if_close(vectors)
+        except np.linalg.LinAlgError as e:
+            raise ValueError(f"{func_name}() failed: {e}")
+        info.setdefault('eigenvectors', []).append(np.asarray(vectors).tolist() if np.isrealobj(vectors) else
+                                                   [[str(complex(v)) for v in row] for row in vectors])
+        return values
+
+    # solve_linear / lstsq
+    use_exact = False
+    if func_name == 'solve_linear':
+        args, use_exact = split_exact_flag(func_name, args, 2)
+    if len(args) != 2:
+        raise ValueError(f"{func_name}() syntax: {func_name}(A, b" +
+                         (f" [, '{EXACT_FLAG}'])" if func_name == 'solve_linear' else ")"))
+    vector_rhs = isinstance(args[1], list) and all(not isinstance(v, list) for v in args[1])
+    if func_name == 'solve_linear':
+        exact_a = exact_matrix(args[0], use_exact)
+        exact_b = exact_matrix([[v] for v in args[1]] if vector_rhs else args[1], True) if exact_a is not None else None
+        if exact_b is not None and exact_a.is_square and exact_a.rows == exact_b.rows:
+            if exact_a.det() == 0:
+                raise ValueError("Matrix is singular.")
+            info.setdefault('linalg_path', []).append('exact')
+            solution = exact_a.LUsolve(exact_b)
+            return exact_result(solution, as_vector=vector_rhs)
+
+    import scipy.linalg
+    a = to_matrix(args[0], 'A', square=func_name == 'solve_linear')
+    b = to_array(args[1])
+    if b.ndim not in (1, 2) or b.shape[0] != a.shape[0]:
+        raise ValueError(f"b must have {a.shape[0]} rows to match A, got shape {b.shape}.")
+    info.setdefault('linalg_path', []).append('numeric')
+    try:
+        if func_name == 'solve_linear':
+            with warnings.catch_warnings(record=True) as caught:
+                warnings.simplefilter('always', scipy.linalg.LinAlgWarning)
+                solution = scipy.linalg.solve(a, b)
+            if caught:
+                info.setdefault('linalg_note', []).append(f"Ill-conditioned matrix: {caught[0].message}")
+            return solution
+        solution, residues, rank, _sv = scipy.linalg.lstsq(a, b)
+        info.setdefault('lstsq', []).append({'rank': int(rank), 'residues': np.atleast_1d(residues).tolist()})
+        return solution
+    except (np.linalg.LinAlgError, scipy.linalg.LinAlgError) as e:
+        message = str(e)
+        raise ValueError("Matrix is singular." if 'singular' in message.lower() else f"{func_name}() failed: {message}")
+
+
+def is_array(value: Any) -> bool:
+    return np is not None and isinstance(value, np.ndarray)
+
+def evaluate(expression: str, meta: Dict[str, Any] = None, use_cache: bool = True,
+             variables: Dict[str, Any] = None, full_arrays: bool = False) -> str:
+    if meta is None:
+        meta = {}
+    if variables is None:
+        variables = {}
+
+    def use_arrays() -> None:
+        # 数组运算需要 numpy：按需加载，并把报告的层级提升到至少 numpy
+        _load_numpy()
+        if _TIER_RANK.get(meta.get('tier'), 0) < _TIER_RANK[TIER_NUMPY]:
+            meta['tier'] = TIER_NUMPY
+
+    def is_array_like(value: Any) -> bool:
+        return isinstance(value, list) or is_array(value) or is_dataset(value)
+
+    def uses_stats_engine(data: Any) -> bool:
+        if is_dataset(data):
+            return True
+        size = data.size if is_array(data) else len(data) if isinstance(data, list) else 0
+        return size > STATS_ENGINE_MIN_SIZE
+
+    def array_result(value: Any) -> Any:
+        if is_array(value) and value.size > MAX_ARRAY_SIZE:
+            raise ValueError(f"Array too large ({value.size} elements, limit {MAX_ARRAY_SIZE}).")
+        return value
 
-def evaluate(expression: str) -> str:
-    # (evaluate function largely unchanged from previous, ensure it calls the modified compute_integral)
-    # ... (rest of the evaluate, main, etc. functions are the same as your last provided version) ...
     def eval_expr(node: ast.AST) -> Any: # Changed return type to Any
         if isinstance(node, ast.Constant):
             return node.value
         elif isinstance(node, ast.Name):
             if node.id in constants: return constants[node.id]
+            if node.id in variables: return variables[node.id]
             nid = node.id.lower()
             if nid == 'inf' or nid == 'infinity': return float('inf')
             if nid == '-inf' or nid == '-infinity': return float('-inf')
@@ -231,6 +2009,11 @@ def evaluate(expression: str) -> str:
             right = eval_expr(node.right)
             if isinstance(left, str) or isinstance(right, str): 
                 raise ValueError(f"Cannot perform arithmetic operation '{type(node.op).__name__}' with non-numeric string operands: '{left}', '{right}'")
+            if (is_array_like(left) or is_array_like(right)) and type(node.op) in allowed_operators:
+                # 数组语义：按 numpy 规则逐元素广播
+                use_arrays()
+                with np.errstate(all='ignore'):
+                    return array_result(allowed_operators[type(node.op)](to_array(left), to_array(right)))
             if not all(isinstance(x, (int, float, complex)) for x in [left, right]):
                      raise ValueError(f"Operands for '{type(node.op).__name__}' must be numeric, got {type(left).__name__} and {type(right).__name__}")
             if type(node.op) in allowed_operators:
@@ -240,6 +2023,9 @@ def evaluate(expression: str) -> str:
             operand_val = eval_expr(node.operand)
             if isinstance(operand_val, str):
                  raise ValueError(f"Cannot apply unary minus to non-numeric string operand: '{operand_val}'")
+            if is_array_like(operand_val):
+                use_arrays()
+                return -to_array(operand_val)
             return -operand_val
         elif isinstance(node, ast.Call) and isinstance(node.func, ast.Name):
             func_name = node.func.id
@@ -276,14 +2062,193 @@ def evaluate(expression: str) -> str:
                     lower_limit_val = eval_expr(node.args[2])
                     upper_limit_val = eval_expr(node.args[3])
                 
-                return compute_integral(expr_str_val, var_name_val, lower_limit_val, upper_limit_val)
+                return compute_integral(expr_str_val, var_name_val, lower_limit_val, upper_limit_val,
+                                        info=meta, use_cache=use_cache)
+
+            if func_name in SOLVER_FUNCTIONS:
+                needs_range = func_name in ('minimize', 'maximize')
+                syntax = (f"{func_name}() syntax: {func_name}('expr_str' [, 'var_str'], lower, upper)" if needs_range else
+                          f"{func_name}() syntax: {func_name}('expr_str' [, 'var_str'] [, lower, upper]); 'lhs = rhs' equations are accepted")
+                num_args = len(node.args)
+                if not 1 <= num_args <= 4:
+                    raise ValueError(syntax)
+                expr_str_arg_node = node.args[0]
+                if not (isinstance(expr_str_arg_node, ast.Constant) and isinstance(expr_str_arg_node.value, str)):
+                    raise ValueError(f"First argument to {func_name}() must be a string expression (e.g., 'x**2 - 2').")
+                rest = [eval_expr(arg) for arg in node.args[1:]]
+                var_name_val, lower_limit_val, upper_limit_val = 'x', None, None
+                if num_args in (2, 4):
+                    if not isinstance(rest[0], str):
+                        raise ValueError(f"If {num_args} args for {func_name}, 2nd arg (variable name) must be a string.")
+                    var_name_val = rest.pop(0)
+                if rest:
+                    if len(rest) != 2:
+                        raise ValueError(syntax)
+                    lower_limit_val, upper_limit_val = rest
+                elif needs_range:
+                    raise ValueError(syntax)
+                return compute_solver(func_name, expr_str_arg_node.value, var_name_val, lower_limit_val, upper_limit_val,
+                                      info=meta, use_cache=use_cache)
+
+            if func_name in MULTI_INTEGRAL_DIMENSIONS:
+                dims = MULTI_INTEGRAL_DIMENSIONS[func_name]
+                syntax = (f"{func_name}() syntax: {func_name}('expr_str', ('var', lower, upper), ...) with ranges listed innermost first"
+                          + (f", or {func_name}('expr_str', " + ", ".join(f"{v}_lower, {v}_upper" for v in DEFAULT_INTEGRATION_VARIABLES[:dims]) + ")" if dims else "")
+                          + " (limits may depend on outer variables only)")
+                expr_str_arg_node = node.args[0] if node.args else None
+                if not (isinstance(expr_str_arg_node, ast.Constant) and isinstance(expr_str_arg_node.value, str)):
+                    raise ValueError(f"First argument to {func_name}() must be a string expression (e.g., 'x*y').")
+                expr_str_val = preprocess_expression_string(expr_str_arg_node.value)
+
+                range_args = [eval_expr(arg) for arg in node.args[1:]]
+                if range_args and all(isinstance(r, (tuple, list)) for r in range_args):
+                    if not all(len(r) == 3 and isinstance(r[0], str) for r in range_args):
+                        raise ValueError(f"Each integration range must be ('var', lower, upper). {syntax}")
+                    specs = [tuple(r) for r in range_args]
+                elif dims is not None and len(range_args) == 2 * dims:
+                    specs = [(DEFAULT_INTEGRATION_VARIABLES[i], range_args[2 * i], range_args[2 * i + 1]) for i in range(dims)]
+                elif range_args and len(range_args) % 3 == 0 and all(isinstance(range_args[i], str) for i in range(0, len(range_args), 3)):
+                    specs = [tuple(range_args[i:i + 3]) for i in range(0, len(range_args), 3)]
+                else:
+                    raise ValueError(syntax)
+                if dims is not None and len(specs) != dims:
+                    raise ValueError(f"{func_name}() needs exactly {dims} integration ranges, got {len(specs)}. {syntax}")
+
+                if len(specs) == 1:
+                    var_name_val, lower_limit_val, upper_limit_val = specs[0]
+                    return compute_integral(expr_str_val, var_name_val, lower_limit_val, upper_limit_val,
+                                            info=meta, use_cache=use_cache)
+                return compute_multi_integral(expr_str_val, specs, info=meta, use_cache=use_cache)
 
             args = [eval_expr(arg) for arg in node.args]
+
+            if func_name in ('linspace', 'arange'):
+                use_arrays()
+                if not 1 <= len(args) <= 3 or not all(isinstance(a, (int, float)) for a in args):
+                    raise ValueError(f"{func_name}() requires 1 to 3 numeric arguments.")
+                if func_name == 'linspace':
+                    if len(args) < 2:
+                        raise ValueError("linspace() syntax: linspace(start, stop [, num=50])")
+                    num = int(args[2]) if len(args) == 3 else 50
+                    if not 0 <= num <= MAX_ARRAY_SIZE:
+                        raise ValueError(f"linspace() num must be between 0 and {MAX_ARRAY_SIZE}.")
+                    return np.linspace(args[0], args[1], num)
+                start, stop, step = (0, args[0], 1) if len(args) == 1 else (args[0], args[1], args[2] if len(args) == 3 else 1)
+                if step == 0:
+                    raise ValueError("arange() step must not be zero.")
+                if math.ceil((stop - start) / step) > MAX_ARRAY_SIZE:
+                    raise ValueError(f"arange() would create more than {MAX_ARRAY_SIZE} elements.")
+                return np.arange(start, stop, step, dtype=float)
+
+            if func_name in ('base64_data', 'file_data'):
+                use_arrays()
+                _load_stats_engine()
+                if func_name == 'base64_data':
+                    if not 1 <= len(args) <= 2 or not all(isinstance(a, str) for a in args):
+                        raise ValueError("base64_data() syntax: base64_data('base64_string' [, 'float64'|'float32'|'int64'|'int32'])")
+                    return stats_engine.Dataset.from_base64(*args)
+                if not 1 <= len(args) <= 2 or not isinstance(args[0], str):
+                    raise ValueError("file_data() syntax: file_data('file.npy'|'file.csv' [, column_index_or_name])")
+                return stats_engine.Dataset.from_file(*args)
+
+            if func_name in STATS_ENGINE_FUNCTIONS or (func_name in _STATS_LIST_FUNCTIONS and args and uses_stats_engine(args[0])):
+                use_arrays()
+                _load_stats_engine()
+                if not args:
+                    raise ValueError(f"{func_name} requires a data list or dataset as its first argument.")
+                data = stats_engine.as_dataset(args[0])
+                if func_name == 'confidence_interval':
+                    if len(args) < 2:
+                        raise ValueError("confidence_interval() requires data_list and confidence_level")
+                    return compute_confidence_interval(data, args[1], args[2] if len(args) > 2 else None)
+                if func_name == 't_test':
+                    if len(args) != 2 or not isinstance(args[1], (int, float)):
+                        raise ValueError("t_test requires a list and a number (mu).")
+                    return stats_engine.t_test(data, args[1])
+                if func_name == 'percentile':
+                    if len(args) != 2 or not (isinstance(args[1], (int, float)) or is_array_like(args[1])):
+                        raise ValueError("percentile() syntax: percentile(data, q) with q a number or list of numbers in [0, 100]")
+                    return stats_engine.percentile(data, args[1].tolist() if is_array(args[1]) else args[1])
+                if func_name == 'histogram':
+                    if not 1 <= len(args) <= 4 or not all(isinstance(a, (int, float)) for a in args[1:]):
+                        raise ValueError("histogram() syntax: histogram(data [, bins=10] [, low, high])")
+                    if len(args) == 3:
+                        raise ValueError("histogram() needs both low and high when a range is given.")
+                    hist = stats_engine.histogram(data, *args[1:])
+                    return json.dumps({'counts': hist['counts'], 'edges': [float(format_scalar(e)) for e in hist['edges']]})
+                if func_name == 'correlation':
+                    if len(args) not in (2, 3) or (len(args) == 3 and not isinstance(args[2], str)):
+                        raise ValueError("correlation() syntax: correlation(x_data, y_data [, 'pearson'|'spearman'|'kendall'])")
+                    if len(args) == 3 and args[2].strip().lower() != 'pearson' \
+                            and _TIER_RANK.get(meta.get('tier'), 0) < _TIER_RANK[TIER_SCIPY]:
+                        meta['tier'] = TIER_SCIPY # spearman/kendall 由 scipy.stats 计算
+                    return stats_engine.correlation(data, stats_engine.as_dataset(args[1]), *args[2:])
+                if len(args) != 1:
+                    raise ValueError(f"{func_name} requires a single data list or dataset.")
+                return getattr(stats_engine, func_name)(data)
+
+            if func_name in MATRIX_FUNCTIONS:
+                use_arrays()
+                try:
+                    result = matrix_function(func_name, args, meta)
+                finally:
+                    if 'exact' in meta.get('linalg_path', []):
+                        meta['tier'] = TIER_SYMPY
+                return array_result(result) if is_array(result) else result
+
+            if func_name == 'fit':
+                if not 3 <= len(args) <= 5 or not isinstance(args[0], str):
+                    raise ValueError("fit() syntax: fit('model_expr', xs, ys, ['param1', ...] [, initial_guesses]) or fit('linear'|'polyN', xs, ys)")
+                param_names = args[3] if len(args) > 3 else None
+                if param_names is not None and (not isinstance(param_names, (list, tuple)) or not all(isinstance(p, str) for p in param_names)):
+                    raise ValueError("fit() parameter names must be a list of strings, e.g. ['a', 'b'].")
+                use_arrays()
+                _load_stats_engine()
+                xs, ys = (stats_engine.as_dataset(a).to_array() for a in args[1:3])
+                model_str, names = expand_fit_model(args[0], param_names)
+                fit_result = fit_model(model_str, xs, ys, tuple(p.strip() for p in names), args[4] if len(args) > 4 else None)
+                meta.setdefault('fit', []).append(fit_result)
+                show = lambda value: 'n/a' if value is None else format_scalar(value)
+                terms = ", ".join(f"{name} = {format_scalar(value)} ± {show(fit_result['stderr'][name])}"
+                                  for name, value in fit_result['params'].items())
+                return f"{terms}, R² = {show(fit_result['r_squared'])}"
+
+            if func_name in _STATS_LIST_FUNCTIONS:
+                # 统计函数保持原有的列表语义，数组先转换回列表
+                args = [a.tolist() if is_array(a) else a for a in args]
+            elif func_name in math_functions and any(is_array_like(a) for a in args):
+                use_arrays()
+                vectorized = _vectorized_math_functions()
+                if func_name in vectorized:
+                    with np.errstate(all='ignore'):
+                        return array_result(vectorized[func_name](*[to_array(a) for a in args]))
             
             if func_name == 'error_propagation':
-                if len(args) != 2 or not isinstance(args[0], str) or not isinstance(args[1], dict):
-                    raise ValueError("error_propagation() requires expr_str, {var: (value, error)}")
-                return compute_error_propagation(args[0], args[1]) 
+                if len(args) not in (2, 3) or not isinstance(args[0], str) or not isinstance(args[1], dict):
+                    raise ValueError("error_propagation() requires expr_str, {var: (value, error)} [, {'var1,var2': correlation}]")
+                correlations = args[2] if len(args) == 3 else None
+                try:
+                    cache_key = error_propagation_cache_key(args[0], args[1], correlations)
+                    cacheable = use_cache
+                except Exception:
+                    cache_key, cacheable = None, False
+                return cached_call(cache_key, meta, cacheable,
+                                   lambda call_info: compute_error_propagation(args[0], args[1], correlations, call_info))
+            elif func_name == 'error_propagation_mc':
+                if len(args) not in (2, 3) or not isinstance(args[0], str) or not isinstance(args[1], dict) \
+                        or (len(args) == 3 and not isinstance(args[2], dict)):
+                    raise ValueError("error_propagation_mc() requires expr_str, {var: (value, error) | {'dist': 'uniform', 'low': a, 'high': b} | {'dist': 'samples', 'values': [...]}} [, {'samples': n, 'seed': s, 'percentiles': [...]}]")
+                options = args[2] if len(args) == 3 else {}
+                unknown_options = set(options) - {'samples', 'seed', 'percentiles'}
+                if unknown_options:
+                    raise ValueError(f"Unknown error_propagation_mc() options: {', '.join(sorted(map(str, unknown_options)))}")
+                try:
+                    cache_key = monte_carlo_cache_key(args[0], args[1], options)
+                    cacheable = use_cache
+                except Exception:
+                    cache_key, cacheable = None, False
+                return cached_call(cache_key, meta, cacheable,
+                                   lambda call_info: compute_error_propagation_mc(args[0], args[1], options, call_info))
             elif func_name == 'confidence_interval':
                 if len(args) < 2:
                     raise ValueError("confidence_interval() requires data_list and confidence_level")
@@ -317,45 +2282,73 @@ def evaluate(expression: str) -> str:
         elif isinstance(node, ast.Tuple): return tuple(eval_expr(elt) for elt in node.elts)
         raise ValueError(f"Unsupported AST node: {type(node).__name__}")
 
-    def compute_error_propagation(expr_str: str, vars_errors: Dict[str, Tuple[float, float]]) -> str:
+    def compute_error_propagation(expr_str: str, vars_errors: Dict[str, Any], correlations: Any = None,
+                                  call_info: Dict[str, Any] = None) -> str:
+        _load_sympy_stack()
         try:
-            symbols_map = {var_name: Symbol(var_name) for var_name in vars_errors.keys()}
-            # Ensure that base_sympy_locals are available and that symbols from vars_errors take precedence
-            current_locals = base_sympy_locals.copy()
-            current_locals.update(symbols_map)
-            sympy_expr = sympify(preprocess_expression_string(expr_str), locals=current_locals) # Preprocess here too
-            
-            subs_values = {symbols_map[k]: v[0] for k, v in vars_errors.items()}
-            calculated_value = sympy_expr.subs(subs_values).evalf()
-
-            total_error_sq = sympy.S.Zero
-            for var_name, (val, err) in vars_errors.items():
-                s_var = symbols_map[var_name]
-                partial_derivative = diff(sympy_expr, s_var)
-                partial_derivative_val = partial_derivative.subs(subs_values).evalf()
-                if not partial_derivative_val.is_number: # Check if derivative is numeric
-                     raise ValueError(f"Partial derivative w.r.t '{var_name}' is not numeric: {latex(partial_derivative_val)}")
-                total_error_sq += (partial_derivative_val * err)**2
-            
-            final_error = sympy.sqrt(total_error_sq).evalf()
-            if not calculated_value.is_number or not final_error.is_number:
-                raise ValueError("Calculated value or final error is not numeric.")
+            row_values, row_errors, is_table = propagate_errors(expr_str, vars_errors, correlations)
+            if not is_table:
+                if not (math.isfinite(row_values[0]) and math.isfinite(row_errors[0])):
+                    raise ValueError("Calculated value or final error is not numeric.")
+                return f"Value = {float(row_values[0]):.7g}, Error = {float(row_errors[0]):.4g}"
 
-            return f"Value = {float(calculated_value):.7g}, Error = {float(final_error):.4g}"
+            lines = []
+            rows = []
+            for row, (value, error) in enumerate(zip(row_values.tolist(), row_errors.tolist()), start=1):
+                if math.isfinite(value) and math.isfinite(error):
+                    lines.append(f"Row {row}: Value = {value:.7g}, Error = {error:.4g}")
+                    rows.append([value, error])
+                else:
+                    lines.append(f"Row {row}: Error - value or error is not numeric")
+                    rows.append([None, None])
+            if call_info is not None:
+                call_info.setdefault('error_propagation_rows', []).extend(rows)
+            return "\n".join(lines)
         except Exception as e:
             return f"Error in error_propagation for '{expr_str}': {type(e).__name__} - {str(e)}"
 
-    def compute_confidence_interval(data: list, confidence_level: float, population_mean: float = None) -> str:
+    def compute_error_propagation_mc(expr_str: str, vars_spec: Dict[str, Any], options: Dict[str, Any],
+                                     call_info: Dict[str, Any]) -> str:
+        _load_sympy_stack()
         try:
-            if not isinstance(data, list) or not all(isinstance(x, (int, float)) for x in data):
+            samples = options.get('samples', MC_DEFAULT_SAMPLES)
+            seed = options.get('seed', 0)
+            percentiles = options.get('percentiles', MC_DEFAULT_PERCENTILES)
+            if not isinstance(samples, (int, float)) or samples != int(samples):
+                raise ValueError("samples must be an integer.")
+            if not isinstance(seed, int):
+                raise ValueError("seed must be an integer.")
+            if not isinstance(percentiles, (list, tuple)) or not all(isinstance(p, (int, float)) and 0 <= p <= 100 for p in percentiles):
+                raise ValueError("percentiles must be a list of numbers between 0 and 100.")
+            summary = monte_carlo_propagation(expr_str, vars_spec, int(samples), seed, tuple(percentiles))
+            call_info.setdefault('monte_carlo', []).append(
+                {key: summary[key] for key in ('samples', 'invalid', 'seed', 'percentile_samples')})
+            percentile_text = ", ".join(f"P{p:g} = {v:.7g}" for p, v in summary['percentiles'].items())
+            result = f"Mean = {summary['mean']:.7g}, Std = {summary['std']:.4g}"
+            if percentile_text:
+                result += f", {percentile_text}"
+            if summary['invalid']:
+                result += f" ({summary['invalid']} of {summary['samples']} samples were not finite and were ignored)"
+            return result
+        except Exception as e:
+            return f"Error in error_propagation_mc for '{expr_str}': {type(e).__name__} - {str(e)}"
+
+    def compute_confidence_interval(data: Any, confidence_level: float, population_mean: float = None) -> str:
+        _load_scipy_stack()
+        try:
+            if not is_dataset(data) and (not isinstance(data, list) or not all(isinstance(x, (int, float)) for x in data)):
                 return "Error: Data for confidence_interval must be a list of numbers."
             if not isinstance(confidence_level, (int, float)) or not (0 < confidence_level < 1):
                 return "Error: Confidence level must be a number between 0 and 1."
             n = len(data)
             if n < 2: return "Error: Data sample too small for confidence interval (need at least 2 points)."
             
-            sample_mean = statistics.mean(data)
-            sample_std = statistics.stdev(data)
+            if is_dataset(data):
+                sample_mean = stats_engine.mean(data)
+                sample_std = stats_engine.stdev(data)
+            else:
+                sample_mean = statistics.mean(data)
+                sample_std = statistics.stdev(data)
             
             # Using Scipy's t.interval for more robust CI calculation
             ci_lower, ci_upper = stats.t.interval(confidence_level, df=n-1, loc=sample_mean, scale=sample_std/math.sqrt(n))
@@ -380,12 +2373,21 @@ def evaluate(expression: str) -> str:
         if stack:
             raise SyntaxError(f"Unclosed parentheses or brackets in '{expression_str_input}'")
 
-        parsed_expr = ast.parse(expression_str_input, mode='eval')
+        parsed_expr = parse_expression(expression_str_input)
+        tier = required_tier(parsed_expr)
+        meta['tier'] = tier
         result = eval_expr(parsed_expr.body)
+        meta['_value'] = result
+        if tier == TIER_SYMPY and meta.get('cache') and all(c == 'hit' for c in meta['cache']):
+            meta['tier'] = TIER_CACHE
         
         if isinstance(result, str): 
             return result
-        if isinstance(result, (float, sympy.Float, sympy.Rational, sympy.Number)): # sympy.Number includes Integer
+        if is_array(result):
+            return format_array(result, full=full_arrays)
+        if is_dataset(result):
+            return format_array(np.asarray(result.to_array()), full=full_arrays)
+        if isinstance(result, float) or (sympy is not None and isinstance(result, sympy.Number)): # sympy.Number includes Integer
             try:
                 num_result = float(result) # Attempt to convert to Python float
                 if math.isinf(num_result) or math.isnan(num_result):
@@ -397,7 +2399,7 @@ def evaluate(expression: str) -> str:
             except Exception: # If conversion to float fails for some SymPy Number type
                 return str(result) # Fallback to string representation of the SymPy number
 
-        if isinstance(result, (int, sympy.Integer)): # Redundant due to sympy.Number above, but harmless
+        if isinstance(result, int): # sympy.Integer is already handled by sympy.Number above
             return str(result)
         if isinstance(result, complex): 
              return f"{result.real:.10g}{'+' if result.imag >= 0 else ''}{result.imag:.10g}j".replace("+-","-")
@@ -418,44 +2420,288 @@ def evaluate(expression: str) -> str:
 
 import json
 
+ERROR_PREFIXES = ("Error:", "Syntax Error:", "Input Error:", "Calculation Error:")
+
+def json_safe(value: Any) -> Any:
+    """NaN/±inf floats (at any depth) become None: Plugin.js's JSON.parse rejects bare NaN/Infinity."""
+    if isinstance(value, float):
+        return value if math.isfinite(value) else None
+    if isinstance(value, dict):
+        return {key: json_safe(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [json_safe(item) for item in value]
+    return value
+
+def dump_response(response: Dict[str, Any]) -> str:
+    return json.dumps(json_safe(response), allow_nan=False)
+
+def is_truthy(value: Any) -> bool:
+    if isinstance(value, str):
+        return value.strip().lower() in ('true', '1', 'yes', 'on')
+    return bool(value)
+
+def parse_data_inputs(data_input: Any) -> Dict[str, Any]:
+    """
+    The optional "data" object of the input JSON maps names to datasets usable in
+    the expression: number lists, base64 strings, or {"base64"|"chunks"|"path": ...}.
+    Nested lists and {"base64": ..., "shape": [rows, cols]} become matrices instead.
+    """
+    if not data_input:
+        return {}
+    if not isinstance(data_input, dict):
+        raise ValueError('"data" must be an object mapping names to datasets.')
+    _load_stats_engine()
+    variables = {}
+    for name, spec in data_input.items():
+        if not name.isidentifier():
+            raise ValueError(f"Invalid data name '{name}'.")
+        try:
+            if isinstance(spec, list) and spec and all(isinstance(row, list) for row in spec):
+                variables[name] = spec
+            elif isinstance(spec, dict) and 'shape' in spec:
+                variables[name] = matrix_from_spec(spec)
+            else:
+                variables[name] = stats_engine.dataset_from_spec(spec)
+        except ValueError as ve:
+            raise ValueError(f"Data '{name}': {ve}")
+    return variables
+
+def build_output(expression_input: Any, options: Dict[str, Any] = None) -> Dict[str, Any]:
+    """Evaluate one expression and wrap it in the plugin's JSON output shape."""
+    options = options or {}
+    if not expression_input:
+        return {"status": "error", "error": "SciCalculator Plugin Error: No expression provided."}
+
+    try:
+        variables = parse_data_inputs(options.get('data'))
+    except ValueError as ve:
+        return {"status": "error", "error": f"SciCalculator Plugin Error: {str(ve)}"}
+    meta: Dict[str, Any] = {}
+    result_str = evaluate(expression_input, meta, use_cache=not is_truthy(options.get('no_cache', False)),
+                          variables=variables, full_arrays=is_truthy(options.get('full_arrays', False)))
+
+    is_error_result = False
+    if isinstance(result_str, str):
+        for prefix in ERROR_PREFIXES:
+            if result_str.startswith(prefix) :
+                is_error_result = True
+                break
+        # Warnings are not necessarily hard errors for status
+        if result_str.startswith("Warning:") and "Potentially large error" in result_str:
+            pass # This is a success with a caveat
+
+    if is_error_result:
+        output = {"status": "error", "error": result_str}
+    else:
+        ai_friendly_result = result_str
+        formatted_result_for_ai = f"###计算结果：{ai_friendly_result}###，请将结果转告用户"
+        output = {"status": "success", "result": formatted_result_for_ai}
+    for key, value in meta.items():
+        if not key.startswith('_'):
+            output.setdefault(key, value)
+    return output
+
+BATCH_ITEM_NAME_PATTERN = re.compile(r'^\s*([A-Za-z_]\w*)\s*=(?!=)\s*(.+)$', re.S)
+
+def parse_batch_items(expressions_input: Any) -> List[Dict[str, Any]]:
+    """
+    Normalize the `expressions` input into [{"name": str|None, "expression": str}].
+    Accepts a list (or a JSON string of a list, or newline-separated text) whose
+    items are plain expressions, "name = expression" strings, or
+    {"name": ..., "expression": ...} objects.
+    """
+    if isinstance(expressions_input, str):
+        try:
+            expressions_input = json.loads(expressions_input)
+        except json.JSONDecodeError:
+            expressions_input = [line for line in expressions_input.splitlines() if line.strip()]
+    if not isinstance(expressions_input, list):
+        raise ValueError("'expressions' must be a list of expressions.")
+
+    items = []
+    for raw_item in expressions_input:
+        if isinstance(raw_item, dict):
+            name = raw_item.get('name')
+            expression = raw_item.get('expression')
+        else:
+            name, expression = None, raw_item
+            match = BATCH_ITEM_NAME_PATTERN.match(str(raw_item))
+            if match:
+                name, expression = match.group(1), match.group(2)
+        if name is not None:
+            name = str(name).strip()
+            if not name.isidentifier() or name in constants:
+                raise ValueError(f"Invalid result name '{name}' in batch.")
+        items.append({"name": name, "expression": expression})
+    return items
+
+def build_batch_output(expressions_input: Any, options: Dict[str, Any] = None) -> Dict[str, Any]:
+    """
+    Evaluate a list of expressions in one process. Every item gets its own
+    build_output()-shaped entry; named numeric results can be referenced by
+    later items. Integral/solve races share the request's time budget, so items
+    reached after it is used up report a timeout error instead of running.
+    """
+    options = options or {}
+    try:
+        items = parse_batch_items(expressions_input)
+    except ValueError as ve:
+        return {"status": "error", "error": f"SciCalculator Plugin Error: {str(ve)}"}
+    if not items:
+        return {"status": "error", "error": "SciCalculator Plugin Error: No expression provided."}
+
+    use_cache = not is_truthy(options.get('no_cache', False))
+    full_arrays = is_truthy(options.get('full_arrays', False))
+    try:
+        variables = parse_data_inputs(options.get('data'))
+    except ValueError as ve:
+        return {"status": "error", "error": f"SciCalculator Plugin Error: {str(ve)}"}
+    results = []
+    summary_lines = []
+    for index, item in enumerate(items, start=1):
+        name, expression = item['name'], item['expression']
+        if not expression:
+            result_str = "SciCalculator Plugin Error: No expression provided."
+            entry = {"status": "error", "error": result_str}
+        else:
+            meta: Dict[str, Any] = {}
+            result_str = evaluate(expression, meta, use_cache=use_cache, variables=variables, full_arrays=full_arrays)
+            if isinstance(result_str, str) and result_str.startswith(ERROR_PREFIXES):
+                entry = {"status": "error", "error": result_str}
+            else:
+                entry = {"status": "success", "result": f"###计算结果：{result_str}###，请将结果转告用户"}
+                if name and (isinstance(meta.get('_value'), (int, float, complex, list)) or is_array(meta.get('_value'))
+                             or is_dataset(meta.get('_value'))):
+                    variables[name] = meta['_value']
+            for key, value in meta.items():
+                if not key.startswith('_'):
+                    entry.setdefault(key, value)
+        summary_lines.append(f"{name} = {result_str}" if name else f"#{index}: {result_str}")
+        results.append({"index": index, "name": name, "expression": expression, **entry})
+
+    succeeded = sum(1 for r in results if r['status'] == 'success')
+    if succeeded == 0:
+        return {"status": "error", "error": "\n".join(summary_lines), "results": results}
+    summary = "\n".join(summary_lines)
+    return {"status": "success", "result": f"###计算结果：\n{summary}\n###，请将结果转告用户", "results": results}
+
+def _diagnostic_targets() -> List[Tuple[Any, str, str]]:
+    """Functions timed per phase in diagnostics mode: (owner, attribute, phase)."""
+    module = sys.modules[__name__]
+    targets = [(module, loader, 'import') for loader in
+               ('_load_numpy', '_load_stats_engine', '_load_scipy_stack', '_load_sympy_stack')]
+    targets += [(module, 'parse_expression', 'parse'), (module, 'cached_sympify', 'sympify'),
+                (module, 'integrate', 'integrate'), (module, 'latex', 'latex'),
+                (module, 'quad', 'quad'), (module, 'nquad', 'quad'),
+                (module, 'race_symbolic_numeric', 'workers')]
+    if sympy is not None:
+        targets += [(sympy, 'solveset', 'solve'), (sympy, 'lambdify', 'lambdify'),
+                    (sympy.core.evalf.EvalfMixin, 'evalf', 'evalf')]
+    return targets
+
+def handle_request_with_diagnostics(data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    "diagnostics": true adds a `timings` object (per-phase milliseconds, call counts,
+    tracemalloc peak and the race workers' own timings; "timing" skips tracemalloc);
+    "profile": "name.prof" also writes a cProfile dump under SCICALC_PROFILE_DIR
+    (workers write name.prof.<kind>).
+    """
+    _load_diagnostics()
+    profile_path = None
+    if data.get('profile'):
+        try:
+            profile_path = diagnostics.resolve_profile_path(data['profile'])
+        except (ValueError, OSError) as e:
+            return {"status": "error", "error": f"SciCalculator Plugin Error: {str(e)}"}
+    request = {key: value for key, value in data.items() if key not in ('diagnostics', 'profile')}
+    trace_memory = str(data.get('diagnostics', '')).strip().lower() != 'timing'
+    with diagnostics.Diagnostics(_diagnostic_targets, profile_path, trace_memory) as diag:
+        output = handle_request(request)
+    output['timings'] = diag.report()
+    return output
+
+def handle_request(data: Any) -> Dict[str, Any]:
+    """
+    Dispatch one decoded request (dict or raw expression string) to single or batch
+    evaluation. All races in the request share one INTEGRAL_BUDGET_SECONDS deadline.
+    """
+    global REQUEST_DEADLINE
+    if REQUEST_DEADLINE is not None: # 诊断模式的内层调用沿用外层的截止时间
+        return _dispatch_request(data)
+    REQUEST_DEADLINE = time.monotonic() + INTEGRAL_BUDGET_SECONDS
+    try:
+        return _dispatch_request(data)
+    finally:
+        REQUEST_DEADLINE = None
+
+def _dispatch_request(data: Any) -> Dict[str, Any]:
+    if isinstance(data, dict) and (is_truthy(data.get('diagnostics', False)) or data.get('profile')
+                                   or str(data.get('diagnostics', '')).strip().lower() == 'timing'):
+        return handle_request_with_diagnostics(data)
+    if isinstance(data, dict):
+        if data.get('expressions') is not None:
+            return build_batch_output(data['expressions'], data)
+        return build_output(data.get('expression'), data)
+    return build_output(data if isinstance(data, str) else None)
+
+SERVER_SHUTDOWN_COMMANDS = ("shutdown", "exit", "quit")
+
+def serve(stdin=None, stdout=None) -> int:
+    """
+    Long-lived JSONL mode: one request per line, one response per line.
+    Request:  {"id": 1, "expression": "1+1"}  (a bare expression line is also accepted)
+    Response: {"id": 1, "status": "success", "result": "..."}
+    Send {"command": "shutdown"} (or close stdin) to stop the server.
+    """
+    stdin = stdin or sys.stdin
+    stdout = stdout or sys.stdout
+    for raw_line in stdin:
+        line = raw_line.strip()
+        if not line:
+            continue
+        request_id = None
+        try:
+            try:
+                data = json.loads(line)
+            except json.JSONDecodeError:
+                data = line
+            if isinstance(data, dict):
+                request_id = data.get('id')
+                command = str(data.get('command', '')).strip().lower()
+                if command in SERVER_SHUTDOWN_COMMANDS:
+                    response = {"status": "success", "result": "SciCalculator server shutting down."}
+                    if request_id is not None:
+                        response = {"id": request_id, **response}
+                    print(dump_response(response), file=stdout, flush=True)
+                    break
+            response = handle_request(data)
+        except Exception as e:
+            # One bad request must never take the server down with it.
+            response = {"status": "error", "error": f"SciCalculator Plugin Error: {type(e).__name__} - {str(e)}"}
+        if request_id is not None:
+            response = {"id": request_id, **response}
+        print(dump_response(response), file=stdout, flush=True)
+    return 0
+
 def main():
-    # (main function unchanged from previous version)
+    if '--server' in sys.argv[1:] or os.environ.get('SCICALC_SERVER_MODE', '').lower() == 'true':
+        sys.exit(serve())
+
     expression_input = sys.stdin.readline().strip()
+    request: Any = expression_input
 
     try:
         # Attempt to parse the input as JSON, in case the expression is wrapped in a JSON object.
         data = json.loads(expression_input)
-        if isinstance(data, dict) and 'expression' in data:
-            expression_input = data['expression']
+        if isinstance(data, dict) and ('expression' in data or 'expressions' in data):
+            request = data
     except (json.JSONDecodeError, TypeError):
         # If it's not valid JSON or not a dict, assume it's a raw expression string.
         pass
 
-    output = {}
-    if not expression_input:
-        output = {"status": "error", "error": "SciCalculator Plugin Error: No expression provided."}
-    else:
-        result_str = evaluate(expression_input)
-        error_prefixes = ("Error:", "Syntax Error:", "Input Error:", "Calculation Error:") 
-        
-        is_error_result = False
-        if isinstance(result_str, str):
-            for prefix in error_prefixes:
-                if result_str.startswith(prefix) : 
-                    is_error_result = True
-                    break
-            # Warnings are not necessarily hard errors for status
-            if result_str.startswith("Warning:") and "Potentially large error" in result_str:
-                pass # This is a success with a caveat
-
-        if is_error_result:
-            output = {"status": "error", "error": result_str}
-        else:
-            ai_friendly_result = result_str
-            formatted_result_for_ai = f"###计算结果：{ai_friendly_result}###，请将结果转告用户"
-            output = {"status": "success", "result": formatted_result_for_ai}
+    output = handle_request(request)
 
-    print(json.dumps(output), file=sys.stdout)
+    print(dump_response(output), file=sys.stdout)
     sys.exit(0 if output.get("status") == "success" else 1)
 
 
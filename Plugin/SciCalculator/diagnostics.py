@@ -0,0 +1,193 @@
+"""
+SciCalculator 的按阶段计时与性能剖析 (输入 JSON 中传 "diagnostics": true 时启用)。
+
+启用期间把计算器里几个关键函数 (模块加载、ast.parse、sympify、integrate、
+evalf、quad、latex 等) 临时替换为计时包装，按阶段累计"自身耗时"：嵌套调用的
+时间只记在最内层阶段上，各阶段之和加上 other 等于总耗时。请求结束后恢复原函数，
+未启用时没有任何额外开销。同时用 tracemalloc 记录峰值内存 (会使纯 Python 代码
+变慢数倍，"diagnostics": "timing" 时跳过)，并可把单次请求的 cProfile 结果写入
+SCICALC_PROFILE_DIR 下的文件。
+
+只依赖标准库。
+"""
+import cProfile
+import functools
+import os
+import sys
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+PLUGIN_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_PROFILE_DIR = os.path.join(PLUGIN_DIR, 'profiles')
+
+# 当前正在进行的诊断 (同一时刻只有一个请求被诊断)
+active: Optional['Diagnostics'] = None
+
+
+def profile_dir() -> str:
+    return os.path.realpath(os.environ.get('SCICALC_PROFILE_DIR') or DEFAULT_PROFILE_DIR)
+
+
+def resolve_profile_path(path: str) -> str:
+    """相对路径相对于 SCICALC_PROFILE_DIR 解析；不允许写到该目录之外。"""
+    root = profile_dir()
+    full_path = os.path.realpath(os.path.join(root, os.path.expanduser(str(path))))
+    if os.path.commonpath([root, full_path]) != root or full_path == root:
+        raise ValueError(f"Profile path '{path}' is outside the profile directory (SCICALC_PROFILE_DIR).")
+    os.makedirs(os.path.dirname(full_path), exist_ok=True)
+    return full_path
+
+
+def peak_rss_kb() -> Optional[int]:
+    """本进程的峰值常驻内存 (KB)；不支持 resource 模块的平台返回 None。"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+class PhaseTimer:
+    """按阶段累计自身耗时 (exclusive time) 与调用次数。"""
+
+    def __init__(self):
+        self.totals: Dict[str, float] = {}
+        self.calls: Dict[str, int] = {}
+        self._stack: List[List[Any]] = [] # [phase, start, 子阶段耗时]
+
+    def reset(self) -> None:
+        self.totals.clear()
+        self.calls.clear()
+        self._stack.clear()
+
+    def wrap(self, func: Callable, phase: str, after: Callable[[], None] = None) -> Callable:
+        @functools.wraps(func)
+        def timed(*args, **kwargs):
+            self._stack.append([phase, time.perf_counter(), 0.0])
+            try:
+                return func(*args, **kwargs)
+            finally:
+                _phase, start, child_seconds = self._stack.pop()
+                elapsed = time.perf_counter() - start
+                self.totals[phase] = self.totals.get(phase, 0.0) + elapsed - child_seconds
+                self.calls[phase] = self.calls.get(phase, 0) + 1
+                if self._stack:
+                    self._stack[-1][2] += elapsed
+                if after is not None:
+                    after()
+        return timed
+
+
+class Diagnostics:
+    """
+    with Diagnostics(targets, profile_path) as diag: ...; diag.report()
+
+    targets() 返回 (对象, 属性名, 阶段名) 列表；值为 None 的属性 (尚未懒加载的
+    依赖) 会在任一 'import' 阶段结束后再补上计时包装。
+    """
+
+    def __init__(self, targets: Callable[[], Iterable[Tuple[Any, str, str]]], profile_path: str = None,
+                 trace_memory: bool = True):
+        self.targets = targets
+        self.profile_path = profile_path
+        self.trace_memory = trace_memory
+        self.timer = PhaseTimer()
+        self.workers: List[Dict[str, Any]] = []
+        self.profiler: Optional[cProfile.Profile] = None
+        self._patched: Dict[Tuple[int, str], Tuple[Any, str, Any]] = {}
+        self._started_tracemalloc = False
+        self.peak_bytes: Optional[int] = None
+        self._start = 0.0
+        self._elapsed = 0.0
+
+    def __enter__(self) -> 'Diagnostics':
+        global active
+        active = self
+        self._patch()
+        if self.trace_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._started_tracemalloc = True
+            elif hasattr(tracemalloc, 'reset_peak'): # Python 3.9+
+                tracemalloc.reset_peak()
+        if self.profile_path:
+            self.profiler = cProfile.Profile()
+        self._start = time.perf_counter()
+        if self.profiler is not None:
+            self.profiler.enable()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        global active
+        if self.profiler is not None:
+            self.profiler.disable()
+        self._elapsed = time.perf_counter() - self._start
+        if self.trace_memory:
+            self.peak_bytes = tracemalloc.get_traced_memory()[1]
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+        for owner, attr, original in reversed(list(self._patched.values())):
+            setattr(owner, attr, original)
+        self._patched.clear()
+        active = None
+        if self.profiler is not None:
+            self.profiler.dump_stats(self.profile_path)
+
+    def _patch(self) -> None:
+        for owner, attr, phase in self.targets():
+            key = (id(owner), attr)
+            original = getattr(owner, attr, None) if owner is not None else None
+            if original is None or key in self._patched:
+                continue
+            after = self._patch if phase == 'import' else None
+            setattr(owner, attr, self.timer.wrap(original, phase, after))
+            self._patched[key] = (owner, attr, original)
+
+    # --- fork 出的积分/求解工作进程 ---
+    def start_worker(self, kind: str) -> None:
+        """
+        在子进程中调用：清空从父进程继承的计时，改为记录本进程自己的阶段与剖析。
+        子进程里关闭 tracemalloc (它会让符号计算慢数倍，从而改变竞速结果)，峰值内存改报 RSS。
+        """
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+        self.timer.reset()
+        self.workers = []
+        self._start = time.perf_counter()
+        self.peak_bytes = None
+        if self.profiler is not None:
+            self.profiler.disable()
+            self.profiler = cProfile.Profile()
+            self.profile_path = f"{self.profile_path}.{kind}"
+            self.profiler.enable()
+
+    def finish_worker(self) -> Dict[str, Any]:
+        if self.profiler is not None:
+            self.profiler.disable()
+            self.profiler.dump_stats(self.profile_path)
+        self._elapsed = time.perf_counter() - self._start
+        return self.report()
+
+    def add_worker(self, kind: str, report: Dict[str, Any]) -> None:
+        self.workers.append({'kind': kind, **report})
+
+    def report(self) -> Dict[str, Any]:
+        phases = {phase: round(seconds * 1000, 3) for phase, seconds in
+                  sorted(self.timer.totals.items(), key=lambda item: -item[1])}
+        phases['other'] = round(max(0.0, self._elapsed - sum(self.timer.totals.values())) * 1000, 3)
+        report = {
+            'total_ms': round(self._elapsed * 1000, 3),
+            'phases_ms': phases,
+            'calls': dict(self.timer.calls),
+        }
+        if self.peak_bytes is not None:
+            report['peak_memory_kb'] = round(self.peak_bytes / 1024, 1)
+        else:
+            report['peak_rss_kb'] = peak_rss_kb()
+        if self.workers:
+            report['workers'] = self.workers
+        if self.profile_path:
+            report['profile'] = self.profile_path
+        return report
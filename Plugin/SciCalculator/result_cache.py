@@ -0,0 +1,192 @@
+"""
+SciCalculator 的磁盘结果缓存 (SQLite，LRU + 过期淘汰)。
+
+只依赖标准库，这样缓存命中时完全不需要导入 sympy/scipy。
+缓存键基于表达式 AST 的规范化形式，因此空格、多余括号、`^`/`**`
+等书写差异不会导致重复计算。
+"""
+import ast
+import json
+import os
+import sqlite3
+import time
+from typing import Any, Dict, Optional
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'result_cache.sqlite3')
+# 缓存键的版本号：计算逻辑或结果格式变化时递增，旧版本写入的条目不会再被命中
+CACHE_KEY_VERSION = 2
+
+
+def _env_number(name: str, default: float) -> float:
+    try:
+        return float(os.environ.get(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def canonical_expression(expr_str: str) -> str:
+    """把表达式字符串规范化为 AST dump；无法解析时退回去除空白后的原文。"""
+    text = str(expr_str).replace('^', '**').strip()
+    try:
+        return ast.dump(ast.parse(text, mode='eval').body)
+    except SyntaxError:
+        return ''.join(text.split())
+
+
+def canonical_scalar(value: Any) -> Any:
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, (int, float)):
+        return repr(float(value))
+    if isinstance(value, str):
+        stripped = value.strip().lower()
+        if stripped in ('inf', '-inf', 'infinity', '-infinity'):
+            return stripped.replace('infinity', 'inf')
+        return canonical_expression(value)
+    if value is None:
+        return None
+    if isinstance(value, dict):
+        return sorted([str(key), canonical_scalar(item)] for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return [canonical_scalar(item) for item in value]
+    if hasattr(value, 'tolist'): # numpy 数组/标量
+        return canonical_scalar(value.tolist())
+    return repr(value)
+
+
+def _cache_key(*parts: Any) -> str:
+    return json.dumps([CACHE_KEY_VERSION, *parts])
+
+
+def integral_cache_key(expr_str: str, var_name: str, lower: Any, upper: Any) -> str:
+    return _cache_key('integral', canonical_expression(expr_str), var_name.strip(),
+                      canonical_scalar(lower), canonical_scalar(upper))
+
+
+def solver_cache_key(kind: str, expr_str: str, var_name: str, lower: Any, upper: Any) -> str:
+    return _cache_key(kind, canonical_expression(expr_str), var_name.strip(),
+                      canonical_scalar(lower), canonical_scalar(upper))
+
+
+def multi_integral_cache_key(expr_str: str, specs: Any) -> str:
+    ranges = [[str(name).strip(), canonical_scalar(lower), canonical_scalar(upper)] for name, lower, upper in specs]
+    return _cache_key('multi_integral', canonical_expression(expr_str), ranges)
+
+
+def error_propagation_cache_key(expr_str: str, vars_errors: Dict[str, Any], correlations: Any = None) -> str:
+    values = sorted((str(name), canonical_scalar(val_err)) for name, val_err in vars_errors.items())
+    corr = sorted((str(key), canonical_scalar(value)) for key, value in (correlations or {}).items())
+    return _cache_key('error_propagation', canonical_expression(expr_str), values, corr)
+
+
+def monte_carlo_cache_key(expr_str: str, vars_spec: Dict[str, Any], options: Dict[str, Any]) -> str:
+    spec = sorted((str(name), canonical_scalar(value)) for name, value in vars_spec.items())
+    opts = sorted((str(key), canonical_scalar(value)) for key, value in options.items())
+    return _cache_key('error_propagation_mc', canonical_expression(expr_str), spec, opts)
+
+
+class ResultCache:
+    """
+    大小受限的持久化 LRU 缓存。任何 SQLite 错误都只会让缓存失效，
+    永远不会影响计算本身。
+    """
+
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, max_entries: int = 2000,
+                 max_bytes: int = 16 * 1024 * 1024, max_age_seconds: float = 30 * 86400,
+                 enabled: bool = True):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self.enabled = enabled
+        self._conn: Optional[sqlite3.Connection] = None
+
+    @classmethod
+    def from_env(cls) -> 'ResultCache':
+        return cls(
+            path=os.environ.get('SCICALC_CACHE_PATH') or DEFAULT_CACHE_PATH,
+            max_entries=int(_env_number('SCICALC_CACHE_MAX_ENTRIES', 2000)),
+            max_bytes=int(_env_number('SCICALC_CACHE_MAX_MB', 16) * 1024 * 1024),
+            max_age_seconds=_env_number('SCICALC_CACHE_MAX_AGE_DAYS', 30) * 86400,
+            enabled=os.environ.get('SCICALC_CACHE', 'true').strip().lower() not in ('false', '0', 'off', 'no'),
+        )
+
+    def _connect(self) -> Optional[sqlite3.Connection]:
+        if not self.enabled:
+            return None
+        if self._conn is None:
+            try:
+                conn = sqlite3.connect(self.path, timeout=5)
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS results ("
+                    " key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL,"
+                    " created_at REAL NOT NULL, last_access REAL NOT NULL)"
+                )
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_results_last_access ON results(last_access)")
+                conn.commit()
+                self._conn = conn
+            except sqlite3.Error:
+                self.enabled = False
+                return None
+        return self._conn
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        conn = self._connect()
+        if conn is None:
+            return None
+        try:
+            row = conn.execute("SELECT value, created_at FROM results WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            now = time.time()
+            if self.max_age_seconds > 0 and now - row[1] > self.max_age_seconds:
+                conn.execute("DELETE FROM results WHERE key = ?", (key,))
+                conn.commit()
+                return None
+            conn.execute("UPDATE results SET last_access = ? WHERE key = ?", (now, key))
+            conn.commit()
+            return json.loads(row[0])
+        except (sqlite3.Error, ValueError):
+            return None
+
+    def put(self, key: str, entry: Dict[str, Any]) -> None:
+        conn = self._connect()
+        if conn is None:
+            return
+        try:
+            payload = json.dumps(entry)
+            now = time.time()
+            conn.execute(
+                "INSERT OR REPLACE INTO results (key, value, size, created_at, last_access) VALUES (?, ?, ?, ?, ?)",
+                (key, payload, len(payload) + len(key), now, now),
+            )
+            self._evict(conn, now)
+            conn.commit()
+        except (sqlite3.Error, TypeError, ValueError):
+            pass
+
+    def _evict(self, conn: sqlite3.Connection, now: float) -> None:
+        if self.max_age_seconds > 0:
+            conn.execute("DELETE FROM results WHERE created_at < ?", (now - self.max_age_seconds,))
+        count, total = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM results").fetchone()
+        if count <= self.max_entries and total <= self.max_bytes:
+            return
+        # 按最近访问时间从旧到新淘汰，直到满足条目数与总字节数限制
+        to_delete = []
+        for key, size in conn.execute("SELECT key, size FROM results ORDER BY last_access ASC"):
+            if count <= self.max_entries and total <= self.max_bytes:
+                break
+            to_delete.append((key,))
+            count -= 1
+            total -= size
+        conn.executemany("DELETE FROM results WHERE key = ?", to_delete)
+
+    def clear(self) -> None:
+        conn = self._connect()
+        if conn is None:
+            return
+        try:
+            conn.execute("DELETE FROM results")
+            conn.commit()
+        except sqlite3.Error:
+            pass
@@ -0,0 +1,402 @@
+"""
+SciCalculator 的 numpy 统计引擎。
+
+数据不必再以列表字面量写进表达式：可以是 base64 打包的浮点数组、
+数据目录下的 `.npy` (内存映射) / CSV (mmap 分块解析) 文件，或分块流式输入。
+均值/方差等矩统计按块合并 (Welford/Chan 在线算法)，不需要一次性持有全部数据；
+中位数、分位数、相关系数等需要完整数据的统计才会物化数组。
+
+小数据 (不超过 EXACT_STATS_MAX_SIZE 个值) 仍交给 `statistics` 模块计算，
+保证与原有的列表函数结果完全一致。
+"""
+import base64
+import binascii
+import io
+import math
+import mmap
+import os
+import statistics
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+PLUGIN_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_DATA_DIR = os.path.join(PLUGIN_DIR, 'data')
+
+EXACT_STATS_MAX_SIZE = 10_000
+STREAM_CHUNK_SIZE = 1 << 16
+CSV_CHUNK_BYTES = 1 << 22
+MAX_MATERIALIZED_SIZE = 50_000_000
+BASE64_DTYPES = {'float64': '<f8', 'float32': '<f4', 'int64': '<i8', 'int32': '<i4'}
+CORRELATION_METHODS = ('pearson', 'spearman', 'kendall')
+
+
+def data_dir() -> str:
+    return os.path.realpath(os.environ.get('SCICALC_DATA_DIR') or DEFAULT_DATA_DIR)
+
+
+def resolve_data_path(path: str) -> str:
+    """相对路径相对于 SCICALC_DATA_DIR 解析；不允许访问该目录之外的文件。"""
+    root = data_dir()
+    full_path = os.path.realpath(os.path.join(root, os.path.expanduser(str(path))))
+    if os.path.commonpath([root, full_path]) != root:
+        raise ValueError(f"Data file '{path}' is outside the data directory (SCICALC_DATA_DIR).")
+    if not os.path.isfile(full_path):
+        raise ValueError(f"Data file '{path}' not found in the data directory.")
+    return full_path
+
+
+class OnlineMoments:
+    """按块合并的计数/均值/二阶中心矩 (Chan 等人的并行 Welford 算法) 以及最值。"""
+
+    __slots__ = ('count', 'mean', 'm2', 'minimum', 'maximum')
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.minimum = math.inf
+        self.maximum = -math.inf
+
+    def update(self, chunk: Any) -> None:
+        chunk = np.asarray(chunk, dtype=float).ravel()
+        n = chunk.size
+        if n == 0:
+            return
+        chunk_mean = float(chunk.mean())
+        chunk_m2 = float(np.square(chunk - chunk_mean).sum())
+        total = self.count + n
+        delta = chunk_mean - self.mean
+        self.mean += delta * n / total
+        self.m2 += chunk_m2 + delta * delta * self.count * n / total
+        self.count = total
+        self.minimum = min(self.minimum, float(chunk.min()))
+        self.maximum = max(self.maximum, float(chunk.max()))
+
+    def variance(self) -> float:
+        if self.count < 2:
+            raise ValueError("variance requires at least two data points")
+        return self.m2 / (self.count - 1)
+
+
+class Dataset:
+    """
+    一维数值数据源。`chunks()` 逐块产出 float64 数组 (矩统计只走这条路径)，
+    `to_array()` 在需要完整数据时物化 (`.npy` 文件直接返回内存映射)。
+    """
+
+    def __init__(self, chunk_source: Callable[[], Iterator[Any]], label: str,
+                 array: Any = None, size: Optional[int] = None):
+        self._chunk_source = chunk_source
+        self.label = label
+        self._array = array
+        self._size = size
+        self._moments: Optional[OnlineMoments] = None
+
+    def __repr__(self) -> str:
+        return f"Dataset({self.label})"
+
+    @classmethod
+    def from_array(cls, values: Any, label: str = 'array') -> 'Dataset':
+        try:
+            arr = np.asarray(values, dtype=float).ravel()
+        except (TypeError, ValueError):
+            raise ValueError("Data must contain only numbers.")
+
+        def chunks() -> Iterator[Any]:
+            for start in range(0, arr.size, STREAM_CHUNK_SIZE):
+                yield arr[start:start + STREAM_CHUNK_SIZE]
+        return cls(chunks, label, array=arr, size=arr.size)
+
+    @classmethod
+    def from_base64(cls, text: str, dtype: str = 'float64') -> 'Dataset':
+        return cls.from_array(decode_base64_array(text, dtype), label=f'base64 {dtype}')
+
+    @classmethod
+    def from_base64_chunks(cls, texts: List[str], dtype: str = 'float64') -> 'Dataset':
+        """分块流式输入：每块在被消费时才解码，矩统计不会同时持有所有块。"""
+        if not isinstance(texts, (list, tuple)) or not all(isinstance(t, str) for t in texts):
+            raise ValueError("Streaming data chunks must be a list of base64 strings.")
+        for text in texts:
+            _check_base64_size(text, dtype)
+
+        def chunks() -> Iterator[Any]:
+            for text in texts:
+                yield decode_base64_array(text, dtype)
+        return cls(chunks, label=f'{len(texts)} base64 chunks')
+
+    @classmethod
+    def from_file(cls, path: str, column: Any = None) -> 'Dataset':
+        full_path = resolve_data_path(path)
+        if full_path.lower().endswith('.npy'):
+            arr = np.load(full_path, mmap_mode='r', allow_pickle=False)
+            if arr.ndim == 2:
+                arr = arr[:, _column_index(column, None, arr.shape[1])]
+            elif arr.ndim != 1 or column not in (None, 0):
+                raise ValueError(f"'{path}' must hold a 1-D array or a 2-D table with a column index.")
+
+            def npy_chunks() -> Iterator[Any]:
+                for start in range(0, arr.shape[0], STREAM_CHUNK_SIZE):
+                    yield np.asarray(arr[start:start + STREAM_CHUNK_SIZE], dtype=float)
+            return cls(npy_chunks, label=os.path.basename(full_path), array=arr, size=arr.shape[0])
+
+        delimiter, skip_header, column_index = _inspect_csv(full_path, column)
+        return cls(lambda: _csv_chunks(full_path, delimiter, skip_header, column_index),
+                   label=os.path.basename(full_path))
+
+    def chunks(self) -> Iterator[Any]:
+        return self._chunk_source()
+
+    def to_array(self) -> Any:
+        if self._array is None:
+            parts, total = [], 0
+            for chunk in self.chunks():
+                total += chunk.size
+                if total > MAX_MATERIALIZED_SIZE:
+                    raise ValueError(f"Data too large to load ({total}+ values); only mean/variance/stdev/"
+                                     f"histogram stream over it.")
+                parts.append(chunk)
+            self._array = np.concatenate(parts) if parts else np.empty(0)
+            self._size = self._array.size
+        return self._array
+
+    def moments(self) -> OnlineMoments:
+        if self._moments is None:
+            moments = OnlineMoments()
+            for chunk in self.chunks():
+                moments.update(chunk)
+            self._moments = moments
+            self._size = moments.count
+        return self._moments
+
+    def __len__(self) -> int:
+        if self._size is None:
+            self.moments()
+        return self._size
+
+
+def _check_base64_size(text: str, dtype: str) -> None:
+    if dtype not in BASE64_DTYPES:
+        raise ValueError(f"Unsupported dtype '{dtype}', use one of: {', '.join(BASE64_DTYPES)}.")
+    itemsize = np.dtype(BASE64_DTYPES[dtype]).itemsize
+    raw_size = len(text.strip()) * 3 // 4 - text.strip().count('=')
+    if raw_size % itemsize:
+        raise ValueError(f"Base64 data length is not a multiple of the {dtype} item size ({itemsize} bytes).")
+
+
+def decode_base64_array(text: str, dtype: str = 'float64') -> Any:
+    """把 base64 字符串解码为 float64 数组 (小端序字节)。"""
+    _check_base64_size(text, dtype)
+    try:
+        raw = base64.b64decode(text.strip(), validate=True)
+    except (binascii.Error, ValueError) as e:
+        raise ValueError(f"Invalid base64 data: {e}")
+    return np.frombuffer(raw, dtype=BASE64_DTYPES[dtype]).astype(float)
+
+
+def _column_index(column: Any, header: Optional[List[str]], width: int) -> int:
+    if column is None:
+        return 0
+    if isinstance(column, str):
+        if header is None or column not in header:
+            raise ValueError(f"Column '{column}' not found" + (f" (columns: {', '.join(header)})." if header else " (file has no header row)."))
+        return header.index(column)
+    if not isinstance(column, int) or not -width <= column < width:
+        raise ValueError(f"Column index {column} is out of range for {width} columns.")
+    return column % width
+
+
+def _split_fields(line: str, delimiter: Optional[str]) -> List[str]:
+    return [field.strip() for field in (line.split(delimiter) if delimiter else line.split())]
+
+
+def _inspect_csv(path: str, column: Any) -> Tuple[Optional[str], int, int]:
+    """根据第一行推断分隔符、是否有表头以及要读取的列。"""
+    with open(path, 'r', encoding='utf-8', errors='replace') as fh:
+        first_line = ''
+        for line in fh:
+            if line.strip() and not line.lstrip().startswith('#'):
+                first_line = line.strip()
+                break
+    if not first_line:
+        raise ValueError(f"Data file '{os.path.basename(path)}' is empty.")
+    delimiter = next((d for d in (',', '\t', ';') if d in first_line), None)
+    fields = _split_fields(first_line, delimiter)
+    try:
+        [float(field) for field in fields]
+        header = None
+    except ValueError:
+        header = fields
+    return delimiter, 1 if header else 0, _column_index(column, header, len(fields))
+
+
+def _csv_chunks(path: str, delimiter: Optional[str], skip_header: int, column_index: int) -> Iterator[Any]:
+    """通过 mmap 按行边界切块，每块交给 numpy 解析，内存占用与文件大小无关。"""
+    with open(path, 'rb') as fh:
+        if os.fstat(fh.fileno()).st_size == 0:
+            return
+        with mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            position, length = 0, len(mm)
+            first = True
+            while position < length:
+                end = mm.find(b'\n', min(position + CSV_CHUNK_BYTES, length))
+                end = length if end == -1 else end + 1
+                block = mm[position:end]
+                position = end
+                try:
+                    values = np.loadtxt(io.BytesIO(block), delimiter=delimiter, usecols=(column_index,),
+                                        skiprows=skip_header if first else 0, ndmin=1, dtype=float, comments='#')
+                except ValueError as e:
+                    raise ValueError(f"Invalid numeric data in '{os.path.basename(path)}': {e}")
+                first = False
+                if values.size:
+                    yield values
+
+
+def as_dataset(value: Any) -> Dataset:
+    if isinstance(value, Dataset):
+        return value
+    if isinstance(value, (list, tuple, np.ndarray)):
+        return Dataset.from_array(value)
+    raise ValueError(f"Expected a data list or dataset, got {type(value).__name__}.")
+
+
+def dataset_from_spec(spec: Any) -> Dataset:
+    """
+    输入 JSON 中 `data` 字段的每一项: 数字列表、base64 字符串，或
+    {"base64": ..., "dtype": ...} / {"chunks": [...], "dtype": ...} / {"path": ..., "column": ...}。
+    """
+    if isinstance(spec, str):
+        return Dataset.from_base64(spec)
+    if isinstance(spec, list):
+        return Dataset.from_array(spec)
+    if isinstance(spec, dict):
+        dtype = spec.get('dtype', 'float64')
+        if 'base64' in spec:
+            return Dataset.from_base64(spec['base64'], dtype)
+        if 'chunks' in spec:
+            return Dataset.from_base64_chunks(spec['chunks'], dtype)
+        if 'path' in spec:
+            return Dataset.from_file(spec['path'], spec.get('column'))
+    raise ValueError("Each data entry must be a number list, a base64 string, or an object with "
+                     "'base64', 'chunks' or 'path'.")
+
+
+def _exact_values(data: Dataset) -> Optional[List[float]]:
+    """小数据返回 Python 列表，交给 statistics 模块以保持与原函数完全一致的结果。"""
+    if data._array is not None and data._array.size <= EXACT_STATS_MAX_SIZE:
+        return data._array.tolist()
+    if data._array is None and len(data) <= EXACT_STATS_MAX_SIZE:
+        return data.to_array().tolist()
+    return None
+
+
+def mean(data: Dataset) -> float:
+    values = _exact_values(data)
+    if values is not None:
+        return statistics.mean(values)
+    moments = data.moments()
+    if moments.count == 0:
+        raise ValueError("mean requires at least one data point")
+    return moments.mean
+
+
+def variance(data: Dataset) -> float:
+    values = _exact_values(data)
+    if values is not None:
+        return statistics.variance(values)
+    return data.moments().variance()
+
+
+def stdev(data: Dataset) -> float:
+    values = _exact_values(data)
+    if values is not None:
+        return statistics.stdev(values)
+    return math.sqrt(data.moments().variance())
+
+
+def median(data: Dataset) -> float:
+    values = _exact_values(data)
+    if values is not None:
+        return statistics.median(values)
+    arr = data.to_array()
+    if arr.size == 0:
+        raise ValueError("no median for empty data")
+    return float(np.median(arr))
+
+
+def mode(data: Dataset) -> float:
+    values = _exact_values(data)
+    if values is not None:
+        return statistics.mode(values)
+    arr = data.to_array()
+    if arr.size == 0:
+        raise ValueError("no mode for empty data")
+    # 与 statistics.mode 一致：出现次数相同时取最先出现的值
+    uniques, first_index, counts = np.unique(arr, return_index=True, return_counts=True)
+    candidates = np.flatnonzero(counts == counts.max())
+    return float(uniques[candidates[np.argmin(first_index[candidates])]])
+
+
+def t_test(data: Dataset, mu: float) -> float:
+    from scipy import stats as scipy_stats
+    values = _exact_values(data)
+    if values is not None:
+        return scipy_stats.ttest_1samp(values, mu).pvalue
+    moments = data.moments()
+    t_stat = (moments.mean - mu) / math.sqrt(moments.variance() / moments.count)
+    return float(2 * scipy_stats.t.sf(abs(t_stat), moments.count - 1))
+
+
+def percentile(data: Dataset, q: Any) -> Any:
+    arr = data.to_array()
+    if arr.size == 0:
+        raise ValueError("percentile requires at least one data point")
+    q_arr = np.asarray(q, dtype=float)
+    if np.any((q_arr < 0) | (q_arr > 100)):
+        raise ValueError("Percentiles must be between 0 and 100.")
+    result = np.percentile(arr, q_arr)
+    return result.tolist() if q_arr.ndim else float(result)
+
+
+def histogram(data: Dataset, bins: int = 10, low: Optional[float] = None,
+              high: Optional[float] = None) -> Dict[str, List[float]]:
+    """固定区间的分块直方图；未给出区间时先用一次流式扫描求最值。"""
+    if not isinstance(bins, int) or not 1 <= bins <= 10_000:
+        raise ValueError("histogram bins must be an integer between 1 and 10000.")
+    if low is None or high is None:
+        moments = data.moments()
+        if moments.count == 0:
+            raise ValueError("histogram requires at least one data point")
+        low = moments.minimum if low is None else low
+        high = moments.maximum if high is None else high
+    if not (math.isfinite(low) and math.isfinite(high)):
+        raise ValueError("histogram range must be finite.")
+    if low == high:
+        low, high = low - 0.5, high + 0.5
+    if low > high:
+        raise ValueError("histogram lower bound must not exceed the upper bound.")
+    edges = np.linspace(low, high, bins + 1)
+    counts = np.zeros(bins, dtype=np.int64)
+    for chunk in data.chunks():
+        counts += np.histogram(chunk, bins=edges)[0]
+    return {'counts': counts.tolist(), 'edges': edges.tolist()}
+
+
+def correlation(x: Dataset, y: Dataset, method: str = 'pearson') -> float:
+    method = str(method).strip().lower()
+    if method not in CORRELATION_METHODS:
+        raise ValueError(f"Unknown correlation method '{method}', use one of: {', '.join(CORRELATION_METHODS)}.")
+    x_arr, y_arr = np.asarray(x.to_array(), dtype=float), np.asarray(y.to_array(), dtype=float)
+    if x_arr.size != y_arr.size:
+        raise ValueError(f"correlation requires data of equal length, got {x_arr.size} and {y_arr.size}.")
+    if x_arr.size < 2:
+        raise ValueError("correlation requires at least two data points")
+    if np.ptp(x_arr) == 0 or np.ptp(y_arr) == 0:
+        raise ValueError("correlation is undefined for constant data (zero variance).")
+    if method == 'pearson':
+        return float(np.corrcoef(x_arr, y_arr)[0, 1])
+    from scipy import stats as scipy_stats
+    if method == 'spearman':
+        return float(scipy_stats.spearmanr(x_arr, y_arr)[0])
+    return float(scipy_stats.kendalltau(x_arr, y_arr)[0])